@@ -11,6 +11,7 @@ from groq import Groq
 from .firebase_config import main_db, main_firestore, kospi_db, kosdaq_db
 from .fetcher import MARKET_TZ
 from .trade_engine import get_latest_price
+from .symbol_index import get_symbol_index
 
 try:
     from duckduckgo_search import DDGS
@@ -166,13 +167,7 @@ class AIBotManager:
         top_symbols = list(self.current_holdings.keys())[:2] # Search for top 2 holdings to avoid too many queries
         for sym in top_symbols:
              # Get name for the symbol
-             name = "Unknown"
-             for m in ['KOSPI', 'KOSDAQ', 'ETF']:
-                target_db = kospi_db if m in ['KOSPI', 'ETF'] else kosdaq_db
-                s_data = target_db.child(f'stocks/{m}/{sym}').get()
-                if s_data:
-                    name = s_data.get('name', 'Unknown')
-                    break
+             name = get_symbol_index().name_of(sym)
              print(f"  -> Fetching news for {name} ({sym})...")
              news = search_news(f"주식 {name} {sym} 최신 호재 악재 뉴스", max_results=3)
              holdings_news += f"\n[{name} ({sym}) 관련 뉴스]\n{news}\n"
@@ -333,14 +328,7 @@ class AIBotManager:
             return False
 
         # Get official Name
-        name = "Unknown"
-        # Check in RTDB for name
-        for m in ['KOSPI', 'KOSDAQ', 'ETF']:
-            target_db = kospi_db if m in ['KOSPI', 'ETF'] else kosdaq_db
-            s_data = target_db.child(f'stocks/{m}/{symbol}').get()
-            if s_data:
-                name = s_data.get('name', 'Unknown')
-                break
+        name = get_symbol_index().name_of(symbol)
 
         order_id = f"bot_{int(time.time() * 1000)}"
         order_payload = {
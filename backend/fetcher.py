@@ -1,20 +1,22 @@
-import requests
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from typing import List, Dict, Optional
 from .models import Stock
+from .naver_client import get_client
+from .ohlcv_cache import get_ohlcv_cache
 
 MARKET_TZ = ZoneInfo("Asia/Seoul")
+http = get_client()
+ohlcv = get_ohlcv_cache()
 
 def fetch_kr_stocks() -> Dict[str, Stock]:
     """Fetch all KR stocks (KOSPI, KOSDAQ, ETF, ETN) from Naver in one call."""
     snapshot: Dict[str, Stock] = {}
-    headers = {"User-Agent": "Mozilla/5.0"}
 
     # No sosok field and large pageSize to fetch everything
     url = "https://m.stock.naver.com/api/json/sise/siseListJson.nhn?menu=market_sum&pageSize=5000&page=1"
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = http.get(url, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             items = data.get('result', {}).get('itemList', [])
@@ -51,7 +53,7 @@ def fetch_exchange_rate() -> float:
     """Fetch USD/KRW exchange rate from Naver."""
     try:
         url = "https://api.stock.naver.com/marketindex/majors/part1"
-        resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=5)
+        resp = http.get(url, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             for item in data.get('majors', []):
@@ -63,18 +65,16 @@ def fetch_exchange_rate() -> float:
 def fetch_indices() -> Dict[str, Dict]:
     """Fetch major market indices."""
     results = {}
-    headers = {"User-Agent": "Mozilla/5.0"}
     index_map = {
         'KOSPI': 'https://m.stock.naver.com/api/index/KOSPI/price',
         'KOSDAQ': 'https://m.stock.naver.com/api/index/KOSDAQ/price',
         'S&P 500': 'https://api.stock.naver.com/index/.INX/basic',
         'Nasdaq': 'https://api.stock.naver.com/index/.IXIC/basic'
     }
-    for name, url in index_map.items():
+    responses = http.get_many(index_map.values(), timeout=5)
+    for (name, url), data in zip(index_map.items(), responses):
         try:
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.status_code == 200:
-                data = resp.json()
+            if data is not None:
                 if 'price' in url:
                     if isinstance(data, list) and data:
                         d = data[0]
@@ -101,24 +101,56 @@ def fetch_indices() -> Dict[str, Dict]:
     return snapshot
 
 def fetch_stock_chart(symbol: str, page_size: int = 60, page: int = 1) -> List[List]:
+    """
+    Recent daily candles, latest first: [Date(YYYY-MM-DD), Open, High, Low, Close, Volume].
+    Served from the shared OHLCV cache when it is fresh and deep enough; otherwise
+    only the days newer than the cached range are fetched from Naver and appended.
+    """
+    if page != 1:
+        return _fetch_chart_pages(symbol, page_size, page)
+
+    cached = ohlcv.get(symbol)
+    if len(cached) >= page_size and ohlcv.is_fresh(symbol):
+        return [list(c) for c in reversed(cached[-page_size:])]
+
+    # Top up: page back until we overlap the cached range (however far that
+    # is) and have at least page_size candles
+    stop_at = cached[-1][0] if cached else None
+    fetched = _fetch_chart_pages(symbol, page_size, 1, stop_at=stop_at)
+
+    if not fetched:
+        # Naver failed: stale candles beat no chart
+        return [list(c) for c in reversed(cached[-page_size:])]
+
+    # Never store a hole: if paging stopped short of the cached range, start over
+    ohlcv.put(symbol, [tuple(row) for row in fetched], replace=bool(stop_at) and fetched[-1][0] > stop_at)
+    return [list(c) for c in reversed(ohlcv.get(symbol)[-page_size:])]
+
+# Upper bound on pages per chart fetch (60 candles each, ~10 years)
+MAX_CHART_PAGES = 40
+
+def _fetch_chart_pages(symbol: str, page_size: int = 60, page: int = 1, stop_at: Optional[str] = None) -> List[List]:
     """
     Fetch historical stock data from Naver and compress it into an array format.
     Handles larger page_size by fetching multiple pages (API limit is approx 60).
+    With stop_at (YYYY-MM-DD), keeps paging past page_size until that date is
+    reached, so a top-up always joins the cached range.
     Format: [Date(YYYY-MM-DD), Open, High, Low, Close, Volume]
     """
-    headers = {"User-Agent": "Mozilla/5.0"}
     all_data = []
     
-    # If page_size is large, we need to fetch multiple pages of up to 60 each
+    # If page_size is large, we need to fetch multiple pages of up to 60 each.
+    # The page size stays fixed so page numbers map to contiguous offsets.
     current_page = page
     remaining_size = page_size
     MAX_API_PAGE_SIZE = 60
+    fetch_size = MAX_API_PAGE_SIZE if stop_at else min(page_size, MAX_API_PAGE_SIZE)
+    reached = False
 
-    while remaining_size > 0:
-        fetch_size = min(remaining_size, MAX_API_PAGE_SIZE)
+    while (remaining_size > 0 or (stop_at and not reached)) and current_page - page < MAX_CHART_PAGES:
         url = f"https://m.stock.naver.com/api/stock/{symbol}/price?pageSize={fetch_size}&page={current_page}"
         try:
-            resp = requests.get(url, headers=headers, timeout=10)
+            resp = http.get(url, timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 if not isinstance(data, list) or not data:
@@ -155,6 +187,7 @@ def fetch_stock_chart(symbol: str, page_size: int = 60, page: int = 1) -> List[L
                     break # No more data available
                 
                 remaining_size -= len(data)
+                reached = bool(stop_at) and all_data[-1][0] <= stop_at  # overlaps data we already have
                 current_page += 1
             else:
                 break
@@ -56,50 +56,60 @@ ranking_db = db.reference(app=ranking_app)
 # Firestore (Main only usually)
 main_firestore = firestore.client(app=main_app)
 
+def build_ranking_entry(uid: str):
+    """
+    Builds the ranking_cache/{uid} entry (user summary + long positions) from Firestore.
+    Returns None if the user does not exist.
+    """
+    user_ref = main_firestore.collection('users').document(uid)
+    user_snap = user_ref.get()
+    if not user_snap.exists:
+        return None
+
+    user_data = user_snap.to_dict()
+    
+    # 1. Fetch Portfolio
+    portfolio_ref = user_ref.collection('portfolio')
+    portfolio_docs = portfolio_ref.stream()
+    
+    portfolio_items = {}
+    for doc in portfolio_docs:
+        data = doc.to_dict()
+        symbol = doc.id
+        qty = float(data.get('quantity', 0))
+        if qty > 0:
+            portfolio_items[symbol] = {
+                'symbol': symbol,
+                'quantity': qty,
+                'averagePrice': float(data.get('averagePrice', 0))
+            }
+
+    # 2. Prepare Sync Payload
+    import time
+    now_ms = int(time.time() * 1000)
+    
+    return {
+        'uid': uid,
+        'displayName': user_data.get('displayName', 'Anonymous'),
+        'photoURL': user_data.get('photoURL', ''),
+        'balance': float(user_data.get('balance', 0)),
+        'startingBalance': float(user_data.get('startingBalance', user_data.get('starting_balance', 300_000_000))),
+        'portfolio': portfolio_items,
+        'updatedAt': now_ms,
+        'lastSync': now_ms
+    }
+
 def sync_user_to_rtdb(uid: str):
     """
     Syncs essential user data and portfolio from Firestore to RTDB.
     This serves as a cache for the leaderboard to avoid scanning Firestore.
+    Synchronous; daemons should prefer ranking_sync.enqueue_* on hot paths.
     """
     try:
-        user_ref = main_firestore.collection('users').document(uid)
-        user_snap = user_ref.get()
-        if not user_snap.exists:
+        sync_payload = build_ranking_entry(uid)
+        if sync_payload is None:
             return
 
-        user_data = user_snap.to_dict()
-        
-        # 1. Fetch Portfolio
-        portfolio_ref = user_ref.collection('portfolio')
-        portfolio_docs = portfolio_ref.stream()
-        
-        portfolio_items = {}
-        for doc in portfolio_docs:
-            data = doc.to_dict()
-            symbol = doc.id
-            qty = float(data.get('quantity', 0))
-            if qty > 0:
-                portfolio_items[symbol] = {
-                    'symbol': symbol,
-                    'quantity': qty,
-                    'averagePrice': float(data.get('averagePrice', 0))
-                }
-
-        # 2. Prepare Sync Payload
-        import time
-        now_ms = int(time.time() * 1000)
-        
-        sync_payload = {
-            'uid': uid,
-            'displayName': user_data.get('displayName', 'Anonymous'),
-            'photoURL': user_data.get('photoURL', ''),
-            'balance': float(user_data.get('balance', 0)),
-            'startingBalance': float(user_data.get('startingBalance', user_data.get('starting_balance', 300_000_000))),
-            'portfolio': portfolio_items,
-            'updatedAt': now_ms,
-            'lastSync': now_ms
-        }
-
         # 3. Update RTDB Cache
         # We store it in ranking_cache/uid
         ranking_db.child('ranking_cache').child(uid).set(sync_payload)
@@ -0,0 +1,33 @@
+from firebase_admin import firestore
+
+from .firebase_config import main_firestore
+
+# Same document the data engine reads (data_engine/holdings_index.py):
+# symbol -> number of users with a non-zero position. Every backend path that
+# opens or closes a position bumps it inside its own transaction.
+HOLDINGS_COLLECTION = "system"
+HOLDINGS_DOCUMENT = "held_symbols"
+
+
+def holdings_ref():
+    return main_firestore.collection(HOLDINGS_COLLECTION).document(HOLDINGS_DOCUMENT)
+
+
+def holder_delta(old_qty: float, new_qty: float) -> int:
+    """+1 when a position opens, -1 when it closes, 0 otherwise."""
+    if old_qty == 0 and new_qty != 0:
+        return 1
+    if old_qty != 0 and new_qty == 0:
+        return -1
+    return 0
+
+
+def record_position_change(transaction, symbol: str, old_qty: float, new_qty: float):
+    """Queue the holder-count update on the caller's transaction (write only, no read)."""
+    delta = holder_delta(old_qty, new_qty)
+    if delta == 0:
+        return
+    transaction.set(holdings_ref(), {
+        "counts": {symbol: firestore.Increment(delta)},
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
@@ -1,26 +1,40 @@
+import json
 import schedule
 import time
+import numpy as np
 from datetime import datetime
-from .firebase_config import main_db, main_firestore, kospi_db, kosdaq_db, ranking_db
+from .firebase_config import main_db, main_firestore, ranking_db
+from .price_cache import get_price_cache
 from .fetcher import MARKET_TZ
 from .price_updater import is_kr_market_open
+from .equity_engine import PositionBookBuilder, compute_equity, mean_yield_by_symbol
+
+# users/{uid}/live_stats last written by this process, to skip unchanged users
+last_live_stats: dict[str, dict] = {}
+LIVE_STATS_MAX_PAYLOAD_BYTES = 256 * 1024
+
+def write_live_stats(stats_by_uid: dict[str, dict], calculated_at: str) -> int:
+    """
+    Writes changed users' live_stats as multi-location updates on users/,
+    chunked by payload size. Returns the number of users written.
+    """
+    changed = {uid: stats for uid, stats in stats_by_uid.items() if last_live_stats.get(uid) != stats}
+    chunk, chunk_bytes = {}, 0
+    for uid, stats in changed.items():
+        entry = {**stats, 'lastCalculatedAt': calculated_at}
+        chunk[f'{uid}/live_stats'] = entry
+        chunk_bytes += len(uid) + len(json.dumps(entry))
+        if chunk_bytes >= LIVE_STATS_MAX_PAYLOAD_BYTES:
+            ranking_db.child('users').update(chunk)
+            chunk, chunk_bytes = {}, 0
+    if chunk:
+        ranking_db.child('users').update(chunk)
+    last_live_stats.update(changed)
+    return len(changed)
 
 def get_all_prices():
-    """Fetch all prices from KOSPI/KOSDAQ RTDBs to use as a local cache."""
-    prices = {}
-    
-    # 1. KOSPI project (KOSPI + ETF)
-    # The structure is now: stocks/KOSPI/{symbol} and stocks/ETF/{symbol}
-    kp_raw = kospi_db.child('stocks').get() or {}
-    for market in ['KOSPI', 'ETF']:
-        prices.update(kp_raw.get(market, {}))
-    
-    # 2. KOSDAQ project (KOSDAQ)
-    # The structure is now: stocks/KOSDAQ/{symbol}
-    kd_raw = kosdaq_db.child('stocks').get() or {}
-    prices.update(kd_raw.get('KOSDAQ', {}))
-    
-    return prices
+    """All KOSPI/KOSDAQ quotes from the in-process price cache (no RTDB reads)."""
+    return get_price_cache().snapshot()
 
 def leaderboard_update_job():
     print(f"[{datetime.now(MARKET_TZ)}] Calculating Leaderboard (Zero-Read Optimization)...")
@@ -32,85 +46,80 @@ def leaderboard_update_job():
     try:
         ranking_cache = ranking_db.child('ranking_cache').get() or {}
         
-        rankings = []
-        stock_yield_agg = {} # {symbol: {'sum_yield': 0, 'count': 0, 'name': ''}}
-        
-        total_equity_sum = 0
-        total_yield_sum = 0
-        total_players = 0
-        
+        # 3. Load every cached position into arrays and value them in one pass
+        builder = PositionBookBuilder()
+        cash = []
         for uid, user_data in ranking_cache.items():
-            total_players += 1
-            
-            # 3. Calculate Portfolio Value
-            portfolio_value = 0
-            stock_count = 0
-            portfolio = user_data.get('portfolio', {})
-            
-            for symbol, p_data in portfolio.items():
-                qty = float(p_data.get('quantity', 0))
-                avg_price = float(p_data.get('averagePrice', 0))
-                
-                live_price = float(all_prices.get(symbol, {}).get('price', avg_price))
-                portfolio_value += (qty * live_price)
-                if qty > 0: 
-                    stock_count += 1
-                    if symbol and avg_price > 0:
-                        item_yield = ((live_price / avg_price) - 1) * 100
-                        if symbol not in stock_yield_agg:
-                            stock_yield_agg[symbol] = {
-                                'sum_yield': 0, 'count': 0,
-                                'name': all_prices.get(symbol, {}).get('name', symbol)
-                            }
-                        stock_yield_agg[symbol]['sum_yield'] += item_yield
-                        stock_yield_agg[symbol]['count'] += 1
-
-            # 4. Use cached data
-            cash = float(user_data.get('balance', 0))
-            display_name = user_data.get('displayName', 'Anonymous')
-            photo_url = user_data.get('photoURL', '')
-            starting_balance = float(user_data.get('startingBalance', 300000000.0))
-            
-            total_equity = cash + portfolio_value
-            yield_percent = ((total_equity - starting_balance) / starting_balance) * 100 if starting_balance > 0 else 0
-            
-            total_equity_sum += total_equity
-            total_yield_sum += yield_percent
-            
-            user_rank_data = {
+            builder.add_user(uid)
+            cash.append(float(user_data.get('balance', 0)))
+            for symbol, p_data in (user_data.get('portfolio') or {}).items():
+                builder.add_position(uid, symbol, float(p_data.get('quantity', 0)), float(p_data.get('averagePrice', 0)))
+        book = builder.build()
+
+        symbol_prices = book.prices_by_symbol({
+            symbol: float(all_prices[symbol]['price'])
+            for symbol in book.symbols
+            if isinstance(all_prices.get(symbol), dict) and 'price' in all_prices[symbol]
+        })
+        position_prices = book.position_prices(symbol_prices)
+        # Fall back to the cost basis when there is no live price
+        position_prices = np.where(np.isnan(position_prices), book.avg_price, position_prices)
+        result = compute_equity(book, position_prices, cash)
+
+        starting_balances = np.array([
+            float(user_data.get('startingBalance', 300000000.0)) for user_data in ranking_cache.values()
+        ], dtype=np.float64)
+        yields = np.divide(result.equity - starting_balances, starting_balances,
+                           out=np.zeros(book.n_users), where=starting_balances > 0) * 100
+
+        total_players = book.n_users
+        total_equity_sum = float(result.equity.sum())
+        total_yield_sum = float(yields.sum())
+        calculated_at = datetime.now(MARKET_TZ).isoformat()
+
+        rankings = []
+        live_stats = {}
+        for row, (uid, user_data) in enumerate(ranking_cache.items()):
+            total_equity = float(result.equity[row])
+            portfolio_value = float(result.stock_value[row])
+            yield_percent = float(yields[row])
+            rankings.append({
                 'uid': uid,
-                'displayName': display_name,
-                'photoURL': photo_url,
+                'displayName': user_data.get('displayName', 'Anonymous'),
+                'photoURL': user_data.get('photoURL', ''),
                 'equity': round(total_equity, 2),
                 'yield': round(yield_percent, 2),
-                'cash': round(cash, 2),
+                'cash': round(cash[row], 2),
                 'stockValue': round(portfolio_value, 2)
-            }
-            rankings.append(user_rank_data)
+            })
             
-            # Update RTDB live stats for Frontend instead of Firestore update
-            ranking_db.child(f'users/{uid}/live_stats').update({
+            # RTDB live stats for Frontend instead of Firestore update
+            live_stats[uid] = {
                 'totalStockValue': round(portfolio_value, 2),
                 'totalEquity': round(total_equity, 2),
                 'pnlRate': round(yield_percent, 2),
-                'stockCount': stock_count,
-                'lastCalculatedAt': datetime.now(MARKET_TZ).isoformat()
-            })
+                'stockCount': int(result.long_count[row])
+            }
+
+        # One fan-out write for every player whose stats moved
+        written = write_live_stats(live_stats, calculated_at)
+        print(f"  -> live_stats updated for {written}/{total_players} players.")
             
-        # 4. Sort by Equity descending
-        rankings.sort(key=lambda x: x['equity'], reverse=True)
-        
-        # 5. Add Rank
-        for i, item in enumerate(rankings):
-            item['rank'] = i + 1
+        # 4. Sort by Equity descending and add rank
+        order = result.order().tolist()
+        rankings = [rankings[row] for row in order]
+        for item, row in zip(rankings, order):
+            item['rank'] = int(result.rank[row])
             
         # 6. Process Top/Worst Stocks by Yield
+        mean_yields, holders = mean_yield_by_symbol(book, position_prices)
         held_stock_yield_list = []
-        for symbol, agg in stock_yield_agg.items():
-            avg_yield = agg['sum_yield'] / agg['count'] if agg['count'] > 0 else 0
+        for symbol, avg_yield, count in zip(book.symbols, mean_yields.tolist(), holders.tolist()):
+            if not symbol or count == 0:
+                continue
             held_stock_yield_list.append({
                 'symbol': symbol,
-                'name': agg['name'],
+                'name': all_prices.get(symbol, {}).get('name', symbol),
                 'yield': round(avg_yield, 2)
             })
         
@@ -143,6 +152,8 @@ def leaderboard_update_job():
 
 def run_manager():
     print("Season 3 Leaderboard Manager started.")
+    if not get_price_cache().wait_ready():
+        print("Price cache not ready yet; serving reads from RTDB until it is.")
     
     # Initial run
     leaderboard_update_job()
@@ -179,8 +190,9 @@ def run_manager():
     trigger_ref.listen(on_trigger_change)
     print("Leaderboard Immediate Trigger Listener active.")
 
-    # Check for schedule change every 60 minutes (instead of 5, as we have a listener)
-    schedule.every(60).minutes.do(setup_schedule)
+    # Check for schedule change every minute; it is a calendar lookup, and
+    # picks up opens and closes (holidays, early closes) on time
+    schedule.every(1).minutes.do(setup_schedule)
     
     while True:
         schedule.run_pending()
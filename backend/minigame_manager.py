@@ -1,10 +1,17 @@
 import time
 import random
+import threading
+from collections import deque
 from datetime import datetime
+from typing import Dict, List, Optional
 from firebase_admin import firestore
-from .firebase_config import main_db, main_firestore, kospi_db, kosdaq_db, sync_user_to_rtdb
+from .firebase_config import main_db, main_firestore
+from .ranking_sync import get_ranking_sync
 from .fetcher import fetch_stock_chart, MARKET_TZ
 from .supabase_client import get_supabase
+from .price_cache import get_price_cache
+from .symbol_index import get_symbol_index
+from .holdings_index import record_position_change
 
 # Reward Table
 REWARDS = {
@@ -14,6 +21,12 @@ REWARDS = {
     3: 500000,  # 3rd win
 }
 
+# Round generation
+ROUND_WINDOW = 40          # candles shown to the user
+MIN_ROUND_HISTORY = 45     # candles required to build a round
+ROUND_POOL_SIZE = 20       # ready rounds kept in memory
+CANDIDATE_REFRESH_SEC = 600
+
 def get_reward(wins: int, failed: bool = False) -> int:
     """Calculates reward based on win count and failure state."""
     if not failed:
@@ -32,31 +45,107 @@ def get_reward(wins: int, failed: bool = False) -> int:
         secured = 500000 + (wins - 3) * 100000
         return secured - 50000
 
+def get_top_stock_candidates() -> List[Dict]:
+    """All KOSPI/KOSDAQ stocks (excluding ETF) usable for a minigame round."""
+    return [
+        dict(quote, symbol=symbol)
+        for symbol, quote in get_price_cache().snapshot().items()
+        if quote['market'] in ('KOSPI', 'KOSDAQ')
+    ]
+
 def get_random_top_stock():
     """Fetches a random stock from KOSPI or KOSDAQ (excluding ETF)."""
-    valid_stocks = []
-    
-    # 1. Fetch KOSPI
-    kp_data = kospi_db.child('stocks/KOSPI').get()
-    if kp_data:
-        for symbol, stock_data in kp_data.items():
-            if isinstance(stock_data, dict) and 'name' in stock_data:
-                stock_data['symbol'] = symbol
-                valid_stocks.append(stock_data)
-        
-    # 2. Fetch KOSDAQ
-    kq_data = kosdaq_db.child('stocks/KOSDAQ').get()
-    if kq_data:
-        for symbol, stock_data in kq_data.items():
-            if isinstance(stock_data, dict) and 'name' in stock_data:
-                stock_data['symbol'] = symbol
-                valid_stocks.append(stock_data)
-        
+    valid_stocks = get_top_stock_candidates()
     if not valid_stocks:
         return None
         
     random.shuffle(valid_stocks)
     return valid_stocks[0]
+
+def build_round(stock: Dict, history: Optional[List[List]]) -> Optional[Dict]:
+    """Pick a random 40-candle window plus the following answer candle from a chart."""
+    if not history or len(history) < MIN_ROUND_HISTORY:
+        return None
+    candles = list(reversed(history))  # oldest first
+    max_start = len(candles) - (ROUND_WINDOW + 1)
+    start_idx = random.randint(0, max_start)
+    return {
+        'symbol': stock['symbol'],
+        'name': stock['name'],
+        'window': candles[start_idx : start_idx + ROUND_WINDOW],
+        'answer': candles[start_idx + ROUND_WINDOW],  # The 41st candle
+    }
+
+class RoundPool:
+    """
+    Keeps a queue of ready-made rounds, built on a background thread from
+    (cached) chart history, so starting a game or a new round is a pop
+    instead of a live chart fetch.
+    """
+
+    def __init__(self, size: int = ROUND_POOL_SIZE):
+        self.size = size
+        self._rounds = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._candidates: List[Dict] = []
+        self._candidates_at = 0.0
+
+    def start(self):
+        threading.Thread(target=self._run, name='minigame-round-pool', daemon=True).start()
+
+    def pop(self) -> Optional[Dict]:
+        with self._lock:
+            round_data = self._rounds.popleft() if self._rounds else None
+        self._wake.set()
+        return round_data
+
+    def _random_candidate(self) -> Optional[Dict]:
+        if not self._candidates or time.monotonic() - self._candidates_at > CANDIDATE_REFRESH_SEC:
+            self._candidates = get_top_stock_candidates()
+            self._candidates_at = time.monotonic()
+        return random.choice(self._candidates) if self._candidates else None
+
+    def _fill(self):
+        attempts = 0
+        while len(self._rounds) < self.size and attempts < self.size * 3:
+            attempts += 1
+            stock = self._random_candidate()
+            if not stock:
+                return
+            round_data = build_round(stock, fetch_stock_chart(stock['symbol'], page_size=120, page=1))
+            if round_data:
+                with self._lock:
+                    self._rounds.append(round_data)
+
+    def _run(self):
+        while True:
+            try:
+                self._fill()
+            except Exception as e:
+                print(f"  !! Minigame round pool refill failed: {e}")
+            self._wake.wait(timeout=30)
+            self._wake.clear()
+
+round_pool = RoundPool()
+
+def next_round() -> Optional[Dict]:
+    """A ready round from the pool, or one built on the spot if the pool is empty."""
+    round_data = round_pool.pop()
+    if round_data:
+        return round_data
+
+    # Pool drained: fall back to a live fetch with retries
+    for i in range(3):
+        stock = get_random_top_stock()
+        if not stock:
+            return None
+        round_data = build_round(stock, fetch_stock_chart(stock['symbol'], page_size=120, page=1))
+        if round_data:
+            return round_data
+        print(f"  !! Retry {i+1} building minigame round")
+    return None
+
 def start_game(uid: str):
     """Initializes a new mini-game session."""
     print(f"  -> Starting Mini-game for {uid}")
@@ -96,45 +185,19 @@ def start_game(uid: str):
         })
         return
 
-    # 2. Pick a random stock
-    stock = get_random_top_stock()
-    if not stock:
-        main_db.child(f'user_activities/{uid}/minigameRequest').update({
-            'status': 'FAILED',
-            'errorMessage': '종목 데이터를 불러오지 못했습니다.'
-        })
-        return
-    
-    # 3. Fetch Historical Data (120 sessions) with retries
-    max_retries = 3
-    history = None
-    target_stock = stock
-    
-    for i in range(max_retries):
-        history = fetch_stock_chart(target_stock['symbol'], page_size=120, page=1)
-        if history and len(history) >= 45:
-            break
-        print(f"  !! Retry {i+1} for starting game ({uid})")
-        target_stock = get_random_top_stock()
-        if not target_stock: break
-
-    if not history or len(history) < 45:
+    # 2-4. Take a prepared round (random stock, 40-candle window + answer candle)
+    round_data = next_round()
+    if not round_data:
         main_db.child(f'user_activities/{uid}/minigameRequest').update({
             'status': 'FAILED',
             'errorMessage': '충분한 차트 데이터를 확보하지 못했습니다. 다시 시도해 주세요.'
         })
         return
 
-    symbol = target_stock['symbol']
-    name = target_stock['name']
-
-    # 4. Select Window
-    history.reverse()
-    
-    max_start = len(history) - 41
-    start_idx = random.randint(0, max_start)
-    window_data = history[start_idx : start_idx + 40]
-    answer_candle = history[start_idx + 40] # The 41st candle
+    symbol = round_data['symbol']
+    name = round_data['name']
+    window_data = round_data['window']
+    answer_candle = round_data['answer']
     
     # Calculate direction: 1 for UP, -1 for DOWN, 0 for FLAT
     direction = 1 if answer_candle[4] > answer_candle[1] else -1
@@ -215,19 +278,8 @@ def handle_guess(uid: str, guess_data: dict):
 
 def prepare_next_round(uid: str, wins: int, secured: int):
     """Pick a new stock and window for the next round."""
-    # Try up to 3 times to get a valid stock with history
-    max_retries = 3
-    history = None
-    target_stock = get_random_top_stock() # Fix: use get_random_top_stock() instead of undefined stock
-
-    for i in range(max_retries):
-        history = fetch_stock_chart(target_stock['symbol'], page_size=120, page=1)
-        if history and len(history) >= 45:
-            break
-        print(f"  !! Retry {i+1} for next round ({uid})")
-        target_stock = get_random_top_stock()
-
-    if not history or len(history) < 45:
+    round_data = next_round()
+    if not round_data:
         print(f"  !! Failed to fetch history for next round after retries ({uid})")
         main_db.child(f'user_activities/{uid}/minigameData').update({
             'status': 'FINISHED',
@@ -235,20 +287,16 @@ def prepare_next_round(uid: str, wins: int, secured: int):
         })
         return
 
-    history.reverse()
-    
-    max_start = len(history) - 41
-    start_idx = random.randint(0, max_start)
-    window_data = history[start_idx : start_idx + 40]
-    answer_candle = history[start_idx + 40]
+    window_data = round_data['window']
+    answer_candle = round_data['answer']
     direction = 1 if answer_candle[4] > answer_candle[1] else -1
     
     main_db.child(f'user_activities/{uid}/minigameData').update({
         'window': window_data,
         'answer': {
             'direction': direction,
-            'symbol': target_stock['symbol'],
-            'name': target_stock['name'],
+            'symbol': round_data['symbol'],
+            'name': round_data['name'],
             'date': answer_candle[0],
             'details': answer_candle
         },
@@ -257,7 +305,7 @@ def prepare_next_round(uid: str, wins: int, secured: int):
         'status': 'ACTIVE',
         'lastRoundResult': None # Clear result for new round
     })
-    print(f"  -> {uid} Round {wins+1} Started with {target_stock['name']}.")
+    print(f"  -> {uid} Round {wins+1} Started with {round_data['name']}.")
 
 def handle_next_round_request(uid: str):
     """Processes user clicking 'Next Round'."""
@@ -342,7 +390,7 @@ def finalize_game(uid: str, wins: int, reward: int, success: bool, answer: dict
         print(f"  !! Failed to log minigame reward to Supabase for {uid}: {e}")
     
     # Sync to RTDB Cache
-    sync_user_to_rtdb(uid)
+    get_ranking_sync().enqueue_full(uid)
 
     # 2. Update RTDB status for Frontend
     session_ref = main_db.child(f'user_activities/{uid}/minigameData')
@@ -360,43 +408,17 @@ def finalize_game(uid: str, wins: int, reward: int, success: bool, answer: dict
     session_ref.update(update_pkg)
 
 def get_all_prices():
-    """Fetch all prices from KOSPI/KOSDAQ RTDBs to use as a local cache."""
-    prices = {}
-    kp_raw = kospi_db.child('stocks').get() or {}
-    for market in ['KOSPI', 'ETF']:
-        prices.update(kp_raw.get(market, {}))
-    kd_raw = kosdaq_db.child('stocks').get() or {}
-    prices.update(kd_raw.get('KOSDAQ', {}))
-    return prices
+    """All KOSPI/KOSDAQ quotes from the in-process price cache."""
+    return get_price_cache().snapshot()
 
 def get_random_luckybox_stock():
     """Fetches a random stock for Lucky Box with price >= 50,000 KRW, weighted by price."""
     valid_stocks = []
-    prices = get_all_prices()
-    
-    # 1. Fetch KOSPI
-    kp_data = kospi_db.child('stocks/KOSPI').get()
-    if kp_data:
-        for symbol, stock_data in kp_data.items():
-            if isinstance(stock_data, dict) and 'name' in stock_data:
-                stock_info = prices.get(symbol, {})
-                price = float(stock_info.get('price', stock_data.get('price', 0)))
-                if price >= 50000:
-                    stock_data['symbol'] = symbol
-                    stock_data['current_price'] = price
-                    valid_stocks.append(stock_data)
-        
-    # 2. Fetch KOSDAQ
-    kq_data = kosdaq_db.child('stocks/KOSDAQ').get()
-    if kq_data:
-        for symbol, stock_data in kq_data.items():
-            if isinstance(stock_data, dict) and 'name' in stock_data:
-                stock_info = prices.get(symbol, {})
-                price = float(stock_info.get('price', stock_data.get('price', 0)))
-                if price >= 50000:
-                    stock_data['symbol'] = symbol
-                    stock_data['current_price'] = price
-                    valid_stocks.append(stock_data)
+    for stock_data in get_top_stock_candidates():
+        price = float(stock_data.get('price', 0))
+        if price >= 50000:
+            stock_data['current_price'] = price
+            valid_stocks.append(stock_data)
 
     if not valid_stocks:
         # Fallback if somehow no stocks match
@@ -456,7 +478,7 @@ def handle_luckybox_request(uid: str):
             # Extract market if available
             market = selected.get('market', '')
             if not market:
-                market = 'KOSPI' if symbol in kospi_db.child('stocks/KOSPI').get(shallow=True) or [] else 'KOSDAQ'
+                market = get_symbol_index().market_of(symbol) or 'KOSDAQ'
             
             # --- 2. All Writes ---
             # 2a. Deduct points
@@ -478,6 +500,7 @@ def handle_luckybox_request(uid: str):
                     'market': market,
                     'updatedAt': firestore.SERVER_TIMESTAMP
                 })
+                record_position_change(transaction, symbol, old_qty, new_qty)
             else:
                 transaction.set(stock_doc_ref, {
                     'symbol': symbol,
@@ -487,6 +510,7 @@ def handle_luckybox_request(uid: str):
                     'market': market,
                     'updatedAt': firestore.SERVER_TIMESTAMP
                 })
+                record_position_change(transaction, symbol, 0, 1)
 
             return True, selected
 
@@ -534,7 +558,7 @@ def handle_luckybox_request(uid: str):
             print(f"  !! Failed to log LUCKY_BOX to Supabase for {uid}: {e}")
 
         # Sync to RTDB Cache
-        sync_user_to_rtdb(uid)
+        get_ranking_sync().enqueue_full(uid)
 
     except Exception as e:
         print(f"Error processing Lucky Box: {e}")
@@ -542,6 +566,11 @@ def handle_luckybox_request(uid: str):
 
 def start_manager():
     print("Season 3 Mini-game Manager Daemon Started.")
+    if not get_price_cache().wait_ready():
+        print("Price cache not ready yet; serving reads from RTDB until it is.")
+
+    # Pre-build rounds off the request path
+    round_pool.start()
     
     def on_request(event):
         if event.data is None: return
@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# Max in-flight requests per host. Naver starts returning 429/empty bodies
+# when hammered, so keep these conservative.
+HOST_CONCURRENCY = {
+    'm.stock.naver.com': 8,
+    'api.stock.naver.com': 8,
+    'polling.finance.naver.com': 4,
+    'ac.stock.naver.com': 4,
+}
+DEFAULT_HOST_CONCURRENCY = 4
+POOL_SIZE = 16
+
+# Sustained requests/sec per host, shared by every fetch path. Bursts of up
+# to one second's worth are allowed.
+HOST_RATE = {
+    'm.stock.naver.com': 20.0,
+    'api.stock.naver.com': 20.0,
+    'polling.finance.naver.com': 10.0,
+    'ac.stock.naver.com': 10.0,
+}
+DEFAULT_HOST_RATE = 10.0
+
+# Adaptive slowdown: a throttled response (429/5xx, including ones urllib3
+# already retried) halves the host's rate, down to MIN_RATE_FACTOR of its
+# configured rate; every clean response wins back RECOVERY_STEP of it.
+SLOWDOWN_STATUSES = frozenset([429, 500, 502, 503, 504])
+SLOWDOWN_FACTOR = 0.5
+MIN_RATE_FACTOR = 0.125
+RECOVERY_STEP = 0.05
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() reserves a token and sleeps until it
+    is due, so concurrent callers are spaced out at exactly `rate` per second
+    instead of each sleeping a fixed interval.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, adaptive: bool = True):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.adaptive = adaptive
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def slow_down(self):
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate * SLOWDOWN_FACTOR, self.base_rate * MIN_RATE_FACTOR)
+
+    def recover(self):
+        if not self.adaptive or self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.rate + self.base_rate * RECOVERY_STEP, self.base_rate)
+
+
+def _was_throttled(resp: requests.Response) -> bool:
+    if resp.status_code in SLOWDOWN_STATUSES:
+        return True
+    retries = getattr(resp.raw, 'retries', None)
+    return any(h.status in SLOWDOWN_STATUSES for h in getattr(retries, 'history', ()) or ())
+
+
+class NaverClient:
+    """
+    Shared HTTP client for Naver quote endpoints.
+    Keeps one keep-alive session (connection pool) per host, bounds concurrent
+    requests per host, paces them through a per-host token bucket that slows
+    down on 429/5xx, and retries those with exponential backoff.
+    """
+
+    def __init__(self, max_workers: int = 16, retries: int = 2, backoff: float = 0.3):
+        self._sessions: Dict[str, requests.Session] = {}
+        self._limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='naver')
+
+    def _host_state(self, host: str):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(DEFAULT_HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=self._retry)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+                self._limits[host] = threading.BoundedSemaphore(
+                    HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+                )
+                self._buckets[host] = TokenBucket(HOST_RATE.get(host, DEFAULT_HOST_RATE))
+            return session, self._limits[host], self._buckets[host]
+
+    def get(self, url: str, timeout: float = 5, **kwargs) -> requests.Response:
+        """Drop-in replacement for requests.get over the pooled session."""
+        session, limit, bucket = self._host_state(urlsplit(url).netloc)
+        # Take the token before the slot so waiting callers do not hold connections
+        bucket.acquire()
+        with limit:
+            resp = session.get(url, timeout=timeout, **kwargs)
+        if _was_throttled(resp):
+            bucket.slow_down()
+        else:
+            bucket.recover()
+        return resp
+
+    def get_json_status(self, url: str, timeout: float = 5) -> Tuple[Optional[int], Optional[Any]]:
+        """
+        GET and decode JSON, keeping the status code so callers can tell a
+        definite 404 from a timeout or 429. Returns (None, None) when the
+        request itself failed and (status, None) on non-200 or a bad body.
+        """
+        try:
+            resp = self.get(url, timeout=timeout)
+        except Exception:
+            return None, None
+        if resp.status_code != 200:
+            return resp.status_code, None
+        try:
+            return resp.status_code, resp.json()
+        except Exception:
+            return resp.status_code, None
+
+    def get_json(self, url: str, timeout: float = 5) -> Optional[Any]:
+        """GET and decode JSON. Returns None on non-200 or any error."""
+        return self.get_json_status(url, timeout)[1]
+
+    def get_many(self, urls: Iterable[str], timeout: float = 5) -> List[Optional[Any]]:
+        """Fetch many URLs concurrently. Results keep the input order (None on failure)."""
+        return list(self._executor.map(lambda u: self.get_json(u, timeout), list(urls)))
+
+    def get_many_status(self, urls: Iterable[str], timeout: float = 5) -> List[Tuple[Optional[int], Optional[Any]]]:
+        """get_many, returning (status, data) pairs as get_json_status does."""
+        return list(self._executor.map(lambda u: self.get_json_status(u, timeout), list(urls)))
+
+    async def aget_json(self, url: str, timeout: float = 5) -> Optional[Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get_json, url, timeout)
+
+    async def aget_many(self, urls: Iterable[str], timeout: float = 5) -> List[Optional[Any]]:
+        """asyncio flavour of get_many for callers that already run an event loop."""
+        return await asyncio.gather(*(self.aget_json(u, timeout) for u in urls))
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._limits.clear()
+            self._buckets.clear()
+
+
+client = NaverClient()
+
+def get_client() -> NaverClient:
+    return client
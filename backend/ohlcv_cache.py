@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+# (date 'YYYY-MM-DD', open, high, low, close, volume), oldest first
+Candle = Tuple[str, float, float, float, float, float]
+
+# One SQLite file can be shared by every process on the host (chart gateway,
+# minigame, data engine history job) by pointing OHLCV_CACHE_PATH at it.
+CACHE_PATH = os.getenv(
+    'OHLCV_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), 'ohlcv_cache.sqlite3')
+)
+
+# A symbol fetched within this many seconds is served without asking Naver.
+FRESH_SECONDS = int(os.getenv('OHLCV_FRESH_SECONDS', '600'))
+MEMORY_SYMBOLS = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    symbol TEXT NOT NULL,
+    date TEXT NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, volume REAL,
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fetch_log (
+    symbol TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class OhlcvCache:
+    """
+    On-disk daily candle store (SQLite, WAL) with an LRU of recently used
+    symbols in memory. Candles are upserted by (symbol, date), so refreshes
+    only need to append the newest days. LRU entries carry the fetch_log
+    stamp they were read under and are dropped once another process has
+    refreshed the symbol.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, memory_symbols: int = MEMORY_SYMBOLS):
+        self.path = path
+        self.memory_symbols = memory_symbols
+        self._local = threading.local()
+        # symbol -> (fetch_log.fetched_at when read, candles)
+        self._lru: "OrderedDict[str, Tuple[Optional[float], List[Candle]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        try:
+            conn = self._conn()
+            conn.executescript(_SCHEMA)
+            conn.commit()
+        except Exception as e:
+            print(f"Error initializing OHLCV cache ({self.path}): {e}")
+
+    def _fetched_at(self, symbol: str) -> Optional[float]:
+        row = self._conn().execute("SELECT fetched_at FROM fetch_log WHERE symbol = ?", (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, symbol: str) -> List[Candle]:
+        """All cached candles for symbol, oldest first."""
+        try:
+            # Stamp first: a refresh landing in between only costs a re-read later
+            fetched_at = self._fetched_at(symbol)
+            with self._lock:
+                entry = self._lru.get(symbol)
+                if entry is not None and entry[0] == fetched_at:
+                    self._lru.move_to_end(symbol)
+                    return entry[1]
+            rows = self._conn().execute(
+                "SELECT date, open, high, low, close, volume FROM candles WHERE symbol = ? ORDER BY date",
+                (symbol,)
+            ).fetchall()
+        except Exception as e:
+            print(f"Error reading OHLCV cache for {symbol}: {e}")
+            return []
+        candles = [tuple(row) for row in rows]
+        self._remember(symbol, fetched_at, candles)
+        return candles
+
+    def latest_date(self, symbol: str) -> Optional[str]:
+        candles = self.get(symbol)
+        return candles[-1][0] if candles else None
+
+    def is_fresh(self, symbol: str, max_age: float = FRESH_SECONDS) -> bool:
+        try:
+            fetched_at = self._fetched_at(symbol)
+        except Exception:
+            return False
+        return fetched_at is not None and (time.time() - fetched_at) < max_age
+
+    def put(self, symbol: str, candles: Iterable[Candle], replace: bool = False):
+        """
+        Upsert candles and mark the symbol as just fetched. Callers must pass
+        candles that reach back to the cached range; otherwise use replace=True
+        to drop the old candles instead of leaving a gap between the two.
+        """
+        rows = [(symbol, *candle) for candle in candles if candle and candle[0]]
+        try:
+            conn = self._conn()
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM candles WHERE symbol = ?", (symbol,))
+                if rows:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO candles (symbol, date, open, high, low, close, volume) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                conn.execute("INSERT OR REPLACE INTO fetch_log (symbol, fetched_at) VALUES (?, ?)",
+                             (symbol, time.time()))
+        except Exception as e:
+            print(f"Error writing OHLCV cache for {symbol}: {e}")
+        with self._lock:
+            self._lru.pop(symbol, None)
+
+    def _remember(self, symbol: str, fetched_at: Optional[float], candles: List[Candle]):
+        with self._lock:
+            self._lru[symbol] = (fetched_at, candles)
+            self._lru.move_to_end(symbol)
+            while len(self._lru) > self.memory_symbols:
+                self._lru.popitem(last=False)
+
+
+ohlcv_cache = OhlcvCache()
+
+def get_ohlcv_cache() -> OhlcvCache:
+    return ohlcv_cache
@@ -0,0 +1,237 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .price_cache import get_price_cache
+
+OrderKey = Tuple[str, str]  # (uid, order_id) under orders/
+
+# Fallback pass over every indexed symbol, for orders that were deferred
+# (market closed, stale price, limit protection) while their price stood still.
+SWEEP_INTERVAL_SEC = 60
+
+
+class _SymbolOrders:
+    """Pending orders on one symbol."""
+
+    def __init__(self):
+        self.buys: List[Tuple[float, int, OrderKey]] = []   # LIMIT BUY max-heap (-target, seq, key)
+        self.sells: List[Tuple[float, int, OrderKey]] = []  # LIMIT SELL min-heap (target, seq, key)
+        self.waiting: Dict[OrderKey, int] = {}              # MARKET orders: key -> seq
+
+    def __bool__(self):
+        return bool(self.buys or self.sells or self.waiting)
+
+
+class PendingOrderIndex:
+    """
+    Pending RTDB orders (orders/{uid}/{orderId}) indexed by symbol, fed by the
+    existing orders listen() stream. LIMIT orders sit in price-ordered heaps
+    so only the ones a new price crosses are handed out; MARKET orders are
+    handed out on every tick of their symbol until they leave PENDING.
+    """
+
+    def __init__(self):
+        self._orders: Dict[OrderKey, Tuple[int, Dict]] = {}  # key -> (seq, order data)
+        self._symbols: Dict[str, _SymbolOrders] = {}
+        self._claimed: Set[OrderKey] = set()
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # --- stream handling ---
+
+    def apply_event(self, event) -> Set[str]:
+        """Apply an orders/ stream event. Returns the symbols that gained pending orders."""
+        path = event.path.strip('/')
+        parts = path.split('/') if path else []
+        data = event.data
+        patch = event.event_type == 'patch'
+        touched: Set[str] = set()
+
+        with self._lock:
+            if not parts:
+                if not patch:
+                    for key in list(self._orders):
+                        self._remove(key)
+                for uid, user_orders in (data or {}).items():
+                    self._replace_user(uid, user_orders, touched, patch)
+            elif len(parts) == 1:
+                self._replace_user(parts[0], data, touched, patch)
+            elif len(parts) == 2:
+                key = (parts[0], parts[1])
+                if patch:
+                    data = self._merged(key, data or {})
+                self._upsert(key, data, touched)
+            else:
+                # Single field write (e.g. orders/uid/oid/status)
+                key = (parts[0], parts[1])
+                self._upsert(key, self._merged(key, {parts[2]: data}), touched)
+        return touched
+
+    def _replace_user(self, uid: str, user_orders: Any, touched: Set[str], patch: bool):
+        if not patch:
+            for key in [k for k in self._orders if k[0] == uid]:
+                self._remove(key)
+        if isinstance(user_orders, dict):
+            for order_id, order_data in user_orders.items():
+                key = (uid, order_id)
+                if patch and isinstance(order_data, dict):
+                    order_data = {**(self._orders.get(key, (0, {}))[1]), **order_data}
+                self._upsert(key, order_data, touched)
+
+    def _merged(self, key: OrderKey, fields: Dict) -> Optional[Dict]:
+        current = self._orders.get(key)
+        if current is None:
+            # Only a partial view of an order we do not track (e.g. a status update)
+            return fields if fields.get('symbol') else None
+        return {**current[1], **fields}
+
+    def _upsert(self, key: OrderKey, data: Any, touched: Set[str]):
+        pending = isinstance(data, dict) and data.get('status') == 'PENDING' and data.get('symbol')
+        if not pending:
+            self._remove(key)
+            self._claimed.discard(key)
+            return
+        if key in self._claimed:
+            return
+        self._add(key, data)
+        touched.add(data['symbol'])
+
+    def _add(self, key: OrderKey, data: Dict):
+        self._remove(key)
+        seq = next(self._seq)
+        self._orders[key] = (seq, data)
+        book = self._symbols.setdefault(data['symbol'], _SymbolOrders())
+        target = data.get('targetPrice') or data.get('price')
+        if data.get('orderType') == 'LIMIT' and target is not None:
+            if data.get('type') == 'BUY':
+                heapq.heappush(book.buys, (-float(target), seq, key))
+                return
+            if data.get('type') == 'SELL':
+                heapq.heappush(book.sells, (float(target), seq, key))
+                return
+        book.waiting[key] = seq
+
+    def _remove(self, key: OrderKey):
+        current = self._orders.pop(key, None)
+        if current is not None:
+            book = self._symbols.get(current[1]['symbol'])
+            if book is not None:
+                book.waiting.pop(key, None)  # heap entries go stale and are skipped
+
+    def _live(self, heap: List[Tuple[float, int, OrderKey]]) -> Optional[Tuple[float, OrderKey]]:
+        while heap:
+            target, seq, key = heap[0]
+            current = self._orders.get(key)
+            if current is not None and current[0] == seq:
+                return target, key
+            heapq.heappop(heap)
+        return None
+
+    # --- matching ---
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return [symbol for symbol, book in self._symbols.items() if book]
+
+    def take(self, symbol: str, price: Optional[float]) -> List[Tuple[OrderKey, Dict]]:
+        """
+        Claim the orders on symbol that price could execute: LIMIT BUY with
+        target >= price, LIMIT SELL with target <= price, and every MARKET order.
+        With no price, everything is handed out so the engine can fail it.
+        """
+        taken: List[Tuple[OrderKey, Dict]] = []
+        with self._lock:
+            book = self._symbols.get(symbol)
+            if not book:
+                return taken
+
+            top = self._live(book.buys)
+            while top is not None and (price is None or price <= -top[0]):
+                heapq.heappop(book.buys)
+                taken.append(self._claim(top[1]))
+                top = self._live(book.buys)
+
+            top = self._live(book.sells)
+            while top is not None and (price is None or price >= top[0]):
+                heapq.heappop(book.sells)
+                taken.append(self._claim(top[1]))
+                top = self._live(book.sells)
+
+            for key in list(book.waiting):
+                taken.append(self._claim(key))
+
+            if not book:
+                del self._symbols[symbol]
+        return taken
+
+    def _claim(self, key: OrderKey) -> Tuple[OrderKey, Dict]:
+        _, data = self._orders[key]
+        self._remove(key)
+        self._claimed.add(key)
+        return key, data
+
+    def release(self, key: OrderKey, data: Dict, still_pending: bool):
+        """Return a claimed order: back into the index if the engine left it PENDING."""
+        with self._lock:
+            self._claimed.discard(key)
+            if still_pending:
+                self._add(key, data)
+
+
+class OrderMatcher:
+    """
+    Runs order execution on one worker thread. New orders and price changes
+    (from the price cache stream) mark symbols dirty; the worker evaluates
+    only those symbols, plus a periodic sweep for deferred orders.
+    """
+
+    def __init__(self, process: Callable[[str, str, Dict], bool], sweep_interval: float = SWEEP_INTERVAL_SEC):
+        self.process = process
+        self.sweep_interval = sweep_interval
+        self.index = PendingOrderIndex()
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def on_order_event(self, event):
+        self.mark_dirty(self.index.apply_event(event))
+
+    def mark_dirty(self, symbols: Set[str]):
+        if not symbols:
+            return
+        with self._lock:
+            self._dirty.update(symbols)
+        self._wake.set()
+
+    def run(self):
+        prices = get_price_cache()
+        prices.subscribe(self.mark_dirty)
+        last_sweep = time.monotonic()
+        while True:
+            self._wake.wait(timeout=max(0.0, last_sweep + self.sweep_interval - time.monotonic()))
+            self._wake.clear()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            # Price ticks keep waking the worker during market hours, so the
+            # sweep is due by elapsed time, not by an idle wait timing out.
+            now = time.monotonic()
+            if now - last_sweep >= self.sweep_interval:
+                dirty |= set(self.index.symbols())
+                last_sweep = now
+            for symbol in dirty:
+                try:
+                    self._match(symbol, prices.get(symbol))
+                except Exception as e:
+                    print(f"Order matching error on {symbol}: {e}")
+
+    def _match(self, symbol: str, quote: Optional[Dict]):
+        price = quote['price'] if quote and quote['price'] > 0 else None
+        for (uid, order_id), data in self.index.take(symbol, price):
+            still_pending = True
+            try:
+                still_pending = not self.process(uid, order_id, data)
+            finally:
+                self.index.release((uid, order_id), data, still_pending)
@@ -5,39 +5,19 @@ import urllib.parse
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from firebase_admin import firestore
-from .firebase_config import main_db, main_firestore, kospi_db, kosdaq_db, ranking_db, sync_user_to_rtdb
+from .firebase_config import main_db, main_firestore, ranking_db
+from .ranking_sync import get_ranking_sync
+from .price_cache import get_price_cache
 from .email_utils import EmailManager
 from .supabase_client import get_supabase
+from .holdings_index import record_position_change
 
 MARKET_TZ = ZoneInfo("Asia/Seoul")
 MAX_TICKERS = 50
 
 def get_all_prices():
-    """Fetch all prices from KOSPI/KOSDAQ RTDBs to use as a local cache."""
-    prices = {}
-    kp_raw = kospi_db.child('stocks').get() or {}
-    
-    # Process KOSPI Project (KOSPI, ETF, ETN)
-    for market in ['KOSPI', 'ETF', 'ETN']:
-        market_data = kp_raw.get(market, {})
-        for symbol, data in market_data.items():
-            prices[symbol] = {
-                'name': data.get('name', 'Unknown'),
-                'price': data.get('price', 0),
-                'market': market
-            }
-            
-    # Process KOSDAQ Project (KOSDAQ)
-    kd_raw = kosdaq_db.child('stocks').get() or {}
-    market_data = kd_raw.get('KOSDAQ', {})
-    for symbol, data in market_data.items():
-        prices[symbol] = {
-            'name': data.get('name', 'Unknown'),
-            'price': data.get('price', 0),
-            'market': 'KOSDAQ'
-        }
-        
-    return prices
+    """All KOSPI/KOSDAQ/ETF/ETN quotes from the in-process price cache."""
+    return get_price_cache().snapshot()
 
 def process_portfolio_request(uid: str, req: dict):
     print(f"[{datetime.now(MARKET_TZ)}] Processing Portfolio Request from {uid}")
@@ -114,7 +94,7 @@ def process_portfolio_request(uid: str, req: dict):
     print(f"  -> Deducted 10,000 P from {uid}. Fetching portfolio for {target_name} ({target_uid})")
     
     # Sync requester to RTDB Cache for point update
-    sync_user_to_rtdb(uid)
+    get_ranking_sync().enqueue_full(uid)
 
     # 3. Fetch Target User Data & Portfolio & Prices
     target_ref = main_firestore.collection('users').document(target_uid)
@@ -454,6 +434,7 @@ def process_sabotage_request(uid: str, req: dict):
                     transaction.update(tgt_stock_doc, {
                         'quantity': new_qty
                     })
+                record_position_change(transaction, tgt_stock_doc.id, current_qty, max(new_qty, 0))
 
                 # Requester history
                 transaction.update(requester_ref, {
@@ -527,6 +508,7 @@ def process_sabotage_request(uid: str, req: dict):
                             transaction.update(tgt_stock_doc, {
                                 'quantity': new_qty
                             })
+                        record_position_change(transaction, tgt_stock_doc.id, current_qty, max(new_qty, 0))
                 
 
                 donation_amount = min(donation_amount, new_tgt_cash) 
@@ -583,6 +565,7 @@ def process_sabotage_request(uid: str, req: dict):
                         'averagePrice': new_avg,
                         'lastUpdated': firestore.SERVER_TIMESTAMP
                     })
+                    record_position_change(transaction, tgt_stock_doc.id, old_qty, new_qty)
                 else:
                     transaction.set(tgt_stock_doc, {
                         'symbol': selected_penny['symbol'],
@@ -591,6 +574,7 @@ def process_sabotage_request(uid: str, req: dict):
                         'averagePrice': penny_price,
                         'lastUpdated': firestore.SERVER_TIMESTAMP
                     })
+                    record_position_change(transaction, tgt_stock_doc.id, 0, buy_qty)
                     
                 transaction.update(target_ref, {
                     'balance': target_cash - actual_cost
@@ -746,8 +730,8 @@ def process_sabotage_request(uid: str, req: dict):
 
 
     # Sync both parties to RTDB Cache
-    sync_user_to_rtdb(uid)
-    sync_user_to_rtdb(target_uid)
+    get_ranking_sync().enqueue_full(uid)
+    get_ranking_sync().enqueue_full(target_uid)
 
     # Broadcast to Ticker
     try:
@@ -982,6 +966,8 @@ def process_sabotage_request(uid: str, req: dict):
 
 def start_manager():
     print("Season 3 Portfolio Request Manager Started.")
+    if not get_price_cache().wait_ready():
+        print("Price cache not ready yet; serving reads from RTDB until it is.")
     
     def on_request(event):
         if event.data is None: return
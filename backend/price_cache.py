@@ -0,0 +1,249 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .firebase_config import kospi_db, kosdaq_db
+from .symbol_index import get_symbol_index
+
+# Markets mirrored from each price project (stocks/{market}/{symbol})
+KOSPI_MARKETS = ('KOSPI', 'ETF', 'ETN')
+KOSDAQ_MARKETS = ('KOSDAQ',)
+
+READY_TIMEOUT_SEC = 30
+# SSE streams silently stall once their auth token expires; reopen periodically.
+RESTART_INTERVAL_SEC = 4 * 60 * 60
+
+
+def parse_quote(market: str, data: Any) -> Optional[Dict]:
+    """
+    Normalize an RTDB stock entry into {'name', 'price', 'market', 'change_percent'}.
+    Entries without a price give None, so valuations fall back to averagePrice
+    instead of counting the position as worthless.
+    """
+    if not isinstance(data, dict) or data.get('price') is None:
+        return None
+    price = float(data['price'])
+    change_percent = float(data.get('change_percent', 0) or 0)
+
+    # Parse from info string if available (compressed format)
+    info = data.get('info', '')
+    if info:
+        try:
+            parts = info.split('|')
+            if len(parts) >= 2:
+                change_percent = float(parts[1])
+        except (TypeError, ValueError):
+            pass
+    return {
+        'name': data.get('name', 'Unknown'),
+        'price': price,
+        'market': market,
+        'change_percent': change_percent,
+    }
+
+
+class PriceCache:
+    """
+    In-process mirror of the KOSPI/KOSDAQ `stocks` trees.
+
+    One listen() stream per price project keeps a symbol -> quote dict up to
+    date from deltas, so order processing, the leaderboard, portfolio and
+    minigame lookups are dict hits instead of RTDB reads. Quote dicts are
+    replaced, never mutated, so callers may hold on to them.
+    """
+
+    def __init__(self):
+        self._sources: List[Tuple[Any, Tuple[str, ...]]] = [
+            (kospi_db.child('stocks'), KOSPI_MARKETS),
+            (kosdaq_db.child('stocks'), KOSDAQ_MARKETS),
+        ]
+        self._raw: Dict[str, Dict[str, Dict]] = {}     # market -> symbol -> raw entry
+        self._quotes: Dict[str, Dict] = {}             # symbol -> quote
+        self._lock = threading.Lock()
+        self._ready = [threading.Event() for _ in self._sources]
+        self._listeners: List[Any] = []
+        self._subscribers: List[Callable[[Set[str]], Any]] = []
+        self._changed: Set[str] = set()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    # --- lifecycle ---
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._open()
+            self._started = True
+        threading.Thread(target=self._restart_loop, name='price-cache-restart', daemon=True).start()
+
+    def _open(self):
+        for i, (ref, markets) in enumerate(self._sources):
+            listener = ref.listen(lambda event, i=i, markets=markets: self._on_event(i, markets, event))
+            self._listeners.append(listener)
+        print(f"Price cache listening on {sum(len(m) for _, m in self._sources)} markets.")
+
+    def _close(self):
+        for listener in self._listeners:
+            try:
+                listener.close()
+            except Exception as e:
+                print(f"Error closing price cache listener: {e}")
+        self._listeners = []
+
+    def _restart_loop(self):
+        while True:
+            time.sleep(RESTART_INTERVAL_SEC)
+            try:
+                # The initial snapshot of the new streams replaces everything we hold.
+                self._close()
+                self._open()
+            except Exception as e:
+                print(f"Error restarting price cache listeners: {e}")
+
+    def wait_ready(self, timeout: float = READY_TIMEOUT_SEC) -> bool:
+        """Start the streams and block until both initial snapshots arrived. Call once at startup."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        return all(event.wait(max(0.0, deadline - time.monotonic())) for event in self._ready)
+
+    def is_ready(self) -> bool:
+        return all(event.is_set() for event in self._ready)
+
+    def subscribe(self, callback: Callable[[Set[str]], Any]):
+        """
+        Call callback(symbols) with the symbols whose price changed, after each
+        stream event. Runs on the listener thread, so callbacks must be quick.
+        """
+        self._subscribers.append(callback)
+
+    # --- reads ---
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """Quote for symbol, or None if it is not listed."""
+        # Never block here: a stream that is slow to deliver its first
+        # snapshot would otherwise stall every trade and match for the timeout.
+        self.start()
+        if not self.is_ready():
+            return self._read_through(symbol)
+        return self._quotes.get(symbol)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Shallow copy of every quote (symbol -> quote)."""
+        self.start()
+        if not self.is_ready():
+            return self._read_all()
+        with self._lock:
+            return dict(self._quotes)
+
+    def _read_all(self) -> Dict[str, Dict]:
+        quotes = {}
+        for ref, markets in self._sources:
+            raw = ref.get() or {}
+            for market in markets:
+                for symbol, data in (raw.get(market) or {}).items():
+                    quote = parse_quote(market, data)
+                    if quote:
+                        quotes[symbol] = quote
+        return quotes
+
+    def _read_through(self, symbol: str) -> Optional[Dict]:
+        # Streams not up yet: one direct read routed by the symbol index,
+        # or probe every market if the symbol is not indexed yet.
+        market = get_symbol_index().market_of(symbol)
+        if market:
+            ref = get_symbol_index().stock_ref(symbol)
+            return parse_quote(market, ref.get()) if ref else None
+        for ref, markets in self._sources:
+            for market in markets:
+                data = ref.child(f'{market}/{symbol}').get()
+                if data:
+                    return parse_quote(market, data)
+        return None
+
+    # --- stream handling ---
+
+    def _on_event(self, source: int, markets: Tuple[str, ...], event):
+        try:
+            path = event.path.strip('/')
+            parts = path.split('/') if path else []
+            data = event.data
+            patch = event.event_type == 'patch'
+
+            with self._lock:
+                self._apply(source, markets, parts, data, patch)
+                changed, self._changed = self._changed, set()
+        except Exception as e:
+            print(f"Error applying price cache event {getattr(event, 'path', '')}: {e}")
+            return
+
+        if changed:
+            for callback in self._subscribers:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"Error in price cache subscriber: {e}")
+
+    def _apply(self, source: int, markets: Tuple[str, ...], parts: List[str], data: Any, patch: bool):
+        if not parts:
+            # Initial load / whole-tree write: each market child is replaced
+            if not patch:
+                for market in markets:
+                    self._set_market(market, None)
+            for market, entries in (data or {}).items():
+                if market in markets:
+                    self._set_market(market, entries)
+            self._ready[source].set()
+            return
+
+        market = parts[0]
+        if market not in markets:
+            return
+        if len(parts) == 1:
+            if patch:
+                for symbol, entry in (data or {}).items():
+                    self._set_symbol(market, symbol, entry)
+            else:
+                self._set_market(market, data)
+        elif len(parts) == 2:
+            if patch:
+                merged = dict(self._raw.get(market, {}).get(parts[1]) or {})
+                merged.update(data or {})
+                data = merged
+            self._set_symbol(market, parts[1], data)
+        else:
+            # Single field write (e.g. stocks/KOSPI/005930/price)
+            merged = dict(self._raw.get(market, {}).get(parts[1]) or {})
+            if data is None:
+                merged.pop(parts[2], None)
+            else:
+                merged[parts[2]] = data
+            self._set_symbol(market, parts[1], merged or None)
+
+    def _set_market(self, market: str, entries: Any):
+        for symbol in list(self._raw.get(market, {})):
+            self._set_symbol(market, symbol, None)
+        for symbol, entry in (entries or {}).items():
+            self._set_symbol(market, symbol, entry)
+
+    def _set_symbol(self, market: str, symbol: str, entry: Any):
+        market_raw = self._raw.setdefault(market, {})
+        quote = parse_quote(market, entry)
+        if quote is None:
+            market_raw.pop(symbol, None)
+            current = self._quotes.get(symbol)
+            if current and current['market'] == market:
+                del self._quotes[symbol]
+                self._changed.add(symbol)
+            return
+        market_raw[symbol] = entry
+        previous = self._quotes.get(symbol)
+        if previous is None or previous['price'] != quote['price']:
+            self._changed.add(symbol)
+        self._quotes[symbol] = quote
+
+
+price_cache = PriceCache()
+
+def get_price_cache() -> PriceCache:
+    return price_cache
@@ -1,13 +1,17 @@
 import schedule
 import time
-from datetime import datetime, time as dt_time
+from datetime import datetime, timedelta
 from .firebase_config import main_db, kospi_db, kosdaq_db
 from .fetcher import fetch_kr_stocks, fetch_exchange_rate, fetch_indices, MARKET_TZ
 from .models import Stock
+from .symbol_index import get_symbol_index
+from .trading_calendar import get_krx_calendar, get_nyse_calendar
 import math
 
 # Global state for diff-based updates
 last_snapshot: dict[str, dict] = {}
+last_update_time = None  # start of the last successful fetch
+CLOSE_GRACE = timedelta(minutes=30)  # keep refreshing this long after a close for the final prints
 
 def sanitize_for_firebase(data):
     if isinstance(data, dict):
@@ -19,11 +23,24 @@ def sanitize_for_firebase(data):
     return data
 
 def is_kr_market_open() -> bool:
-    """Check if the KR market is open (9:00 - 15:30, Weekdays)."""
+    """Check if a KRX session is in progress (holidays and shifted hours included)."""
+    return get_krx_calendar().is_open(datetime.now(MARKET_TZ))
+
+def is_us_market_open() -> bool:
+    return get_nyse_calendar().is_open(datetime.now(MARKET_TZ))
+
+def off_hours_update_job():
+    """
+    While KRX is closed, only refresh when there is something new: through
+    CLOSE_GRACE after each KRX/NYSE close (plus once after it) for the
+    closing prints, and during NYSE hours for the US indices. Weekends and
+    holidays are skipped entirely.
+    """
     now = datetime.now(MARKET_TZ)
-    if now.weekday() >= 5: # Sat, Sun
-        return False
-    return dt_time(9, 0) <= now.time() <= dt_time(15, 30)
+    if (last_update_time is None or is_us_market_open()
+            or last_update_time < get_krx_calendar().previous_close(now) + CLOSE_GRACE
+            or last_update_time < get_nyse_calendar().previous_close(now) + CLOSE_GRACE):
+        price_update_job()
 
 def has_stock_changed(new_dict: dict, old_dict: dict) -> bool:
     """Compare price field to determine if an update is needed.
@@ -33,7 +50,7 @@ def has_stock_changed(new_dict: dict, old_dict: dict) -> bool:
     return new_dict.get('price') != old_dict.get('price')
 
 def price_update_job():
-    global last_snapshot
+    global last_snapshot, last_update_time
     now = datetime.now(MARKET_TZ)
     is_open = is_kr_market_open()
     print(f"[{now}] Processing Price Update (Market Open: {is_open})...")
@@ -50,6 +67,7 @@ def price_update_job():
     except Exception as e:
         print(f"Error fetching data: {e}")
         return
+    last_update_time = now
 
     # 2. Prepare Updates (Diff check)
     updates_by_market = {
@@ -58,14 +76,16 @@ def price_update_job():
         'ETF': {},
         'ETN': {}
     }
+    classified = {}  # symbol -> (market, name) for the routing index
     
     for symbol, stock in all_stocks.items():
         new_dict = stock.to_dict() # Use full dict for snapshot comparison
         old_dict = last_snapshot.get(symbol)
+        m_type = stock.market if stock.market in updates_by_market else 'KOSPI'
+        classified[symbol] = (m_type, stock.name)
         
         if has_stock_changed(new_dict, old_dict):
             # Group by market and use compressed format for RTDB
-            m_type = stock.market if stock.market in updates_by_market else 'KOSPI'
             updates_by_market[m_type][symbol] = stock.to_rtdb_dict()
             
             # Update local snapshot
@@ -104,6 +124,11 @@ def price_update_job():
             kosdaq_db.child('system/updatedAt').set(now.isoformat())
             if updates_by_market['KOSDAQ']:
                 print(f"  -> KOSDAQ Project: Synced {len(updates_by_market['KOSDAQ'])} stock changes.")
+
+        # D. Main Project: symbol -> (market, name) routing index (new/renamed symbols only)
+        indexed = get_symbol_index().sync(classified)
+        if indexed:
+            print(f"  -> Symbol index: {indexed} entries updated.")
                 
     except Exception as e:
         print(f"Error during Firebase sync: {e}")
@@ -128,8 +153,9 @@ def run_scheduler():
             
         schedule.clear('price_job')
         interval = 30 if is_open else 60
+        job = price_update_job if is_open else off_hours_update_job
         
-        schedule.every(interval).seconds.do(price_update_job).tag('price_job')
+        schedule.every(interval).seconds.do(job).tag('price_job')
         current_market_open = is_open
         print(f"Scheduler mode changed. Market Open: {is_open}, Interval: {interval}s")
 
@@ -0,0 +1,127 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from .firebase_config import ranking_db, build_ranking_entry
+
+CACHE_NODE = 'ranking_cache'
+FLUSH_WINDOW_SEC = 1.0    # trades of the same user within this window share one write
+MAX_PATHS_PER_UPDATE = 500
+
+
+class RankingSyncQueue:
+    """
+    Write-behind sync of ranking_cache/{uid}.
+
+    Trades enqueue the fields they changed (balance, one portfolio entry),
+    taken from the transaction result, so nothing is re-read from Firestore.
+    Changes are coalesced per path and written by a background thread as
+    multi-path updates. Users without a cache entry yet, or callers that
+    cannot describe their change, get a full rebuild from Firestore instead.
+    """
+
+    def __init__(self, window: float = FLUSH_WINDOW_SEC):
+        self.window = window
+        self._paths: Dict[str, Dict[str, Any]] = {}  # uid -> {relative path: value}
+        self._full: Set[str] = set()
+        self._known: Optional[Set[str]] = None       # uids that already have a cache entry
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ranking-sync', daemon=True)
+        self._thread.start()
+
+    def enqueue_trade(self, uid: str, balance: float, symbol: str, quantity: float, average_price: float):
+        """Record a trade's effect: the new balance and the new position in symbol."""
+        position = None
+        if quantity > 0:
+            position = {'symbol': symbol, 'quantity': float(quantity), 'averagePrice': float(average_price)}
+        self._enqueue(uid, {'balance': float(balance), f'portfolio/{symbol}': position})
+
+    def enqueue_full(self, uid: str):
+        """Rebuild the whole entry from Firestore on the next flush."""
+        with self._lock:
+            self._full.add(uid)
+            self._paths.pop(uid, None)
+        self.start()
+        self._wake.set()
+
+    def _enqueue(self, uid: str, fields: Dict[str, Any]):
+        with self._lock:
+            if uid not in self._full:
+                self._paths.setdefault(uid, {}).update(fields)
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Let further trades of the same users land in this batch
+            time.sleep(self.window)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing ranking cache sync: {e}")
+
+    def _load_known(self) -> Set[str]:
+        if self._known is None:
+            self._known = set((ranking_db.child(CACHE_NODE).get(shallow=True) or {}).keys())
+        return self._known
+
+    def flush(self) -> int:
+        """Write everything queued so far. Returns the number of users written."""
+        with self._lock:
+            paths, self._paths = self._paths, {}
+            full, self._full = self._full, set()
+        if not paths and not full:
+            return 0
+
+        known = self._load_known()
+        # A partial update would leave a new user's entry without its summary fields
+        full |= {uid for uid in paths if uid not in known}
+
+        now_ms = int(time.time() * 1000)
+        updates: Dict[str, Any] = {}
+        for uid in full:
+            try:
+                entry = build_ranking_entry(uid)
+            except Exception as e:
+                print(f"Error building ranking cache entry for {uid}: {e}")
+                continue
+            if entry is not None:
+                updates[uid] = entry
+        for uid, fields in paths.items():
+            if uid in full:
+                continue
+            for path, value in fields.items():
+                updates[f'{uid}/{path}'] = value
+            updates[f'{uid}/updatedAt'] = now_ms
+            updates[f'{uid}/lastSync'] = now_ms
+
+        items = list(updates.items())
+        for i in range(0, len(items), MAX_PATHS_PER_UPDATE):
+            chunk = items[i:i + MAX_PATHS_PER_UPDATE]
+            try:
+                ranking_db.child(CACHE_NODE).update(dict(chunk))
+            except Exception as e:
+                print(f"Error writing ranking cache batch: {e}")
+                # Retry these users with a full rebuild on the next flush
+                for path, _ in chunk:
+                    self.enqueue_full(path.split('/')[0])
+        known.update(uid for uid in full if uid in updates)
+
+        users = len(full | set(paths))
+        print(f"  [SYNC] {users} users synced to RTDB cache ({len(updates)} paths).")
+        return users
+
+
+ranking_sync = RankingSyncQueue()
+
+def get_ranking_sync() -> RankingSyncQueue:
+    return ranking_sync
@@ -0,0 +1,91 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from .firebase_config import main_db, kospi_db, kosdaq_db
+
+# system/symbol_index/{symbol} = {'market': ..., 'name': ...}
+INDEX_PATH = 'system/symbol_index'
+
+# Which price project holds each market's stocks/{market} tree
+MARKET_DBS = {
+    'KOSPI': kospi_db,
+    'ETF': kospi_db,
+    'ETN': kospi_db,
+    'KOSDAQ': kosdaq_db,
+}
+
+
+class SymbolIndex:
+    """
+    Persistent symbol -> (market, name) routing table.
+
+    price_update_job writes it whenever it classifies a new symbol or a name
+    changes; readers keep a local copy and fall back to a single direct read
+    of system/symbol_index/{symbol} on a miss.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        data = main_db.child(INDEX_PATH).get() or {}
+        with self._lock:
+            for symbol, entry in data.items():
+                if isinstance(entry, dict) and entry.get('market'):
+                    self._entries[symbol] = (entry['market'], entry.get('name', 'Unknown'))
+            self._loaded = True
+
+    def lookup(self, symbol: str) -> Optional[Tuple[str, str]]:
+        """(market, name) for symbol, or None if the symbol was never listed."""
+        entry = self._entries.get(symbol)
+        if entry is not None or not symbol:
+            return entry
+        data = main_db.child(f'{INDEX_PATH}/{symbol}').get()
+        if not isinstance(data, dict) or not data.get('market'):
+            return None
+        entry = (data['market'], data.get('name', 'Unknown'))
+        with self._lock:
+            self._entries[symbol] = entry
+        return entry
+
+    def market_of(self, symbol: str) -> Optional[str]:
+        entry = self.lookup(symbol)
+        return entry[0] if entry else None
+
+    def name_of(self, symbol: str, default: str = 'Unknown') -> str:
+        entry = self.lookup(symbol)
+        return entry[1] if entry else default
+
+    def stock_ref(self, symbol: str):
+        """RTDB reference to stocks/{market}/{symbol} in the right price project, or None."""
+        market = self.market_of(symbol)
+        if market not in MARKET_DBS:
+            return None
+        return MARKET_DBS[market].child(f'stocks/{market}/{symbol}')
+
+    def sync(self, classified: Dict[str, Tuple[str, str]]) -> int:
+        """Write entries that are new or changed (one multi-path update). Returns the count written."""
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            changed = {
+                symbol: entry for symbol, entry in classified.items()
+                if self._entries.get(symbol) != entry
+            }
+        if not changed:
+            return 0
+        main_db.child(INDEX_PATH).update({
+            symbol: {'market': market, 'name': name}
+            for symbol, (market, name) in changed.items()
+        })
+        with self._lock:
+            self._entries.update(changed)
+        return len(changed)
+
+
+symbol_index = SymbolIndex()
+
+def get_symbol_index() -> SymbolIndex:
+    return symbol_index
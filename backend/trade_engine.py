@@ -1,10 +1,15 @@
 import time
 import math
-from datetime import datetime, time as dt_time
+from datetime import datetime
 from firebase_admin import firestore
-from .firebase_config import main_db, kospi_db, kosdaq_db, main_firestore, sync_user_to_rtdb, ranking_db
+from .firebase_config import main_db, main_firestore, ranking_db
 from .supabase_client import get_supabase
 from .fetcher import MARKET_TZ
+from .price_cache import get_price_cache
+from .order_matcher import OrderMatcher
+from .ranking_sync import get_ranking_sync
+from .trading_calendar import get_krx_calendar
+from .holdings_index import record_position_change
 
 # Constants
 FEE_RATE_SELL = 0.002  # 0.2% (SELL only)
@@ -13,43 +18,13 @@ PROFIT_RATIO_THRESHOLD = 0.1 # 10%
 MAX_TICKERS = 50
 
 def get_latest_price(symbol: str) -> tuple[float, str, float]:
-    """Fetch latest price and change_percent from nested RTDB structure."""
+    """Latest price, market and change_percent from the in-process price cache."""
+    quote = get_price_cache().get(symbol)
+    # ETNs are mirrored for valuation but are not tradable
+    if quote and quote['market'] != 'ETN':
+        return quote['price'], quote['market'], quote['change_percent']
     
-    def parse_stock_data(data):
-        if not data: return 0.0, 0.0
-        price = float(data.get('price', 0))
-        change_percent = float(data.get('change_percent', 0))
-        
-        # Parse from info string if available (compressed format)
-        info = data.get('info', '')
-        if info:
-            try:
-                parts = info.split('|')
-                if len(parts) >= 2:
-                    change_percent = float(parts[1])
-            except:
-                pass
-        return price, change_percent
-
-    # 1. Try KOSPI
-    stock_kp = kospi_db.child(f'stocks/KOSPI/{symbol}').get()
-    if stock_kp:
-        p, cp = parse_stock_data(stock_kp)
-        return p, 'KOSPI', cp
-    
-    # 2. Try ETF (also in KOSPI DB)
-    stock_etf = kospi_db.child(f'stocks/ETF/{symbol}').get()
-    if stock_etf:
-        p, cp = parse_stock_data(stock_etf)
-        return p, 'ETF', cp
-    
-    # 3. Try KOSDAQ
-    stock_kq = kosdaq_db.child(f'stocks/KOSDAQ/{symbol}').get()
-    if stock_kq:
-        p, cp = parse_stock_data(stock_kq)
-        return p, 'KOSDAQ', cp
-    
-    # 4. Fallback: Symbol not found in DB
+    # Fallback: Symbol not found in DB
     return 0.0, None, 0.0
 
 def calculate_fee(side: str, market: str, amount: float, tax_points: float = 0) -> tuple[float, float, float]:
@@ -135,14 +110,14 @@ def broadcast_ticker(display_name, symbol, name, tx_type, amount, profit_ratio=N
         print(f"Error broadcasting ticker: {e}")
 
 def is_kr_market_open() -> bool:
-    """Check if the KR market is open (9:00 - 15:30, Weekdays)."""
-    now = datetime.now(MARKET_TZ)
-    if now.weekday() >= 5: # Sat, Sun
-        return False
-    return dt_time(9, 0) <= now.time() <= dt_time(15, 30)
+    """Check if a KRX session is in progress (holidays and shifted hours included)."""
+    return get_krx_calendar().is_open(datetime.now(MARKET_TZ))
 
-def process_order(uid: str, order_id: str, order_data: dict):
-    """Executes order with Firestore Transaction and RTDB status update."""
+def process_order(uid: str, order_id: str, order_data: dict) -> bool:
+    """
+    Executes order with Firestore Transaction and RTDB status update.
+    Returns False if the order was left PENDING for a later attempt.
+    """
     symbol = order_data.get('symbol')
     req_quantity = order_data.get('quantity')
     side = order_data.get('type') # BUY or SELL
@@ -152,13 +127,13 @@ def process_order(uid: str, order_id: str, order_data: dict):
 
     # Status check (Idempotency)
     if order_data.get('status') != 'PENDING':
-        return
+        return True
 
     # [Reality Engine] Market Hours Check
     is_open = is_kr_market_open()
     if not is_open and not is_system:
         # Keep PENDING for next market open
-        return
+        return False
 
     # 1. Price Check
     curr_price, market, change_percent = get_latest_price(symbol)
@@ -167,13 +142,14 @@ def process_order(uid: str, order_id: str, order_data: dict):
             'status': 'FAILED',
             'errorMessage': 'Stock price not found.'
         })
-        return
+        return True
 
     # [Reality Engine] Freshness Check: Is the price from today?
     # Systems orders (Welcome/Sabotage etc.) skip this to work 24/7 with available price.
     if is_open and not is_system:
         now = datetime.now(MARKET_TZ)
-        today_start = now.replace(hour=9, minute=0, second=0, microsecond=0)
+        # Today's actual open (late on the first session of the year, CSAT day)
+        today_start = get_krx_calendar().session(now.date())[0]
         
         # Check system/updatedAt to see if the updater has run today
         system_status = main_db.child('system').get() or {}
@@ -183,7 +159,7 @@ def process_order(uid: str, order_id: str, order_data: dict):
             if last_update_dt < today_start:
                 # Still yesterday's price. Wait for the updater to run.
                 print(f"  .. Waiting for fresh price for {symbol} (Last Update: {last_update_str})")
-                return
+                return False
 
     # [Reality Engine] Market Limit Protection (±29.7%)
     # System orders (Welcome/Sabotage etc.) bypass this to ensure execution.
@@ -191,12 +167,12 @@ def process_order(uid: str, order_id: str, order_data: dict):
     if not is_system and abs(change_percent) >= 29.7:
         # Keep status as PENDING and retry in the next loop if the price moves.
         print(f"  .. BLOCKED (Limit): {symbol} at {change_percent}% limit. Waiting for move.")
-        return
+        return False
 
     # 2. LIMIT Check
     if order_type == 'LIMIT':
-        if side == 'BUY' and curr_price > target_price: return
-        if side == 'SELL' and curr_price < target_price: return
+        if side == 'BUY' and curr_price > target_price: return False
+        if side == 'SELL' and curr_price < target_price: return False
 
     # 3. Firestore Transaction
     transaction = main_firestore.transaction()
@@ -247,9 +223,11 @@ def process_order(uid: str, order_id: str, order_data: dict):
                 'market': market,
                 'updatedAt': firestore.SERVER_TIMESTAMP
             }, merge=True)
+            record_position_change(transaction, symbol, curr_qty, new_qty)
             
             balance_change = -total_cost
             stock_change = req_quantity
+            position_avg = new_avg
         else: # SELL
             if curr_qty < req_quantity: return "Insufficient Stock Quantity"
             
@@ -271,6 +249,7 @@ def process_order(uid: str, order_id: str, order_data: dict):
                     'quantity': new_qty,
                     'updatedAt': firestore.SERVER_TIMESTAMP
                 })
+            record_position_change(transaction, symbol, curr_qty, new_qty)
             
             # Deduct used tax points
             if disc > 0:
@@ -280,6 +259,7 @@ def process_order(uid: str, order_id: str, order_data: dict):
             
             balance_change = proceeds
             stock_change = -req_quantity
+            position_avg = avg_price
         
         # Record Transaction to User History sub-collection
         # REMOVED: No longer writing to Firestore history
@@ -297,6 +277,8 @@ def process_order(uid: str, order_id: str, order_data: dict):
             "tx_type": side, "price": curr_price, "quantity": req_quantity,
             "amount": total_amount, "raw_fee": raw_fee, "discount": disc,
             "final_fee": final_fee, "balance_change": balance_change, "stock_change": stock_change,
+            # State after the trade, for the ranking cache
+            "new_balance": balance + balance_change, "new_quantity": new_qty, "new_average_price": position_avg,
             **kwargs_out
         }
 
@@ -305,7 +287,7 @@ def process_order(uid: str, order_id: str, order_data: dict):
         if isinstance(result, str):
             if result == "ALREADY_PROCESSED":
                 print(f"  -- SKIP: {uid}/{order_id} already processed.")
-                return
+                return True
             main_db.child(f'orders/{uid}/{order_id}').update({
                 'status': 'FAILED', 'errorMessage': result
             })
@@ -321,8 +303,8 @@ def process_order(uid: str, order_id: str, order_data: dict):
             record_to_supabase(**result)
             print(f"  -> SUCCESS: {uid} | {side} {symbol} @ {curr_price}")
             
-            # Sync to RTDB Cache for Leaderboard (Zero-Read Optimization)
-            sync_user_to_rtdb(uid)
+            # Sync to RTDB Cache for Leaderboard (Zero-Read Optimization), batched off the order path
+            get_ranking_sync().enqueue_trade(uid, result['new_balance'], symbol, result['new_quantity'], result['new_average_price'])
             
             # Ticker for large trades or high profit/loss
             is_large_trade = result['amount'] >= TICKER_THRESHOLD
@@ -343,47 +325,21 @@ def process_order(uid: str, order_id: str, order_data: dict):
         main_db.child(f'orders/{uid}/{order_id}').update({
             'status': 'ERROR', 'errorMessage': str(e)
         })
+    return True
 
 def start_engine():
     print("Trade Engine Daemon (Season 3) - RTDB Watch Mode started.")
-    
-    def on_order_change(event):
-        """Callback for RTDB order listener."""
-        if event.data is None: return
-        
-        # event.path might be like "/UID/ORDER_ID" or "/"
-        path_parts = event.path.strip('/').split('/')
-        
-        # We want to catch new orders or status changes to PENDING
-        # If it's a bulk initial load or deep update
-        if len(path_parts) == 2: # Single order update: /UID/ORDER_ID
-            uid, order_id = path_parts
-            process_order(uid, order_id, event.data)
-        elif len(path_parts) == 0: # Root change /
-            for uid, user_orders in event.data.items():
-                for oid, odata in user_orders.items():
-                    if odata.get('status') == 'PENDING':
-                        process_order(uid, oid, odata)
+    # Block once for the price streams' initial snapshots; reads never wait after this
+    if not get_price_cache().wait_ready():
+        print("Price cache not ready yet; serving reads from RTDB until it is.")
 
-    # Watch all orders
-    main_db.child('orders').listen(on_order_change)
-    
-    # Polling for LIMIT orders (since prices change externally)
-    while True:
-        try:
-            # 1. Get ONLY the list of UIDs (shallow=True prevents downloading all orders)
-            users_with_orders = main_db.child('orders').get(shallow=True)
-            
-            if users_with_orders:
-                # 2. For each UID, ONLY fetch orders that are strictly PENDING
-                for uid in users_with_orders.keys():
-                    pending_orders = main_db.child(f'orders/{uid}').order_by_child('status').equal_to('PENDING').get()
-                    if pending_orders:
-                        for oid, odata in pending_orders.items():
-                            process_order(uid, oid, odata)
-        except Exception as e:
-            print(f"Limit polling error: {e}")
-        time.sleep(10)
+    # The orders stream keeps a symbol-indexed book of PENDING orders; the
+    # matcher executes new orders right away and re-evaluates LIMIT orders
+    # only for symbols whose price moved (price cache stream), popping just
+    # the ones whose target was crossed.
+    matcher = OrderMatcher(process_order)
+    main_db.child('orders').listen(matcher.on_order_event)
+    matcher.run()
 
 if __name__ == "__main__":
     start_engine()
@@ -0,0 +1,272 @@
+import threading
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+KST = ZoneInfo("Asia/Seoul")
+NY_TZ = ZoneInfo("America/New_York")
+
+Session = Tuple[datetime, datetime]  # (open, close), tz-aware
+
+# --- KRX ---
+
+KRX_OPEN = dt_time(9, 0)
+KRX_CLOSE = dt_time(15, 30)
+# The first session of the year opens an hour late.
+KRX_NEW_YEAR_OPEN = dt_time(10, 0)
+
+# KRX closures. Lunar holidays, substitute days and election days cannot be
+# derived by rule, so they are listed per year; extend this table every
+# December once KRX publishes the next year's closures.
+KRX_HOLIDAYS = {
+    2025: [
+        date(2025, 1, 1), date(2025, 1, 27), date(2025, 1, 28), date(2025, 1, 29), date(2025, 1, 30),
+        date(2025, 3, 3), date(2025, 5, 1), date(2025, 5, 5), date(2025, 5, 6), date(2025, 6, 3),
+        date(2025, 6, 6), date(2025, 8, 15), date(2025, 10, 3), date(2025, 10, 6), date(2025, 10, 7),
+        date(2025, 10, 8), date(2025, 10, 9), date(2025, 12, 25), date(2025, 12, 31),
+    ],
+    2026: [
+        date(2026, 1, 1), date(2026, 2, 16), date(2026, 2, 17), date(2026, 2, 18), date(2026, 3, 2),
+        date(2026, 5, 1), date(2026, 5, 5), date(2026, 5, 25), date(2026, 6, 3), date(2026, 8, 17),
+        date(2026, 9, 24), date(2026, 9, 25), date(2026, 10, 5), date(2026, 10, 9), date(2026, 12, 25),
+        date(2026, 12, 31),
+    ],
+    2027: [
+        date(2027, 1, 1), date(2027, 2, 8), date(2027, 2, 9), date(2027, 3, 1), date(2027, 5, 5),
+        date(2027, 5, 13), date(2027, 8, 16), date(2027, 9, 14), date(2027, 9, 15), date(2027, 9, 16),
+        date(2027, 10, 4), date(2027, 10, 11), date(2027, 12, 27), date(2027, 12, 31),
+    ],
+}
+
+# Fixed-date closures used for years missing from KRX_HOLIDAYS (month, day).
+KRX_FIXED_HOLIDAYS = [(1, 1), (3, 1), (5, 1), (5, 5), (6, 6), (8, 15), (10, 3), (10, 9), (12, 25), (12, 31)]
+
+# Shifted sessions, e.g. the college entrance exam (CSAT) day: open 10:00, close 16:30.
+KRX_SPECIAL_HOURS = {
+    date(2025, 11, 13): (dt_time(10, 0), dt_time(16, 30)),
+    date(2026, 11, 19): (dt_time(10, 0), dt_time(16, 30)),
+}
+
+# --- NYSE ---
+
+NYSE_OPEN = dt_time(9, 30)
+NYSE_CLOSE = dt_time(16, 0)
+NYSE_EARLY_CLOSE = dt_time(13, 0)
+
+
+def _weekdays(year: int) -> List[date]:
+    d = date(year, 1, 1)
+    days = []
+    while d.year == year:
+        if d.weekday() < 5:
+            days.append(d)
+        d += timedelta(days=1)
+    return days
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """n-th given weekday of a month; n = -1 for the last one."""
+    if n > 0:
+        d = date(year, month, 1)
+        d += timedelta(days=(weekday - d.weekday()) % 7)
+        return d + timedelta(weeks=n - 1)
+    d = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return d - timedelta(days=(d.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+
+def _observed(d: date) -> date:
+    """NYSE observance: Saturday holidays move to Friday, Sunday ones to Monday."""
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+def nyse_holidays(year: int) -> List[date]:
+    holidays = [
+        _nth_weekday(year, 1, 0, 3),           # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),           # Presidents' Day
+        _easter(year) - timedelta(days=2),     # Good Friday
+        _nth_weekday(year, 5, 0, -1),          # Memorial Day
+        _observed(date(year, 7, 4)),           # Independence Day
+        _nth_weekday(year, 9, 0, 1),           # Labor Day
+        _nth_weekday(year, 11, 3, 4),          # Thanksgiving
+        _observed(date(year, 12, 25)),         # Christmas
+    ]
+    # New Year's Day falling on a Saturday is not observed on Dec 31
+    if date(year, 1, 1).weekday() != 5:
+        holidays.append(_observed(date(year, 1, 1)))
+    if year >= 2022:
+        holidays.append(_observed(date(year, 6, 19)))  # Juneteenth
+    return holidays
+
+
+def nyse_early_closes(year: int) -> List[date]:
+    closes = [_nth_weekday(year, 11, 3, 4) + timedelta(days=1)]  # day after Thanksgiving
+    for d in (date(year, 7, 3), date(year, 12, 24)):
+        if d.weekday() < 5:
+            closes.append(d)
+    return closes
+
+
+def krx_hours(year: int) -> Dict[date, Tuple[dt_time, dt_time]]:
+    if year in KRX_HOLIDAYS:
+        closed = set(KRX_HOLIDAYS[year])
+    else:
+        print(f"Warning: no KRX holiday table for {year}; using fixed-date holidays only.")
+        closed = {date(year, m, d) for m, d in KRX_FIXED_HOLIDAYS}
+    hours = {d: (KRX_OPEN, KRX_CLOSE) for d in _weekdays(year) if d not in closed}
+    if hours:
+        hours[min(hours)] = (KRX_NEW_YEAR_OPEN, KRX_CLOSE)
+    for d, special in KRX_SPECIAL_HOURS.items():
+        if d in hours:
+            hours[d] = special
+    return hours
+
+
+def nyse_hours(year: int) -> Dict[date, Tuple[dt_time, dt_time]]:
+    closed = set(nyse_holidays(year))
+    hours = {d: (NYSE_OPEN, NYSE_CLOSE) for d in _weekdays(year) if d not in closed}
+    for d in nyse_early_closes(year):
+        if d in hours:
+            hours[d] = (NYSE_OPEN, NYSE_EARLY_CLOSE)
+    return hours
+
+
+class TradingCalendar:
+    """
+    Session table for one exchange. Sessions are built a year at a time
+    (the following year too, so next_open works across New Year) and
+    indexed by local date, so is_open / next_open / next_close are dict
+    lookups instead of per-call date arithmetic. Session times are in the
+    exchange's own timezone, which takes care of US DST.
+    """
+
+    def __init__(self, name: str, tz: ZoneInfo, hours_for_year):
+        self.name = name
+        self.tz = tz
+        self._hours_for_year = hours_for_year
+        self._years: Dict[int, Dict[date, Tuple[dt_time, dt_time]]] = {}
+        # (sessions, index): index maps every calendar day to its first session on or after it
+        self._table: Tuple[List[Session], Dict[date, int]] = ([], {})
+        self._lock = threading.Lock()
+
+    def _ensure(self, day: date):
+        if day.year in self._years and day.year + 1 in self._years:
+            return
+        with self._lock:
+            missing = [y for y in (day.year, day.year + 1) if y not in self._years]
+            if not missing:
+                return
+            years = dict(self._years)
+            for year in missing:
+                years[year] = self._hours_for_year(year)
+            # Publish the table before the years, so the unlocked check above
+            # never sees a year whose sessions are not indexed yet
+            self._table = self._build(years)
+            self._years = years
+
+    def _build(self, years: Dict[int, Dict[date, Tuple[dt_time, dt_time]]]) -> Tuple[List[Session], Dict[date, int]]:
+        sessions: List[Session] = []
+        for year in sorted(years):
+            for d, (open_t, close_t) in sorted(years[year].items()):
+                sessions.append((datetime.combine(d, open_t, self.tz), datetime.combine(d, close_t, self.tz)))
+
+        index: Dict[date, int] = {}
+        i = 0
+        d = date(min(years), 1, 1)
+        end = date(max(years), 12, 31)
+        while d <= end:
+            while i < len(sessions) and sessions[i][0].date() < d:
+                i += 1
+            index[d] = i
+            d += timedelta(days=1)
+        return sessions, index
+
+    def _local(self, at: Optional[datetime]) -> datetime:
+        return datetime.now(self.tz) if at is None else at.astimezone(self.tz)
+
+    def session(self, day: date) -> Optional[Session]:
+        """The (open, close) session on a local date, or None when closed."""
+        self._ensure(day)
+        sessions, index = self._table
+        i = index[day]
+        if i < len(sessions) and sessions[i][0].date() == day:
+            return sessions[i]
+        return None
+
+    def is_trading_day(self, day: date) -> bool:
+        return self.session(day) is not None
+
+    def is_open(self, at: Optional[datetime] = None) -> bool:
+        at = self._local(at)
+        session = self.session(at.date())
+        return session is not None and session[0] <= at <= session[1]
+
+    def _current_or_next(self, at: datetime) -> Session:
+        """The session in progress at `at`, else the next one to open."""
+        self._ensure(at.date())
+        sessions, index = self._table
+        i = index[at.date()]
+        if i < len(sessions) and sessions[i][1] < at:
+            i += 1
+        if i >= len(sessions):
+            self._ensure(sessions[-1][0].date() + timedelta(days=366))
+            return self._current_or_next(at)
+        return sessions[i]
+
+    def next_open(self, at: Optional[datetime] = None) -> datetime:
+        """Start of the next session opening after `at`."""
+        at = self._local(at)
+        session = self._current_or_next(at)
+        if session[0] > at:
+            return session[0]
+        return self._current_or_next(session[1] + timedelta(seconds=1))[0]
+
+    def next_close(self, at: Optional[datetime] = None) -> datetime:
+        """End of the session in progress, or of the next one if closed."""
+        return self._current_or_next(self._local(at))[1]
+
+    def previous_close(self, at: Optional[datetime] = None) -> datetime:
+        """End of the latest session that closed at or before `at`."""
+        at = self._local(at)
+        # Builds the previous year too, for lookups early in January
+        self._ensure(at.date() - timedelta(days=366))
+        self._ensure(at.date())
+        sessions, index = self._table
+        i = index[at.date()]
+        if i < len(sessions) and sessions[i][1] <= at:
+            return sessions[i][1]
+        return sessions[i - 1][1]
+
+
+krx_calendar = TradingCalendar('KRX', KST, krx_hours)
+nyse_calendar = TradingCalendar('NYSE', NY_TZ, nyse_hours)
+
+def get_krx_calendar() -> TradingCalendar:
+    return krx_calendar
+
+def get_nyse_calendar() -> TradingCalendar:
+    return nyse_calendar
+
+def is_kr_market_open(at: Optional[datetime] = None) -> bool:
+    return krx_calendar.is_open(at)
+
+def is_us_market_open(at: Optional[datetime] = None) -> bool:
+    return nyse_calendar.is_open(at)
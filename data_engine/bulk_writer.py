@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from google.api_core import exceptions as gexc
+
+from firestore_client import db
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_OPS = 500
+
+# Errors worth retrying: contention and transient backend failures.
+RETRYABLE_ERRORS = (
+    gexc.Aborted,
+    gexc.DeadlineExceeded,
+    gexc.ServiceUnavailable,
+    gexc.ResourceExhausted,
+    gexc.InternalServerError,
+)
+
+
+class WriteCache:
+    """Last successfully written payload per document path, for skip-unchanged checks."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._data.get(path)
+
+    def remember(self, path: str, data: Mapping[str, Any]):
+        with self._lock:
+            merged = dict(self._data.get(path) or {})
+            merged.update(data)
+            self._data[path] = merged
+
+    def forget(self, path: str):
+        with self._lock:
+            self._data.pop(path, None)
+
+    def unchanged(self, path: str, data: Mapping[str, Any]) -> bool:
+        """True when every field in `data` matches what was last written to `path`."""
+        return _is_unchanged(data, self.get(path))
+
+
+@dataclass
+class BulkWriteResult:
+    written: int = 0
+    skipped: int = 0
+    failed: int = 0
+    chunks: int = 0
+
+
+_PLAIN_TYPES = (int, float, str, bool, type(None))
+
+
+def _is_unchanged(data: Mapping[str, Any], current: Optional[Mapping[str, Any]]) -> bool:
+    # Transforms (Increment, SERVER_TIMESTAMP, ...) always count as a change.
+    if not current:
+        return False
+    return all(
+        isinstance(value, _PLAIN_TYPES) and key in current and current[key] == value
+        for key, value in data.items()
+    )
+
+
+class BulkWriter:
+    """
+    Collects Firestore set/update/delete operations and commits them in
+    chunks of at most 500 writes. Chunks are committed in parallel and
+    retried with jittered backoff on contention/transient errors.
+
+    Writes can be skipped when the document already holds the same values,
+    either from a snapshot the caller already read (`current=`) or from the
+    writer's WriteCache of what it last committed.
+    """
+
+    def __init__(self, client=None, chunk_size: int = MAX_BATCH_OPS, max_workers: int = 4,
+                 retries: int = 3, backoff: float = 0.5, cache: Optional[WriteCache] = None):
+        self.client = client or db
+        self.chunk_size = min(chunk_size, MAX_BATCH_OPS)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self._ops: List[Tuple[str, Any, Optional[Dict[str, Any]], Dict[str, Any]]] = []
+        self._skipped = 0
+
+    def _skip(self, ref, data: Mapping[str, Any], current: Optional[Mapping[str, Any]], skip_unchanged: bool) -> bool:
+        if not skip_unchanged:
+            return False
+        if current is None and self.cache is not None:
+            current = self.cache.get(ref.path)
+        if _is_unchanged(data, current):
+            self._skipped += 1
+            return True
+        return False
+
+    def set(self, ref, data: Dict[str, Any], merge: bool = False,
+            current: Optional[Mapping[str, Any]] = None, skip_unchanged: bool = False):
+        if self._skip(ref, data, current, skip_unchanged):
+            return
+        self._ops.append(('set', ref, data, {'merge': merge}))
+
+    def update(self, ref, data: Dict[str, Any],
+               current: Optional[Mapping[str, Any]] = None, skip_unchanged: bool = False):
+        if self._skip(ref, data, current, skip_unchanged):
+            return
+        self._ops.append(('update', ref, data, {}))
+
+    def delete(self, ref):
+        self._ops.append(('delete', ref, None, {}))
+
+    def pending(self) -> int:
+        return len(self._ops)
+
+    def _commit_chunk(self, chunk) -> bool:
+        for attempt in range(self.retries + 1):
+            batch = self.client.batch()
+            for kind, ref, data, kwargs in chunk:
+                if kind == 'set':
+                    batch.set(ref, data, **kwargs)
+                elif kind == 'update':
+                    batch.update(ref, data)
+                else:
+                    batch.delete(ref)
+            try:
+                batch.commit()
+                return True
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.retries:
+                    print(f"Bulk write chunk failed after {attempt + 1} attempts: {e}")
+                    return False
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+            except Exception as e:
+                print(f"Bulk write chunk failed: {e}")
+                return False
+        return False
+
+    def _record(self, chunk, ok: bool):
+        if self.cache is None:
+            return
+        for kind, ref, data, _ in chunk:
+            if ok and kind != 'delete' and data is not None:
+                self.cache.remember(ref.path, data)
+            else:
+                self.cache.forget(ref.path)
+
+    def flush(self) -> BulkWriteResult:
+        """Commit everything queued so far and reset the writer."""
+        ops, self._ops = self._ops, []
+        result = BulkWriteResult(skipped=self._skipped)
+        self._skipped = 0
+        if not ops:
+            return result
+
+        chunks = [ops[i:i + self.chunk_size] for i in range(0, len(ops), self.chunk_size)]
+        result.chunks = len(chunks)
+        workers = max(1, min(self.max_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-write') as executor:
+            outcomes = list(executor.map(self._commit_chunk, chunks))
+
+        for chunk, ok in zip(chunks, outcomes):
+            self._record(chunk, ok)
+            if ok:
+                result.written += len(chunk)
+            else:
+                result.failed += len(chunk)
+        return result
@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Vectorized equity / ranking math shared by the scheduler (ranking history),
+# the backend leaderboard and mission progress. Positions are flattened into
+# parallel arrays (user row, symbol row, qty, avg price) so valuing every
+# position of every user is a handful of NumPy ops instead of a Python loop.
+
+
+@dataclass
+class PositionBook:
+    """All positions of a set of users as parallel arrays."""
+    uids: List[str]
+    symbols: List[str]
+    user_idx: np.ndarray    # int64, per position -> row in uids
+    symbol_idx: np.ndarray  # int64, per position -> row in symbols
+    qty: np.ndarray         # float64, signed (negative = short)
+    avg_price: np.ndarray   # float64, KRW cost basis per share
+
+    @property
+    def n_users(self) -> int:
+        return len(self.uids)
+
+    def prices_by_symbol(self, symbol_prices: Dict[str, float]) -> np.ndarray:
+        """Symbol-axis price array from a symbol -> price map (NaN where missing)."""
+        return np.array([symbol_prices.get(s, np.nan) for s in self.symbols], dtype=np.float64)
+
+    def position_prices(self, symbol_prices: np.ndarray) -> np.ndarray:
+        """Broadcast a symbol-axis price array onto the positions."""
+        if len(self.symbol_idx) == 0:
+            return np.zeros(0)
+        return symbol_prices[self.symbol_idx]
+
+
+class PositionBookBuilder:
+    """Accumulates users/positions row by row, then freezes them into a PositionBook."""
+
+    def __init__(self):
+        self._uid_rows: Dict[str, int] = {}
+        self._symbol_rows: Dict[str, int] = {}
+        self._user_idx: List[int] = []
+        self._symbol_idx: List[int] = []
+        self._qty: List[float] = []
+        self._avg: List[float] = []
+
+    def add_user(self, uid: str) -> int:
+        row = self._uid_rows.get(uid)
+        if row is None:
+            row = self._uid_rows[uid] = len(self._uid_rows)
+        return row
+
+    def has_user(self, uid: str) -> bool:
+        return uid in self._uid_rows
+
+    def add_position(self, uid: str, symbol: str, qty: float, avg_price: float = 0.0):
+        if not qty:
+            return
+        symbol_row = self._symbol_rows.get(symbol)
+        if symbol_row is None:
+            symbol_row = self._symbol_rows[symbol] = len(self._symbol_rows)
+        self._user_idx.append(self.add_user(uid))
+        self._symbol_idx.append(symbol_row)
+        self._qty.append(float(qty))
+        self._avg.append(float(avg_price or 0))
+
+    def build(self) -> PositionBook:
+        return PositionBook(
+            uids=list(self._uid_rows),
+            symbols=list(self._symbol_rows),
+            user_idx=np.asarray(self._user_idx, dtype=np.int64),
+            symbol_idx=np.asarray(self._symbol_idx, dtype=np.int64),
+            qty=np.asarray(self._qty, dtype=np.float64),
+            avg_price=np.asarray(self._avg, dtype=np.float64),
+        )
+
+
+@dataclass
+class EquityResult:
+    """Per-user results, aligned with PositionBook.uids."""
+    uids: List[str]
+    equity: np.ndarray
+    stock_value: np.ndarray   # sum(qty * price): longs minus current short value
+    gross_value: np.ndarray   # sum(|qty| * price)
+    short_margin: np.ndarray  # sum(|qty| * avg_price) over shorts
+    long_count: np.ndarray    # number of long positions
+    rank: np.ndarray          # 1-based, by equity descending
+
+    def order(self) -> np.ndarray:
+        """User rows sorted by rank."""
+        return np.argsort(self.rank, kind='stable')
+
+
+def _per_user(book: PositionBook, values: np.ndarray) -> np.ndarray:
+    return np.bincount(book.user_idx, weights=values, minlength=book.n_users)
+
+
+def rank_desc(values: np.ndarray) -> np.ndarray:
+    """1-based ranks by value descending; ties keep input order (like a stable sort)."""
+    order = np.argsort(-values, kind='stable')
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(1, len(values) + 1)
+    return ranks
+
+
+def compute_equity(book: PositionBook, position_prices: np.ndarray, cash: np.ndarray,
+                   used_credit: Optional[np.ndarray] = None) -> EquityResult:
+    """
+    Value every position and compute per-user equity and rank in one pass.
+
+    position_prices: KRW price per position; NaN positions are left out of the valuation.
+    cash: balance per user (aligned with book.uids).
+    used_credit: per user. When given, applies the credit model used by the
+        scheduler: equity = balance + stock_value - (used_credit - short_margin) + short_margin.
+        Without it, equity = cash + stock_value.
+    """
+    priced = ~np.isnan(position_prices)
+    prices = np.where(priced, position_prices, 0.0)
+    qty = np.where(priced, book.qty, 0.0)
+
+    stock_value = _per_user(book, qty * prices)
+    gross_value = _per_user(book, np.abs(qty) * prices)
+    short_margin = _per_user(book, np.where(qty < 0, -qty * book.avg_price, 0.0))
+    long_count = np.bincount(book.user_idx, weights=(book.qty > 0).astype(np.float64),
+                             minlength=book.n_users).astype(np.int64)
+
+    cash = np.asarray(cash, dtype=np.float64)
+    equity = cash + stock_value
+    if used_credit is not None:
+        equity = equity - (np.asarray(used_credit, dtype=np.float64) - short_margin) + short_margin
+
+    return EquityResult(
+        uids=book.uids,
+        equity=equity,
+        stock_value=stock_value,
+        gross_value=gross_value,
+        short_margin=short_margin,
+        long_count=long_count,
+        rank=rank_desc(equity),
+    )
+
+
+def mean_yield_by_symbol(book: PositionBook, position_prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Average unrealized yield (%) of long positions per symbol.
+    Returns (mean_yield, holder_count) aligned with book.symbols.
+    """
+    mask = (book.qty > 0) & (book.avg_price > 0) & ~np.isnan(position_prices)
+    safe_avg = np.where(mask, book.avg_price, 1.0)
+    yields = np.where(mask, (position_prices / safe_avg - 1) * 100, 0.0)
+    n = len(book.symbols)
+    sums = np.bincount(book.symbol_idx, weights=yields, minlength=n)
+    counts = np.bincount(book.symbol_idx, weights=mask.astype(np.float64), minlength=n)
+    means = np.divide(sums, counts, out=np.zeros(n), where=counts > 0)
+    return means, counts.astype(np.int64)
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Set
+
+# Hot symbols (held, open limit orders, big recent movers) are re-quoted
+# every few seconds. Idle symbols start at IDLE_BASE_SEC and double their
+# interval each time a fetch finds the price unchanged, up to IDLE_MAX_SEC.
+HOT_INTERVAL_SEC = 5
+IDLE_BASE_SEC = 60
+IDLE_MAX_SEC = 480
+TICK_SEC = 5
+
+# A move of at least this much between two observations makes a symbol hot
+# for MOVE_MEMORY_SEC.
+HOT_MOVE_PERCENT = 1.0
+MOVE_MEMORY_SEC = 15 * 60
+
+
+class FetchTiers:
+    """
+    Per-symbol refresh cadence for the realtime quote poller.
+
+    recompute() sets the managed symbols: `pinned` are always hot, while
+    `background` symbols are polled with adaptive back-off. observe() feeds
+    price moves from any fetch path, promoting movers to hot. due() and
+    mark_fetched() drive the poll loop.
+    """
+
+    def __init__(self, hot_interval: float = HOT_INTERVAL_SEC, idle_base: float = IDLE_BASE_SEC,
+                 idle_max: float = IDLE_MAX_SEC, move_percent: float = HOT_MOVE_PERCENT,
+                 move_memory: float = MOVE_MEMORY_SEC):
+        self.hot_interval = hot_interval
+        self.idle_base = idle_base
+        self.idle_max = idle_max
+        self.move_percent = move_percent
+        self.move_memory = move_memory
+        self._pinned: Set[str] = set()
+        self._background: Set[str] = set()
+        self._moved_at: Dict[str, float] = {}
+        self._idle_interval: Dict[str, float] = {}
+        self._next_due: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _is_hot(self, symbol: str, now: float) -> bool:
+        return symbol in self._pinned or now - self._moved_at.get(symbol, float('-inf')) < self.move_memory
+
+    def _managed(self) -> Set[str]:
+        return self._pinned | self._background | set(self._moved_at)
+
+    def recompute(self, pinned: Iterable[str], background: Iterable[str]) -> Dict[str, int]:
+        """Replace the managed symbol sets. Returns tier sizes for logging."""
+        now = time.monotonic()
+        with self._lock:
+            self._pinned = set(pinned)
+            self._background = set(background)
+            self._moved_at = {s: t for s, t in self._moved_at.items() if now - t < self.move_memory}
+            managed = self._managed()
+            self._next_due = {s: t for s, t in self._next_due.items() if s in managed}
+            self._idle_interval = {s: t for s, t in self._idle_interval.items() if s in managed}
+            hot = sum(1 for s in managed if self._is_hot(s, now))
+            return {'hot': hot, 'idle': len(managed) - hot}
+
+    def observe(self, previous: Mapping, quotes: Mapping, now: Optional[float] = None):
+        """Record moves between a previous frame and fresh quotes (symbol -> Stock)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for symbol, quote in quotes.items():
+                old = previous.get(symbol)
+                if old is None or old.price <= 0:
+                    continue
+                if abs(quote.price - old.price) / old.price * 100 >= self.move_percent:
+                    self._moved_at[symbol] = now
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return [s for s in self._managed() if self._next_due.get(s, 0.0) <= now]
+
+    def mark_fetched(self, symbols: Iterable[str], changed: Set[str], now: Optional[float] = None):
+        """Schedule the next fetch of each symbol; unchanged idle symbols back off."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for symbol in symbols:
+                if self._is_hot(symbol, now):
+                    interval = self.hot_interval
+                elif symbol in changed:
+                    interval = self._idle_interval[symbol] = self.idle_base
+                else:
+                    interval = self._idle_interval[symbol] = min(
+                        self._idle_interval.get(symbol, self.idle_base / 2) * 2, self.idle_max
+                    )
+                self._next_due[symbol] = now + interval
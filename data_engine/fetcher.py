@@ -1,16 +1,25 @@
-import FinanceDataReader as fdr
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime
-from zoneinfo import ZoneInfo
-from typing import List, Dict, Optional, Iterable
-import pandas as pd
+import threading
 import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import List, Dict, Optional, Iterable, Tuple
 
 from models import Stock
 from firestore_client import get_db
+from bulk_writer import BulkWriter, WriteCache
+from naver_client import get_client
+from suffix_cache import get_suffix_cache
+from ohlcv_cache import get_ohlcv_cache
+
+try:
+    import ijson  # incremental JSON decoding for the full-market listing
+except ImportError:
+    ijson = None
 
 db = get_db()
+http = get_client()
+suffix_cache = get_suffix_cache()
+ohlcv = get_ohlcv_cache()
 MARKET_TZ = ZoneInfo("Asia/Seoul")
 
 US_TICKER_MAP = {
@@ -83,7 +92,7 @@ def _to_float(value) -> float:
     if isinstance(value, str):
         if value == '-':
             return 0.0
-    if pd.isna(value) or value != value: # value != value checks for NaN
+    if value is None or value != value: # value != value checks for NaN
         return 0.0
     try:
         val = float(value)
@@ -129,14 +138,13 @@ def fetch_top_stocks(limit: int = 100, additional_symbols: Iterable[str] = ()) -
     """
     print(f"Fetching latest KRX snapshot (KOSPI Top {limit}, KOSDAQ Top {limit})...")
     snapshot: Dict[str, Stock] = {}
-    headers = {"User-Agent": "Mozilla/5.0"}
 
     # sosok=0 (KOSPI), sosok=1 (KOSDAQ)
     for sosok in [0, 1]:
         market_name = "KRX" if sosok == 0 else "KOSDAQ"
         url = f"https://m.stock.naver.com/api/json/sise/siseListJson.nhn?menu=market_sum&sosok={sosok}&pageSize={limit}&page=1"
         try:
-            resp = requests.get(url, headers=headers, timeout=10)
+            resp = http.get(url, timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 items = data.get('result', {}).get('itemList', [])
@@ -168,72 +176,116 @@ def fetch_top_stocks(limit: int = 100, additional_symbols: Iterable[str] = ()) -
     
     return snapshot
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+# Whole KR market (KOSPI, KOSDAQ, ETF, ETN) in one response of a few MB
+KR_LISTING_URL = "https://m.stock.naver.com/api/json/sise/siseListJson.nhn?menu=market_sum&pageSize=5000&page=1"
 
-def fetch_us_stocks() -> Dict[str, Stock]:
+def _iter_listing_items(resp):
+    """Yield result.itemList rows, decoding the body incrementally when ijson is available."""
+    if ijson is not None:
+        resp.raw.decode_content = True
+        yield from ijson.items(resp.raw, 'result.itemList.item', use_float=True)
+    else:
+        yield from resp.json().get('result', {}).get('itemList', [])
+
+def fetch_kr_listing(keep: Iterable[str] = ()) -> Dict[str, Stock]:
     """
-    Fetch a snapshot of selected US stocks via Naver API in parallel.
+    Fetch every KR stock with a single listing call, streaming rows straight
+    into the snapshot instead of decoding the whole payload first.
+    ETFs/ETNs are skipped unless their symbol is in `keep` (held or already published).
     """
-    print(f"Fetching latest US snapshot ({len(US_TICKER_MAP)} tickers) in parallel...")
+    keep = set(keep)
     snapshot: Dict[str, Stock] = {}
-    headers = {"User-Agent": "Mozilla/5.0"}
-    
-    def fetch_single(ticker: str, kor_name: str) -> Optional[Stock]:
-        # Conservative: sleep 100ms before each ticker request
-        time.sleep(0.1)
+    now = datetime.now(MARKET_TZ)
+    try:
+        resp = http.get(KR_LISTING_URL, timeout=15, stream=True)
         try:
-            # Optimal order: .O (Nasdaq), .N (NYSE), .A (AMEX), "", .K
-            for suffix in ['.O', '.N', '.A', '', '.K']:
-                url = f"https://api.stock.naver.com/stock/{ticker}{suffix}/basic"
-                resp = requests.get(url, headers=headers, timeout=5)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    # Skip empty or invalid data
-                    if not data or 'closePrice' not in data:
-                        continue
-                        
-                    price = float(str(data.get('closePrice', '0')).replace(',', ''))
-                    if price <= 0: continue
-                    
-                    change = float(str(data.get('compareToPreviousClosePrice', '0')).replace(',', ''))
-                    ratio = float(data.get('fluctuationsRatio', 0))
-                    
-                    market = 'NASDAQ' if suffix == '.O' else ('NYSE' if suffix == '.N' else ('AMEX' if suffix == '.A' else 'US'))
-                    
-                    return Stock(
-                        symbol=ticker,
-                        name=kor_name,
-                        price=price,
-                        change=change,
-                        change_percent=ratio,
-                        updated_at=datetime.now(MARKET_TZ),
-                        currency='USD',
-                        market=market
-                    )
-            return None
-        except Exception as e:
-            # print(f"Error fetching {ticker}: {e}")
+            if resp.status_code != 200:
+                print(f"Error fetching KR listing: HTTP {resp.status_code}")
+                return snapshot
+            for item in _iter_listing_items(resp):
+                symbol = item.get('cd')
+                if not symbol:
+                    continue
+                if (item.get('etf') is True or item.get('etn') is True) and symbol not in keep:
+                    continue
+                snapshot[symbol] = Stock(
+                    symbol=symbol,
+                    name=item.get('nm'),
+                    price=_to_float(item.get('nv', 0)),
+                    change=_to_float(item.get('cv', 0)),
+                    change_percent=_to_float(item.get('cr', 0)),
+                    updated_at=now,
+                    currency='KRW',
+                    market='KOSDAQ' if item.get('kosdaq') is True else 'KRX'
+                )
+        finally:
+            resp.close()
+    except Exception as e:
+        print(f"Error fetching KR listing: {e}")
+    print(f"Fetched KR listing: {len(snapshot)} stocks.")
+    return snapshot
+
+US_SUFFIXES = ['.O', '.N', '.A', '', '.K']
+
+def _us_market_from_suffix(suffix: str) -> str:
+    return 'NASDAQ' if suffix == '.O' else ('NYSE' if suffix == '.N' else ('AMEX' if suffix == '.A' else 'US'))
+
+def _parse_us_basic(ticker: str, kor_name: str, suffix: str, data) -> Optional[Stock]:
+    # Skip empty or invalid data
+    if not data or not isinstance(data, dict) or 'closePrice' not in data:
+        return None
+    try:
+        price = float(str(data.get('closePrice', '0')).replace(',', ''))
+        if price <= 0:
             return None
+        change = float(str(data.get('compareToPreviousClosePrice', '0')).replace(',', ''))
+        ratio = float(data.get('fluctuationsRatio', 0))
+    except (ValueError, TypeError):
+        return None
 
-    # Use ThreadPoolExecutor for parallel requests
-    # Conservative: 5 workers to be safer
-    max_workers = 5
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_ticker = {
-            executor.submit(fetch_single, ticker, name): ticker 
-            for ticker, name in US_TICKER_MAP.items()
-        }
-        
-        for future in as_completed(future_to_ticker):
-            ticker = future_to_ticker[future]
-            try:
-                stock = future.result()
-                if stock:
-                    snapshot[ticker] = stock
-            except Exception as e:
-                print(f"[{ticker}] Generated an exception: {e}")
+    return Stock(
+        symbol=ticker,
+        name=kor_name,
+        price=price,
+        change=change,
+        change_percent=ratio,
+        updated_at=datetime.now(MARKET_TZ),
+        currency='USD',
+        market=_us_market_from_suffix(suffix)
+    )
 
-    print(f"Fetched {len(snapshot)} US stocks (Parallel).")
+def fetch_us_stocks() -> Dict[str, Stock]:
+    """
+    Fetch a snapshot of selected US stocks via Naver API.
+    Suffixes are probed in rounds: every unresolved ticker is tried with the
+    next suffix in one concurrent batch over the shared keep-alive client.
+    """
+    print(f"Fetching latest US snapshot ({len(US_TICKER_MAP)} tickers) in parallel...")
+    snapshot: Dict[str, Stock] = {}
+    pending = dict(US_TICKER_MAP)
+    # Cached suffix first, then the optimal order: .O (Nasdaq), .N (NYSE), .A (AMEX), "", .K
+    probe_order = {ticker: suffix_cache.ordered(ticker, US_SUFFIXES) for ticker in pending}
+
+    for round_idx in range(len(US_SUFFIXES)):
+        if not pending:
+            break
+        tickers = list(pending.keys())
+        urls = [f"https://api.stock.naver.com/stock/{t}{probe_order[t][round_idx]}/basic" for t in tickers]
+        for ticker, (status, data) in zip(tickers, http.get_many_status(urls, timeout=5)):
+            suffix = probe_order[ticker][round_idx]
+            stock = _parse_us_basic(ticker, pending[ticker], suffix, data)
+            if stock:
+                snapshot[ticker] = stock
+                suffix_cache.set(ticker, suffix)
+                del pending[ticker]
+            elif round_idx == 0 and status == 404 and suffix_cache.get(ticker) == suffix:
+                # Cached exchange no longer serves this ticker. Timeouts and
+                # 429s keep the entry, or a rate-limit burst would force a
+                # full re-probe of every ticker.
+                suffix_cache.invalidate(ticker)
+
+    suffix_cache.save()
+    print(f"Fetched {len(snapshot)} US stocks (Parallel). Cache misses: {len(US_TICKER_MAP) - len(snapshot)}")
     return snapshot
 
 def fetch_exchange_rate() -> float:
@@ -242,7 +294,7 @@ def fetch_exchange_rate() -> float:
     """
     try:
         url = "https://api.stock.naver.com/marketindex/majors/part1"
-        resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=5)
+        resp = http.get(url, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             for item in data.get('majors', []):
@@ -251,9 +303,11 @@ def fetch_exchange_rate() -> float:
     except Exception as e:
         print(f"Error fetching exchange rate from Naver: {e}")
     
-    # Fallback to fdr if Naver fails (since we decided to keep fdr for now)
+    # Fallback to fdr if Naver fails (since we decided to keep fdr for now).
+    # Imported here: FinanceDataReader pulls in pandas, which is slow to load.
     try:
-        df = fdr.DataReader('USD/KRW', start=(datetime.now() - pd.Timedelta(days=5)).strftime('%Y-%m-%d'))
+        import FinanceDataReader as fdr
+        df = fdr.DataReader('USD/KRW', start=(datetime.now() - timedelta(days=5)).strftime('%Y-%m-%d'))
         if not df.empty:
             return float(df.iloc[-1]['Close'])
     except Exception as e:
@@ -263,19 +317,15 @@ def fetch_exchange_rate() -> float:
 def fetch_single_stock(symbol: str) -> Optional[Stock]:
     """
     Fetch data for a single stock (KR or US) via Naver API.
+    Requests are paced by the client's per-host rate limiter.
     """
-    time.sleep(0.1) # Mandatory 100ms throttle
-
-    # Heuristic: 6 chars with at least one digit is likely a KR symbol (including those with letters like 0013V0)
-    is_kr = len(symbol) == 6 and any(c.isdigit() for c in symbol)
-    is_us = not is_kr
-    headers = {"User-Agent": "Mozilla/5.0"}
+    is_us = not is_kr_symbol(symbol)
     
     try:
         if not is_us:
             # KR Stock
             url = f"https://m.stock.naver.com/api/stock/{symbol}/basic"
-            resp = requests.get(url, headers=headers, timeout=5)
+            resp = http.get(url, timeout=5)
             if resp.status_code == 200:
                 data = resp.json()
                 price = float(str(data.get('closePrice', '0')).replace(',', ''))
@@ -296,15 +346,20 @@ def fetch_single_stock(symbol: str) -> Optional[Stock]:
                     market=market
                 )
         else:
-            # US Stock - Try suffixes
-            for suffix in ['.O', '', '.K', '.N', '.A']:
+            # US Stock - Try suffixes (last resolved suffix first)
+            cached_suffix = suffix_cache.get(symbol)
+            for suffix in suffix_cache.ordered(symbol, ['.O', '', '.K', '.N', '.A']):
                 url = f"https://api.stock.naver.com/stock/{symbol}{suffix}/basic"
-                resp = requests.get(url, headers=headers, timeout=5)
+                resp = http.get(url, timeout=5)
+                if resp.status_code == 404 and suffix == cached_suffix:
+                    suffix_cache.invalidate(symbol)
                 if resp.status_code == 200:
                     data = resp.json()
                     price = float(str(data.get('closePrice', '0')).replace(',', ''))
                     change = float(str(data.get('compareToPreviousClosePrice', '0')).replace(',', ''))
                     ratio = float(data.get('fluctuationsRatio', 0))
+                    suffix_cache.set(symbol, suffix)
+                    suffix_cache.save()
                     
                     return Stock(
                         symbol=symbol,
@@ -316,16 +371,135 @@ def fetch_single_stock(symbol: str) -> Optional[Stock]:
                         currency='USD',
                         market='NASDAQ' if suffix == '.O' else ('NYSE' if suffix == '.N' else 'AMEX')
                     )
-                time.sleep(0.1)
                 
     except Exception as e:
         print(f"Error fetching single stock {symbol}: {e}")
     return None
 
+REALTIME_CHUNK_SIZE = 50
+# Symbols whose single-fetch fallback failed are not retried until their
+# backoff expires (doubling per consecutive failure), so a delisted ticker
+# does not cost up to 5 suffix probes on every poll.
+SINGLE_MISS_BACKOFF_SEC = 60
+SINGLE_MISS_MAX_BACKOFF_SEC = 60 * 60
+_single_misses: Dict[str, Tuple[float, float]] = {}  # symbol -> (retry_at, backoff)
+_single_misses_lock = threading.Lock()
+# Naver rise/fall flag: 1 upper limit, 2 rise, 3 flat, 4 lower limit, 5 fall
+FALLING_FLAGS = ('4', '5')
+
+def is_kr_symbol(symbol: str) -> bool:
+    # Heuristic: 6 chars with at least one digit is likely a KR symbol (including those with letters like 0013V0)
+    return len(symbol) == 6 and any(c.isdigit() for c in symbol)
+
+def _chunks(items: List[str], size: int) -> List[List[str]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _signed(value, falling: bool) -> float:
+    val = abs(_to_float(str(value).replace(',', '')) if value is not None else 0.0)
+    return -val if falling else val
+
+def _fetch_kr_realtime(symbols: List[str], market_hints: Dict[str, str]) -> Dict[str, Stock]:
+    results: Dict[str, Stock] = {}
+    urls = [
+        f"https://polling.finance.naver.com/api/realtime?query=SERVICE_ITEM:{','.join(chunk)}"
+        for chunk in _chunks(symbols, REALTIME_CHUNK_SIZE)
+    ]
+    for data in http.get_many(urls, timeout=5):
+        if not isinstance(data, dict):
+            continue
+        for area in data.get('result', {}).get('areas', []) or []:
+            for item in area.get('datas', []) or []:
+                symbol = item.get('cd')
+                price = _to_float(item.get('nv'))
+                if not symbol or price <= 0:
+                    continue
+                falling = str(item.get('rf')) in FALLING_FLAGS
+                results[symbol] = Stock(
+                    symbol=symbol,
+                    name=item.get('nm') or symbol,
+                    price=price,
+                    change=_signed(item.get('cv'), falling),
+                    change_percent=_signed(item.get('cr'), falling),
+                    updated_at=datetime.now(MARKET_TZ),
+                    currency='KRW',
+                    market=market_hints.get(symbol, 'KRX')
+                )
+    return results
+
+def _fetch_us_realtime(symbols: List[str]) -> Dict[str, Stock]:
+    results: Dict[str, Stock] = {}
+    # Only tickers with a known reuters suffix can go through the batch endpoint
+    codes = {f"{s}{suffix_cache.get(s)}": s for s in symbols if suffix_cache.get(s) is not None}
+    urls = [
+        f"https://polling.finance.naver.com/api/realtime/worldstock/stock/{','.join(chunk)}"
+        for chunk in _chunks(list(codes.keys()), REALTIME_CHUNK_SIZE)
+    ]
+    for data in http.get_many(urls, timeout=5):
+        if not isinstance(data, dict):
+            continue
+        for item in data.get('datas', []) or []:
+            symbol = codes.get(item.get('reutersCode'))
+            if not symbol:
+                continue
+            stock = _parse_us_basic(symbol, US_TICKER_MAP.get(symbol, item.get('stockName') or symbol),
+                                    suffix_cache.get(symbol), item)
+            if stock:
+                results[symbol] = stock
+    return results
+
+def _single_fallback(symbols: List[str]) -> Dict[str, Stock]:
+    now = time.monotonic()
+    with _single_misses_lock:
+        due = [s for s in symbols if _single_misses.get(s, (0.0, 0.0))[0] <= now]
+    if len(due) < len(symbols):
+        print(f"Skipping single fetch for {len(symbols) - len(due)} recently failed symbols.")
+
+    results: Dict[str, Stock] = {}
+    for symbol in due:
+        st = fetch_single_stock(symbol)
+        with _single_misses_lock:
+            if st:
+                results[symbol] = st
+                _single_misses.pop(symbol, None)
+            else:
+                backoff = _single_misses.get(symbol, (0.0, SINGLE_MISS_BACKOFF_SEC / 2))[1] * 2
+                backoff = min(backoff, SINGLE_MISS_MAX_BACKOFF_SEC)
+                _single_misses[symbol] = (time.monotonic() + backoff, backoff)
+    return results
+
+def fetch_realtime_quotes(symbols: Iterable[str], market_hints: Optional[Dict[str, str]] = None,
+                          single_fallback: bool = True) -> Dict[str, Stock]:
+    """
+    Fetch quotes for many symbols (KR and US) through Naver's multi-symbol
+    polling endpoint. Symbols are chunked and the chunks fetched concurrently.
+    Anything the batch endpoint does not return falls back to fetch_single_stock
+    (unless single_fallback is False, or the symbol failed that recently).
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+    market_hints = market_hints or {}
+    kr_symbols = [s for s in symbols if is_kr_symbol(s)]
+    us_symbols = [s for s in symbols if not is_kr_symbol(s)]
+
+    results = _fetch_kr_realtime(kr_symbols, market_hints) if kr_symbols else {}
+    if us_symbols:
+        results.update(_fetch_us_realtime(us_symbols))
+
+    missing = [s for s in symbols if s not in results]
+    if missing and single_fallback:
+        print(f"Realtime batch missed {len(missing)}/{len(symbols)} symbols. Falling back to single fetch...")
+        results.update(_single_fallback(missing))
+    return results
+
+# stocks/{symbol} payloads this process last committed, so re-sent quotes
+# that did not move are not written (and re-stamped) again
+_stock_write_cache = WriteCache()
+
 def commit_stock_changes(stocks_to_upsert: Iterable[Stock], symbols_to_delete: Iterable[str] = ()):
     """
     Write the provided stocks to Firestore and delete any stale symbols.
-    Only changed stocks should be passed in to minimize writes.
+    Stocks identical to their last committed write are skipped.
     """
     upserts = list(stocks_to_upsert)
     deletions = list(symbols_to_delete)
@@ -334,35 +508,26 @@ def commit_stock_changes(stocks_to_upsert: Iterable[Stock], symbols_to_delete: I
         print("No Firestore changes to commit.")
         return
 
-    batch = db.batch()
-    operation_count = 0
-
-    def flush_batch():
-        nonlocal batch, operation_count
-        if operation_count == 0:
-            return
-        batch.commit()
-        batch = db.batch()
-        operation_count = 0
-
+    writer = BulkWriter(db, cache=_stock_write_cache)
+    unchanged = 0
     for stock in upserts:
+        ref = db.collection('stocks').document(stock.symbol)
+        # Compare without the write stamp, which differs on every call
+        fields = {k: v for k, v in stock.to_dict().items() if k != 'updatedAt'}
+        if _stock_write_cache.unchanged(ref.path, fields):
+            unchanged += 1
+            continue
         # Stamp the write time right before persisting.
         stock.updated_at = datetime.now(MARKET_TZ)
-        doc_ref = db.collection('stocks').document(stock.symbol)
-        batch.set(doc_ref, stock.to_dict())
-        operation_count += 1
-        if operation_count >= 450:
-            flush_batch()
+        writer.set(ref, stock.to_dict())
 
     for symbol in deletions:
-        doc_ref = db.collection('stocks').document(symbol)
-        batch.delete(doc_ref)
-        operation_count += 1
-        if operation_count >= 450:
-            flush_batch()
+        writer.delete(db.collection('stocks').document(symbol))
 
-    flush_batch()
-    print(f"Committed {len(upserts)} stock updates and {len(deletions)} deletions.")
+    result = writer.flush()
+    if result.failed:
+        print(f"Failed to commit {result.failed} of {result.written + result.failed} stock writes.")
+    print(f"Committed {len(upserts) - unchanged} stock updates ({unchanged} unchanged) and {len(deletions)} deletions.")
 
 def update_stocks(limit: int = 100):
     """
@@ -381,7 +546,6 @@ def fetch_indices() -> Dict[str, Dict]:
     Fetch major market indices and indicators: KOSPI, KOSDAQ, S&P 500, Nasdaq, Dow Jones, Gold, Bitcoin.
     """
     results = {}
-    headers = {"User-Agent": "Mozilla/5.0"}
     
     # 1. Domestic & Global Indices
     index_map = {
@@ -393,11 +557,11 @@ def fetch_indices() -> Dict[str, Dict]:
     }
     
     print(f"Fetching latest market indices via Naver API...")
-    for name, url in index_map.items():
+    names = list(index_map.keys())
+    responses = http.get_many(index_map.values(), timeout=5)
+    for name, url, data in zip(names, index_map.values(), responses):
         try:
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.status_code == 200:
-                data = resp.json()
+            if data is not None:
                 # Local and Global have slightly different structures
                 if 'KOSPI' in url or 'KOSDAQ' in url:
                     # m.stock.naver.com/api/index/... returns a list of history
@@ -427,7 +591,7 @@ def fetch_indices() -> Dict[str, Dict]:
     # 2. Gold (Naver Majors Part 1 or 2)
     try:
         url = "https://api.stock.naver.com/marketindex/majors/part1"
-        resp = requests.get(url, headers=headers, timeout=5)
+        resp = http.get(url, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             for item in data.get('majors', []):
@@ -446,7 +610,7 @@ def fetch_indices() -> Dict[str, Dict]:
     # 3. Bitcoin (Upbit API)
     try:
         url = "https://api.upbit.com/v1/ticker?markets=KRW-BTC"
-        resp = requests.get(url, timeout=5)
+        resp = http.get(url, timeout=5)
         if resp.status_code == 200:
             data = resp.json()
             if data:
@@ -471,14 +635,31 @@ def fetch_indices() -> Dict[str, Dict]:
             
     return results
 
-def fetch_stock_history(symbol: str, days: int = 365) -> List[Dict]:
+def _history_item(candle) -> Dict:
+    date_str, open_val, high_val, low_val, close_val, volume = candle
+    return {'time': date_str, 'open': open_val, 'high': high_val, 'low': low_val, 'close': close_val, 'volume': volume}
+
+def _cache_candle(item: Dict):
+    # Same zero-fill as the backend chart fetcher so every cache reader sees identical candles
+    close_val = item['close']
+    return (item['time'], item['open'] or close_val, item['high'] or close_val,
+            item['low'] or close_val, close_val, item['volume'])
+
+def _oldest_page_date(page_data: List[Dict]) -> str:
+    dates = [item.get('localTradedAt', '')[:10] for item in page_data if item.get('localTradedAt')]
+    return min(dates) if dates else ''
+
+def fetch_stock_history(symbol: str, days: int = 365, since: Optional[str] = None) -> List[Dict]:
     """
     Fetches historical daily data using Naver Finance API with paging.
     Returns a list of dicts suitable for Lightweight Charts:
     [{ 'time': '2023-01-01', 'open': 100, 'high': 110, 'low': 90, 'close': 105, 'volume': 1000 }, ...]
+
+    With `since` (YYYY-MM-DD, the latest date already stored), paging stops
+    once that date is reached and only candles on/after it are returned.
+    The `since` candle itself is re-sent so a partial last candle gets corrected.
     """
     is_us = any(c.isalpha() for c in symbol)
-    headers = {"User-Agent": "Mozilla/5.0"}
     
     # Naver API has a limit on pageSize (around 60). We use paging to get more days.
     pageSize = 60
@@ -486,6 +667,11 @@ def fetch_stock_history(symbol: str, days: int = 365) -> List[Dict]:
     max_pages = 5
     all_history_data = []
 
+    # Serve from the shared OHLCV cache when another job fetched this symbol recently
+    cached = ohlcv.get(symbol) if ohlcv.is_fresh(symbol) else []
+    if cached and ((since and cached[0][0] <= since) or len(cached) >= pageSize * max_pages):
+        return [_history_item(c) for c in cached[-pageSize * max_pages:] if not since or c[0] >= since]
+
     try:
         def parse_val(v):
             if v is None: return 0.0
@@ -495,30 +681,34 @@ def fetch_stock_history(symbol: str, days: int = 365) -> List[Dict]:
             if not is_us:
                 # KR Stock
                 url = f"https://m.stock.naver.com/api/stock/{symbol}/price?pageSize={pageSize}&page={page}"
-                resp = requests.get(url, headers=headers, timeout=5)
+                resp = http.get(url, timeout=5)
                 if resp.status_code == 200:
                     page_data = resp.json()
                     if isinstance(page_data, list) and len(page_data) > 0:
                         all_history_data.extend(page_data)
+                        if since and _oldest_page_date(page_data) <= since: break
                     else: break
                 else: break
             else:
-                # US Stock - Try suffixes
-                suffixes = ['', '.O', '.N', '.A', '.K']
+                # US Stock - Try suffixes (last resolved suffix first)
+                cached_suffix = suffix_cache.get(symbol)
                 page_data_found = False
-                for suffix in suffixes:
+                for suffix in suffix_cache.ordered(symbol, ['', '.O', '.N', '.A', '.K']):
                     url = f"https://api.stock.naver.com/stock/{symbol}{suffix}/price?pageSize={pageSize}&page={page}"
-                    resp = requests.get(url, headers=headers, timeout=5)
+                    resp = http.get(url, timeout=5)
+                    if resp.status_code == 404 and suffix == cached_suffix:
+                        suffix_cache.invalidate(symbol)
                     if resp.status_code == 200:
                         data = resp.json()
                         if isinstance(data, list) and len(data) > 0:
                             all_history_data.extend(data)
                             page_data_found = True
+                            if suffix != cached_suffix:
+                                suffix_cache.set(symbol, suffix)
+                                suffix_cache.save()
                             break
                 if not page_data_found: break
-            
-            # Throttle between pages
-            time.sleep(0.1)
+                if since and _oldest_page_date(data) <= since: break
 
         if not all_history_data:
             print(f"No history found for {symbol}")
@@ -547,10 +737,23 @@ def fetch_stock_history(symbol: str, days: int = 365) -> List[Dict]:
         seen_times = set()
         unique_data = []
         for d in formatted_data:
+            if since and d['time'] < since:
+                continue
             if d['time'] not in seen_times:
                 unique_data.append(d)
                 seen_times.add(d['time'])
-                
+
+        # Append when the fetched range joins the cached one. Otherwise only a
+        # full-window fetch replaces the cache; a `since` delta holds just the
+        # newest days, so it is not cached rather than wiping the history
+        # down to those candles or leaving a hole
+        candles = [_cache_candle(d) for d in unique_data]
+        cache_latest = ohlcv.latest_date(symbol)
+        gap = bool(cache_latest) and bool(unique_data) and unique_data[0]['time'] > cache_latest
+        if not gap:
+            ohlcv.put(symbol, candles)
+        elif not since:
+            ohlcv.put(symbol, candles, replace=True)
         return unique_data
 
     except Exception as e:
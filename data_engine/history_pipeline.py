@@ -0,0 +1,220 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from supabase_client import get_supabase
+
+HISTORY_TABLE = "stock_history"
+
+# Progress of the current day's history run, so a crashed run resumes
+# with the symbols it had not written yet.
+CHECKPOINT_PATH = os.getenv(
+    'HISTORY_CHECKPOINT_PATH',
+    os.path.join(os.path.dirname(__file__), 'history_checkpoint.json')
+)
+
+LATEST_RPC = "stock_history_latest"  # see stock_history_latest.sql
+LATEST_CHUNK = 500
+
+FETCH_WORKERS = 4
+UPSERT_BATCH_ROWS = 5000
+UPSERT_RETRIES = 3
+
+_DONE = object()
+
+
+def to_history_rows(symbol: str, candles: Iterable[Dict]) -> List[Dict]:
+    """Convert fetch_stock_history candles into stock_history rows."""
+    return [{
+        "symbol": symbol,
+        "time": item["time"],
+        "open": item["open"],
+        "high": item["high"],
+        "low": item["low"],
+        "close": item["close"],
+        "volume": item.get("volume", 0)
+    } for item in candles]
+
+
+def upsert_history_rows(rows: List[Dict], retries: int = UPSERT_RETRIES):
+    """Upsert rows into stock_history (idempotent on symbol,time), retrying transient failures."""
+    supabase = get_supabase()
+    if not supabase:
+        raise RuntimeError("Supabase client not initialized. Check SUPABASE_URL/KEY.")
+    for attempt in range(retries + 1):
+        try:
+            supabase.table(HISTORY_TABLE).upsert(rows, on_conflict="symbol,time").execute()
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(1.0 * (2 ** attempt))
+
+
+def get_latest_history_times(symbols: Iterable[str]) -> Dict[str, str]:
+    """
+    Latest stored candle date (YYYY-MM-DD) per symbol, via one grouped query
+    per chunk of symbols. Symbols without stored history are absent.
+    Falls back to a per-symbol lookup if the RPC is not installed.
+    """
+    supabase = get_supabase()
+    if not supabase:
+        return {}
+    symbols = list(dict.fromkeys(symbols))
+    latest: Dict[str, str] = {}
+    try:
+        for i in range(0, len(symbols), LATEST_CHUNK):
+            resp = supabase.rpc(LATEST_RPC, {"symbols": symbols[i:i + LATEST_CHUNK]}).execute()
+            for row in resp.data or []:
+                if row.get("last_time"):
+                    latest[row["symbol"]] = str(row["last_time"])[:10]
+        return latest
+    except Exception as e:
+        print(f"{LATEST_RPC} RPC unavailable ({e}). Falling back to per-symbol lookups.")
+
+    for symbol in symbols:
+        try:
+            resp = supabase.table(HISTORY_TABLE).select("time").eq("symbol", symbol) \
+                .order("time", desc=True).limit(1).execute()
+            if resp.data:
+                latest[symbol] = str(resp.data[0]["time"])[:10]
+        except Exception as e:
+            print(f"Error looking up latest history for {symbol}: {e}")
+    return latest
+
+
+class HistoryCheckpoint:
+    """Symbols already written for a given run date, persisted after each upsert."""
+
+    def __init__(self, run_date: str, path: str = CHECKPOINT_PATH):
+        self.run_date = run_date
+        self.path = path
+        self.done: Set[str] = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('runDate') == self.run_date:
+                self.done = set(data.get('done', []))
+        except Exception as e:
+            print(f"Error loading history checkpoint ({self.path}): {e}")
+
+    def mark_done(self, symbols: Iterable[str]):
+        with self._lock:
+            self.done.update(symbols)
+            payload = {'runDate': self.run_date, 'done': sorted(self.done)}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving history checkpoint ({self.path}): {e}")
+
+    def clear(self):
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except Exception as e:
+            print(f"Error removing history checkpoint ({self.path}): {e}")
+
+
+@dataclass
+class HistoryRunResult:
+    total: int = 0
+    resumed: int = 0
+    written: int = 0
+    empty: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    rows: int = 0
+    upserts: int = 0
+
+
+def run_history_pipeline(symbols: Iterable[str], fetch: Callable[[str], List[Dict]],
+                         run_date: Optional[str] = None, workers: int = FETCH_WORKERS,
+                         batch_rows: int = UPSERT_BATCH_ROWS) -> HistoryRunResult:
+    """
+    Fetch candles for many symbols on a bounded worker pool and write them
+    through a single writer that coalesces rows from many symbols into large
+    multi-symbol upserts. Symbols are checkpointed once their rows are
+    committed; re-running on the same run_date skips them.
+    """
+    run_date = run_date or datetime.now().strftime("%Y-%m-%d")
+    checkpoint = HistoryCheckpoint(run_date)
+    symbols = list(dict.fromkeys(symbols))
+    todo = [s for s in symbols if s not in checkpoint.done]
+    result = HistoryRunResult(total=len(symbols), resumed=len(symbols) - len(todo))
+    if result.resumed:
+        print(f"Resuming history run {run_date}: {result.resumed} symbols already written.")
+
+    # Bounded hand-off between fetchers and the writer keeps memory flat.
+    rows_queue: "queue.Queue" = queue.Queue(maxsize=workers * 4)
+
+    def fetch_one(symbol: str):
+        try:
+            candles = fetch(symbol)
+        except Exception as e:
+            print(f"Error fetching history for {symbol}: {e}")
+            candles = None
+        rows_queue.put((symbol, candles))
+
+    def writer():
+        pending_rows: List[Dict] = []
+        pending_symbols: List[str] = []
+
+        def flush():
+            if not pending_rows:
+                return
+            try:
+                upsert_history_rows(pending_rows)
+                result.rows += len(pending_rows)
+                result.upserts += 1
+                result.written += len(pending_symbols)
+                checkpoint.mark_done(pending_symbols)
+            except Exception as e:
+                print(f"Error upserting {len(pending_rows)} history rows ({len(pending_symbols)} symbols): {e}")
+                result.failed.extend(pending_symbols)
+            pending_rows.clear()
+            pending_symbols.clear()
+
+        processed = 0
+        while True:
+            item = rows_queue.get()
+            if item is _DONE:
+                break
+            symbol, candles = item
+            processed += 1
+            if candles is None:
+                result.failed.append(symbol)
+            elif not candles:
+                result.empty.append(symbol)
+            else:
+                pending_rows.extend(to_history_rows(symbol, candles))
+                pending_symbols.append(symbol)
+                if len(pending_rows) >= batch_rows:
+                    flush()
+            if processed % 50 == 0:
+                print(f"History progress: {processed}/{len(todo)} fetched, {result.rows} rows written.")
+        flush()
+
+    writer_thread = threading.Thread(target=writer, name="history-writer", daemon=True)
+    writer_thread.start()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="history-fetch") as executor:
+        list(executor.map(fetch_one, todo))
+    rows_queue.put(_DONE)
+    writer_thread.join()
+
+    if not result.failed:
+        checkpoint.clear()
+    return result
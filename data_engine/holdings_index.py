@@ -0,0 +1,98 @@
+from typing import Dict, Optional, Set
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_transaction import BaseTransaction
+from firestore_client import db
+
+# Single document holding symbol -> number of users with a non-zero position.
+# Kept in step inside the trade transactions (trade_executor here, and the
+# backend trade engine, minigame and portfolio actions via
+# backend/holdings_index.py) and corrected from the portfolios by
+# reconcile_holdings() to catch drift from other writers (manual fixes,
+# scripts).
+HOLDINGS_COLLECTION = "system"
+HOLDINGS_DOCUMENT = "held_symbols"
+
+
+def holdings_ref():
+    return db.collection(HOLDINGS_COLLECTION).document(HOLDINGS_DOCUMENT)
+
+
+def holder_delta(old_qty: float, new_qty: float) -> int:
+    """+1 when a position opens, -1 when it closes, 0 otherwise."""
+    if old_qty == 0 and new_qty != 0:
+        return 1
+    if old_qty != 0 and new_qty == 0:
+        return -1
+    return 0
+
+
+def record_position_change(transaction: BaseTransaction, symbol: str, old_qty: float, new_qty: float):
+    """Queue the holder-count update on the caller's transaction (write only, no read)."""
+    delta = holder_delta(old_qty, new_qty)
+    if delta == 0:
+        return
+    transaction.set(holdings_ref(), {
+        "counts": {symbol: firestore.Increment(delta)},
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def get_holder_counts() -> Optional[Dict[str, int]]:
+    """Current symbol -> holder count map, or None if the index has not been built yet."""
+    snap = holdings_ref().get()
+    if not snap.exists:
+        return None
+    counts = (snap.to_dict() or {}).get("counts") or {}
+    return {symbol: int(count) for symbol, count in counts.items()}
+
+
+def get_held_symbols() -> Optional[Set[str]]:
+    counts = get_holder_counts()
+    if counts is None:
+        return None
+    return {symbol for symbol, count in counts.items() if count > 0}
+
+
+def reconcile_holdings() -> Dict[str, int]:
+    """
+    Rebuild the index from every users/{uid}/portfolio doc and correct the
+    symbols that drifted. This is the only place that still scans all
+    portfolios.
+
+    Trades keep incrementing the index while the scan runs, so the fix is
+    applied in a transaction on the index doc: only symbols whose stored
+    count did not move during the scan are corrected, with an Increment of
+    the difference. Anything a trade touched is left for the next run.
+    """
+    before = get_holder_counts() or {}
+    counts: Dict[str, int] = {}
+    for doc in db.collection_group("portfolio").stream():
+        data = doc.to_dict() or {}
+        if data.get("quantity", 0) != 0:
+            counts[doc.id] = counts.get(doc.id, 0) + 1
+
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def apply_fixes(transaction) -> int:
+        snap = holdings_ref().get(transaction=transaction)
+        stored = {s: int(c) for s, c in ((snap.to_dict() or {}).get("counts") or {}).items()} if snap.exists else {}
+        fixes = {}
+        for symbol in set(stored) | set(counts):
+            current, target = stored.get(symbol, 0), counts.get(symbol, 0)
+            if current == target or before.get(symbol, 0) != current:
+                continue
+            # Symbols nobody holds any more are dropped from the map
+            fixes[symbol] = firestore.DELETE_FIELD if target == 0 else firestore.Increment(target - current)
+        if fixes or not snap.exists:
+            transaction.set(holdings_ref(), {
+                "counts": fixes,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+        return len(fixes)
+
+    fixed = apply_fixes(transaction)
+    if fixed:
+        print(f"Holdings index drift on {fixed} symbols. Corrected.")
+    return counts
@@ -1,8 +1,10 @@
 import random
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any
+import numpy as np
 from firebase_admin import firestore
 from firestore_client import db
+from equity_engine import PositionBookBuilder, compute_equity
 
 # Mission Types and their configurations
 MISSION_POOL = [
@@ -201,12 +203,17 @@ def update_mission_progress(uid: str):
     
     # 3. Fetch Portfolio (for total asset calculation)
     portfolio_docs = db.collection("users").document(uid).collection("portfolio").stream()
-    total_valuation = 0
+    builder = PositionBookBuilder()
+    builder.add_user(uid)
+    current_prices = []
     for doc in portfolio_docs:
         data = doc.to_dict()
-        qty = data.get("quantity", 0)
-        price = data.get("currentPrice", 0)
-        total_valuation += abs(qty) * price
+        if data.get("quantity", 0):
+            builder.add_position(uid, doc.id, data.get("quantity", 0), data.get("averagePrice", 0))
+            current_prices.append(data.get("currentPrice", 0) or 0)
+    book = builder.build()
+    result = compute_equity(book, np.asarray(current_prices, dtype=np.float64), [user_doc.get("balance", 0)])
+    total_valuation = float(result.gross_value[0])
 
     total_assets = (user_doc.get("balance", 0) + total_valuation)
     used_credit = user_doc.get("usedCredit", 0)
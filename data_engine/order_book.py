@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from firestore_client import db
+
+# Pending limit orders live in active_orders/{orderId} with status PENDING.
+ORDERS_COLLECTION = "active_orders"
+
+
+@dataclass
+class LimitOrder:
+    order_id: str
+    uid: str
+    symbol: str
+    name: str
+    side: str            # BUY or SELL
+    target_price: float  # in `currency`
+    quantity: float
+    currency: str        # KRW or USD
+    seq: int = 0         # heap entry generation; stale entries are skipped
+
+
+def parse_order(order_id: str, data: Dict[str, Any]) -> Optional[LimitOrder]:
+    if data.get("status") != "PENDING":
+        return None
+    side = data.get("type")
+    target = data.get("targetPrice")
+    if side not in ("BUY", "SELL") or target is None or not data.get("symbol"):
+        return None
+    return LimitOrder(
+        order_id=order_id,
+        uid=data.get("uid"),
+        symbol=data["symbol"],
+        name=data.get("name", data["symbol"]),
+        side=side,
+        target_price=float(target),
+        quantity=data.get("quantity"),
+        currency=data.get("currency", "KRW"),
+    )
+
+
+class _Book:
+    """BUY max-heap and SELL min-heap for one (symbol, order currency)."""
+
+    def __init__(self):
+        self.buys: List[Tuple[float, int, str]] = []   # (-target, seq, order_id)
+        self.sells: List[Tuple[float, int, str]] = []  # (target, seq, order_id)
+
+    def __bool__(self):
+        return bool(self.buys or self.sells)
+
+
+class OrderBook:
+    """
+    In-memory book of pending limit orders, loaded once and kept in sync by
+    a Firestore on_snapshot listener on active_orders (status == PENDING).
+
+    Orders are indexed per symbol and order currency in price-ordered heaps,
+    so a price tick only touches the orders that actually cross. Entries
+    are removed lazily: a heap entry is live only while its order is still
+    in the book with the same seq.
+    """
+
+    def __init__(self):
+        self._orders: Dict[str, LimitOrder] = {}
+        self._books: Dict[Tuple[str, str], _Book] = {}
+        self._claimed: Set[str] = set()  # handed out for execution, awaiting their status write
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+
+    # --- lifecycle ---
+
+    def start(self):
+        query = db.collection(ORDERS_COLLECTION).where(filter=FieldFilter("status", "==", "PENDING"))
+        self._watch = query.on_snapshot(self._on_snapshot)
+        print(f"Order book listening on {ORDERS_COLLECTION} (PENDING).")
+
+    def stop(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                print(f"Error closing order book listener: {e}")
+            self._watch = None
+
+    def restart(self):
+        """Re-open the listener; its initial snapshot rebuilds the book from scratch."""
+        self.stop()
+        with self._lock:
+            self._orders.clear()
+            self._books.clear()
+            self._claimed.clear()
+            self._ready.clear()
+        self.start()
+
+    def wait_ready(self, timeout: float = 0) -> bool:
+        return self._ready.wait(timeout)
+
+    # --- listener ---
+
+    def _on_snapshot(self, docs, changes, read_time):
+        try:
+            with self._lock:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == "REMOVED":
+                        self._remove(doc.id)
+                        self._claimed.discard(doc.id)
+                        continue
+                    if doc.id in self._claimed:
+                        continue
+                    order = parse_order(doc.id, doc.to_dict() or {})
+                    if order is None:
+                        self._remove(doc.id)
+                    else:
+                        self._add(order)
+                self._ready.set()
+        except Exception as e:
+            print(f"Error applying order book snapshot: {e}")
+
+    def _add(self, order: LimitOrder):
+        order.seq = next(self._seq)
+        self._orders[order.order_id] = order
+        book = self._books.setdefault((order.symbol, order.currency), _Book())
+        if order.side == "BUY":
+            heapq.heappush(book.buys, (-order.target_price, order.seq, order.order_id))
+        else:
+            heapq.heappush(book.sells, (order.target_price, order.seq, order.order_id))
+
+    def _remove(self, order_id: str) -> Optional[LimitOrder]:
+        # Heap entries go stale and are dropped when they reach the top.
+        return self._orders.pop(order_id, None)
+
+    def _live(self, heap: List[Tuple[float, int, str]]) -> Optional[LimitOrder]:
+        while heap:
+            _, seq, order_id = heap[0]
+            order = self._orders.get(order_id)
+            if order is not None and order.seq == seq:
+                return order
+            heapq.heappop(heap)
+        return None
+
+    # --- matching ---
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list({symbol for (symbol, _), book in self._books.items() if book})
+
+    def __len__(self):
+        return len(self._orders)
+
+    def take_crossing(self, symbol: str, price: float, price_currency: str, exchange_rate: float) -> List[LimitOrder]:
+        """
+        Pop every order on symbol whose target the current price crosses:
+        BUY when price <= target, SELL when price >= target. Taken orders
+        are claimed so listener echoes cannot hand them out twice.
+        """
+        taken: List[LimitOrder] = []
+        with self._lock:
+            for currency in ("KRW", "USD"):
+                book = self._books.get((symbol, currency))
+                if not book:
+                    continue
+                # Same comparison as before: only KRW orders on USD stocks are converted
+                compare = price * exchange_rate if currency == "KRW" and price_currency == "USD" else price
+
+                order = self._live(book.buys)
+                while order is not None and compare <= order.target_price:
+                    heapq.heappop(book.buys)
+                    taken.append(self._claim(order))
+                    order = self._live(book.buys)
+
+                order = self._live(book.sells)
+                while order is not None and compare >= order.target_price:
+                    heapq.heappop(book.sells)
+                    taken.append(self._claim(order))
+                    order = self._live(book.sells)
+
+                if not book:
+                    del self._books[(symbol, currency)]
+        return taken
+
+    def _claim(self, order: LimitOrder) -> LimitOrder:
+        self._orders.pop(order.order_id, None)
+        self._claimed.add(order.order_id)
+        return order
+
+
+order_book = OrderBook()
+
+def get_order_book() -> OrderBook:
+    return order_book
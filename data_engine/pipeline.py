@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Callable, Deque, Dict, List, Mapping, Optional
+
+from price_store import PriceFrame
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Immutable price snapshot produced by the fetch stage."""
+    version: int
+    created_at: datetime
+    created_mono: float
+    frame: PriceFrame
+    exchange_rate: float
+    indices: Mapping[str, Dict]
+    # False for tier patches, which only carry changed stock rows downstream
+    full: bool = True
+
+    @property
+    def stocks(self) -> PriceFrame:
+        return self.frame
+
+    def age(self) -> float:
+        return time.monotonic() - self.created_mono
+
+
+def make_snapshot(version: int, created_at: datetime, frame: PriceFrame,
+                  exchange_rate: float, indices: Dict[str, Dict], full: bool = True) -> Snapshot:
+    return Snapshot(
+        version=version,
+        created_at=created_at,
+        created_mono=time.monotonic(),
+        frame=frame,
+        exchange_rate=exchange_rate,
+        indices=MappingProxyType(dict(indices)),
+        full=full,
+    )
+
+
+class SnapshotQueue:
+    """
+    Bounded staging queue. Producers never block: when full, the oldest
+    snapshot is dropped. Consumers always take the newest one and skip
+    anything older, so a slow stage only ever works on fresh data.
+    """
+
+    def __init__(self, maxsize: int = 2):
+        self._items: Deque[Snapshot] = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.skipped = 0
+
+    def put(self, snapshot: Snapshot):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(snapshot)
+            self._cond.notify()
+
+    def get_latest(self, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: bool(self._items), timeout=timeout):
+                return None
+            latest = self._items.pop()
+            self.skipped += len(self._items)
+            self._items.clear()
+            return latest
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+
+@dataclass
+class StageMetrics:
+    processed: int = 0
+    errors: int = 0
+    last_version: int = 0
+    last_duration: float = 0.0
+    last_latency: float = 0.0  # snapshot creation -> stage finished
+    max_latency: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'processed': self.processed,
+            'errors': self.errors,
+            'lastVersion': self.last_version,
+            'lastDurationSec': round(self.last_duration, 3),
+            'lastLatencySec': round(self.last_latency, 3),
+            'maxLatencySec': round(self.max_latency, 3),
+        }
+
+
+class Stage(threading.Thread):
+    """Worker that consumes the newest snapshot from its own queue."""
+
+    def __init__(self, name: str, handler: Callable[[Snapshot], None], maxsize: int = 2):
+        super().__init__(name=f"stage-{name}", daemon=True)
+        self.stage_name = name
+        self.handler = handler
+        self.queue = SnapshotQueue(maxsize=maxsize)
+        self.metrics = StageMetrics()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            snapshot = self.queue.get_latest(timeout=1.0)
+            if snapshot is None:
+                continue
+            started = time.monotonic()
+            try:
+                self.handler(snapshot)
+                self.metrics.processed += 1
+            except Exception as e:
+                self.metrics.errors += 1
+                print(f"Error in pipeline stage '{self.stage_name}': {e}")
+            finished = time.monotonic()
+            self.metrics.last_version = snapshot.version
+            self.metrics.last_duration = finished - started
+            self.metrics.last_latency = finished - snapshot.created_mono
+            self.metrics.max_latency = max(self.metrics.max_latency, self.metrics.last_latency)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> Dict:
+        stats = self.metrics.to_dict()
+        stats.update({
+            'queueDepth': self.queue.depth(),
+            'dropped': self.queue.dropped,
+            'skipped': self.queue.skipped,
+        })
+        return stats
+
+
+class SnapshotPipeline:
+    """Fans snapshots out from the fetch stage to independent consumer stages."""
+
+    def __init__(self):
+        self.stages: List[Stage] = []
+        self.published = 0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, handler: Callable[[Snapshot], None], maxsize: int = 2) -> Stage:
+        stage = Stage(name, handler, maxsize=maxsize)
+        self.stages.append(stage)
+        return stage
+
+    def next_version(self) -> int:
+        with self._lock:
+            self._version += 1
+            return self._version
+
+    def publish(self, snapshot: Snapshot):
+        self.published += 1
+        for stage in self.stages:
+            stage.queue.put(snapshot)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def stats(self) -> Dict:
+        return {
+            'published': self.published,
+            'stages': {stage.stage_name: stage.stats() for stage in self.stages},
+        }
+
+
+def run_periodic(name: str, interval_sec: float, func: Callable[[], None],
+                 initial_delay: float = 0.0) -> threading.Thread:
+    """
+    Run func every interval_sec on a dedicated thread. Runs never overlap:
+    if one takes longer than the interval, the next starts right after it.
+    """
+    def loop():
+        time.sleep(initial_delay)
+        while True:
+            started = time.monotonic()
+            try:
+                func()
+            except Exception as e:
+                print(f"Error in periodic task '{name}': {e}")
+            time.sleep(max(0.0, interval_sec - (time.monotonic() - started)))
+
+    thread = threading.Thread(target=loop, name=f"periodic-{name}", daemon=True)
+    thread.start()
+    return thread
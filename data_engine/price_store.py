@@ -0,0 +1,174 @@
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import Stock
+
+
+def _readonly(arr: np.ndarray) -> np.ndarray:
+    arr.flags.writeable = False
+    return arr
+
+
+class PriceFrame(Mapping):
+    """
+    Immutable, versioned columnar view of one price snapshot.
+
+    Prices live in NumPy columns addressed through a symbol -> row index, so
+    change detection and position valuation are array operations. The frame
+    still behaves like a read-only Dict[str, Stock] for code that needs the
+    full Stock (RTDB payloads, order execution).
+
+    When a new frame has the same symbol set as the previous one it reuses the
+    previous row layout (same index object), which makes diffs a straight
+    element-wise compare with no re-alignment.
+    """
+
+    def __init__(self, version: int, symbols: Tuple[str, ...], index: Dict[str, int], stocks: Tuple[Stock, ...]):
+        self.version = version
+        self.symbols = symbols
+        self.index = index
+        self._stocks = stocks
+        self.price = _readonly(np.fromiter((s.price for s in stocks), dtype=np.float64, count=len(stocks)))
+        self.change = _readonly(np.fromiter((s.change for s in stocks), dtype=np.float64, count=len(stocks)))
+        self.change_percent = _readonly(np.fromiter((s.change_percent for s in stocks), dtype=np.float64, count=len(stocks)))
+        self.is_usd = _readonly(np.fromiter((s.currency == 'USD' for s in stocks), dtype=bool, count=len(stocks)))
+        self.names = _readonly(np.array([s.name for s in stocks], dtype=object))
+        self.markets = _readonly(np.array([s.market for s in stocks], dtype=object))
+
+    @classmethod
+    def empty(cls) -> 'PriceFrame':
+        return cls(0, (), {}, ())
+
+    @classmethod
+    def build(cls, version: int, stocks: Mapping, layout: Optional['PriceFrame'] = None) -> 'PriceFrame':
+        """Build a frame from symbol -> Stock, reusing layout's row order if the symbol set is unchanged."""
+        if layout is not None and len(layout.index) == len(stocks) and all(s in layout.index for s in stocks):
+            symbols, index = layout.symbols, layout.index
+        else:
+            symbols = tuple(sorted(stocks))
+            index = {symbol: row for row, symbol in enumerate(symbols)}
+        return cls(version, symbols, index, tuple(stocks[s] for s in symbols))
+
+    # --- Mapping interface (symbol -> Stock) ---
+    def __getitem__(self, symbol: str) -> Stock:
+        return self._stocks[self.index[symbol]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.symbols)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol) -> bool:
+        return symbol in self.index
+
+    # --- Columnar helpers ---
+    def rows_for(self, symbols: Iterable[str]) -> np.ndarray:
+        """Row numbers for symbols (-1 where missing)."""
+        index = self.index
+        return np.fromiter((index.get(s, -1) for s in symbols), dtype=np.int64)
+
+    def symbols_at(self, rows: Iterable[int]) -> List[str]:
+        return [self.symbols[r] for r in rows]
+
+    def krw_prices(self, exchange_rate: float) -> np.ndarray:
+        """Price column converted to KRW (USD rows multiplied by the rate)."""
+        return self.price * np.where(self.is_usd, exchange_rate, 1.0)
+
+    def krw_prices_for(self, symbols: Sequence[str], exchange_rate: float) -> np.ndarray:
+        """KRW prices for symbols in the given order (NaN where missing)."""
+        rows = self.rows_for(symbols)
+        out = np.full(len(rows), np.nan)
+        found = rows >= 0
+        out[found] = self.krw_prices(exchange_rate)[rows[found]]
+        return out
+
+    def krw_price(self, symbol: str, exchange_rate: float) -> Optional[float]:
+        row = self.index.get(symbol)
+        if row is None:
+            return None
+        price = float(self.price[row])
+        return price * exchange_rate if self.is_usd[row] else price
+
+    def changed_since(self, prev: Optional['PriceFrame']) -> List[str]:
+        """Symbols whose price/change/change%/name/market differ from prev (or are new)."""
+        if prev is None or len(prev) == 0:
+            return list(self.symbols)
+
+        if prev.index is self.index:
+            prev_rows = np.arange(len(self))
+            present = np.ones(len(self), dtype=bool)
+        else:
+            prev_rows = prev.rows_for(self.symbols)
+            present = prev_rows >= 0
+            prev_rows = np.where(present, prev_rows, 0)
+
+        if len(prev_rows) == 0:
+            return []
+        mask = ~present
+        mask |= self.price != prev.price[prev_rows]
+        mask |= self.change != prev.change[prev_rows]
+        mask |= np.round(self.change_percent, 4) != np.round(prev.change_percent[prev_rows], 4)
+        mask |= self.names != prev.names[prev_rows]
+        mask |= self.markets != prev.markets[prev_rows]
+        return self.symbols_at(np.flatnonzero(mask))
+
+    def with_changes(self, updates: Optional[Mapping] = None, removed: Iterable[str] = (),
+                     version: Optional[int] = None) -> 'PriceFrame':
+        """Copy-on-write: a new frame with updates applied and removed symbols dropped."""
+        stocks = dict(self.items())
+        stocks.update(updates or {})
+        for symbol in removed:
+            stocks.pop(symbol, None)
+        return PriceFrame.build(self.version if version is None else version, stocks, layout=self)
+
+
+class PriceStore:
+    """
+    Holds the current PriceFrame. Readers take current() and keep working on
+    that version while writers publish new ones; frames are never mutated.
+    """
+
+    def __init__(self):
+        self._frame = PriceFrame.empty()
+        self._lock = threading.Lock()
+
+    def current(self) -> PriceFrame:
+        return self._frame
+
+    def publish(self, stocks: Mapping) -> PriceFrame:
+        with self._lock:
+            self._frame = PriceFrame.build(self._frame.version + 1, stocks, layout=self._frame)
+            return self._frame
+
+    def merge(self, stocks: Mapping, base: PriceFrame) -> PriceFrame:
+        """
+        Publish a full frame that the caller built from `base` (fresh quotes
+        plus rows carried over from base), keeping the newest row per symbol.
+        Rows patched in after base was taken (tier polls, re-fetches) win
+        unless the caller's quote is newer, and symbols removed since base
+        stay removed unless the caller fetched them again.
+        """
+        with self._lock:
+            current = self._frame
+            merged = dict(stocks)
+            for symbol, stock in current.items():
+                if base.get(symbol) is stock:
+                    continue  # untouched since base: the caller's view stands
+                incoming = merged.get(symbol)
+                if incoming is None or incoming.updated_at < stock.updated_at:
+                    merged[symbol] = stock
+            for symbol, stock in base.items():
+                if symbol not in current and merged.get(symbol) is stock:
+                    del merged[symbol]
+            self._frame = PriceFrame.build(current.version + 1, merged, layout=current)
+            return self._frame
+
+    def patch(self, updates: Optional[Mapping] = None, removed: Iterable[str] = ()) -> PriceFrame:
+        """Apply out-of-band fixes (e.g. a re-fetched quote) on top of the current frame."""
+        with self._lock:
+            self._frame = self._frame.with_changes(updates, removed, version=self._frame.version + 1)
+            return self._frame
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from firebase_admin import db as rtdb_admin
+
+# handler(key, data) where key is the child name under the watched node
+Handler = Callable[[str, Any], Any]
+
+
+class RequestDispatcher:
+    """
+    Turns RTDB listen() streams into per-child handler calls.
+    Each watched node gets its own small worker pool so a slow handler
+    (e.g. an LLM call) never starves the others. Events for the same child
+    are serialized: if a child changes while its handler runs, the handler
+    runs once more with fresh data afterwards.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Handler] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._listeners: List[Any] = []
+        self._lock = threading.Lock()
+        self._in_flight: Set[Tuple[str, str]] = set()
+        self._rerun: Set[Tuple[str, str]] = set()
+
+    def route(self, node: str, handler: Handler, workers: int = 2):
+        self._routes[node] = handler
+        self._executors[node] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"rtdb-{node}")
+
+    def start(self):
+        for node in self._routes:
+            listener = rtdb_admin.reference(node).listen(lambda event, n=node: self._on_event(n, event))
+            self._listeners.append(listener)
+            print(f"RTDB listener active on '{node}'.")
+
+    def stop(self):
+        for listener in self._listeners:
+            try:
+                listener.close()
+            except Exception as e:
+                print(f"Error closing RTDB listener: {e}")
+        self._listeners = []
+
+    def restart(self):
+        """Re-open all streams. The initial snapshot of each stream doubles as a catch-up pass."""
+        self.stop()
+        self.start()
+
+    def _on_event(self, node: str, event):
+        try:
+            path = event.path.strip('/')
+            parts = path.split('/') if path else []
+
+            if not parts:
+                # Initial load or whole-node write
+                if isinstance(event.data, dict):
+                    for key, value in event.data.items():
+                        self.submit(node, key, value)
+                return
+
+            key = parts[0]
+            if len(parts) == 1 and event.event_type == 'put':
+                self.submit(node, key, event.data)
+            else:
+                # Partial update (patch or deeper path): the handler needs the whole child
+                self.submit(node, key, None, reload=True)
+        except Exception as e:
+            print(f"Error dispatching RTDB event on '{node}': {e}")
+
+    def submit(self, node: str, key: str, data: Any, reload: bool = False):
+        task = (node, key)
+        with self._lock:
+            if task in self._in_flight:
+                self._rerun.add(task)
+                return
+            self._in_flight.add(task)
+        self._executors[node].submit(self._run, node, key, data, reload)
+
+    def _run(self, node: str, key: str, data: Any, reload: bool):
+        task = (node, key)
+        handler = self._routes[node]
+        try:
+            while True:
+                try:
+                    if reload:
+                        data = rtdb_admin.reference(f"{node}/{key}").get()
+                    if data is not None:
+                        handler(key, data)
+                except Exception as e:
+                    print(f"Error handling {node}/{key}: {e}")
+
+                with self._lock:
+                    if task not in self._rerun:
+                        return
+                    self._rerun.discard(task)
+                reload = True
+        finally:
+            with self._lock:
+                self._in_flight.discard(task)
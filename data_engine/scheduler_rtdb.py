@@ -1,20 +1,31 @@
 import argparse
 import schedule
+import threading
 import time
 import os
-from datetime import datetime, time as dt_time, timedelta
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from typing import Dict, Optional
 from firebase_admin import db as rtdb_admin
 from firebase_admin import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
-from groq import Groq
 
-from fetcher import fetch_top_stocks, fetch_us_stocks, fetch_exchange_rate, fetch_single_stock, fetch_stock_history, fetch_indices
+from fetcher import fetch_kr_listing, fetch_us_stocks, fetch_exchange_rate, fetch_single_stock, fetch_stock_history, fetch_indices, fetch_realtime_quotes, is_kr_symbol
 from models import Stock
+from price_store import PriceFrame, PriceStore
+from pipeline import Snapshot, SnapshotPipeline, make_snapshot, run_periodic
+from request_dispatcher import RequestDispatcher
+from naver_client import get_client
 import firestore_client  # Initializes Firebase app
 from firestore_client import db as firestore_db
 from trade_executor import buy_stock, sell_stock
+from holdings_index import get_held_symbols, reconcile_holdings
+from order_book import LimitOrder, get_order_book
+from fetch_tiers import FetchTiers, TICK_SEC as TIER_TICK_SEC
+from trading_calendar import TradingCalendar, get_krx_calendar, get_nyse_calendar
+from equity_engine import PositionBookBuilder, compute_equity
+from bulk_writer import BulkWriter
+from history_pipeline import get_latest_history_times, run_history_pipeline, to_history_rows, upsert_history_rows
 import mission_manager
 from supabase_client import get_supabase
 from dotenv import load_dotenv
@@ -25,59 +36,56 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 MARKET_TZ = ZoneInfo("Asia/Seoul")
 FETCH_INTERVAL_MINUTES = 1
 SYNC_INTERVAL_MINUTES = 1
-STOCK_LIMIT = 100
 DAILY_INTEREST_RATE = 0.001  # 0.1% per day
-
-latest_snapshot: Dict[str, Stock] = {}
-last_written_snapshot: Dict[str, Stock] = {}
+INDICES_REFRESH_INTERVAL = timedelta(hours=1)  # FX/indices cadence while both markets are closed
+CLOSE_GRACE = timedelta(minutes=30)  # keep fetching this long after a close for the final prints
+
+# Retention for finished RTDB request entries (see compact_request_nodes)
+SEARCH_REQUEST_RETENTION = timedelta(minutes=30)
+HISTORY_REQUEST_RETENTION = timedelta(days=1)
+
+# Columnar price snapshots: the store holds the latest frame, and the sync
+# stage remembers the frame it last wrote to diff against.
+price_store = PriceStore()
+last_written_frame: PriceFrame = PriceFrame.empty()
+# monotonic time of the last sync that also ran the RTDB cleanup and system writes
+last_full_sync: Optional[float] = None
 latest_exchange_rate: float = 1400.0
 latest_indices: Dict[str, Dict] = {}
 held_stocks_cache: set[str] = set()
 last_kr_fetch_time: Optional[datetime] = None
 last_us_fetch_time: Optional[datetime] = None
 last_indices_fetch_time: Optional[datetime] = None
+pipeline: Optional[SnapshotPipeline] = None
+order_book = get_order_book()
+# Realtime poll cadence per symbol (hot: held/ordered/moving, idle: backing off)
+fetch_tiers = FetchTiers()
+krx_calendar = get_krx_calendar()
+nyse_calendar = get_nyse_calendar()
 
 def now_kst() -> datetime:
     return datetime.now(MARKET_TZ)
 
-def has_stock_changed(new: Stock, old: Stock) -> bool:
-    return any((
-        new.price != old.price,
-        new.change != old.change,
-        round(new.change_percent, 4) != round(old.change_percent, 4),
-        new.name != old.name,
-        new.market != old.market,
-    ))
-
 def is_kr_market_open() -> bool:
-    now = now_kst()
-    # Mon-Fri (0-4)
-    if now.weekday() >= 5:
-        return False
-    return dt_time(9, 0) <= now.time() <= dt_time(15, 30)
+    return krx_calendar.is_open(now_kst())
 
 def is_us_market_open() -> bool:
-    now = now_kst()
-    # US Market: 23:30 - 06:00 KST (Approximately Mon night - Fri night in NY)
-    # This covers Mon 23:30 -> Tue 06:00, ..., Fri 23:30 -> Sat 06:00
-    t = now.time()
-    weekday = now.weekday()
-    
-    # Mon night to Fri night
-    if weekday <= 4: # Mon - Fri
-        if t >= dt_time(23, 30): return True
-    
-    # Tue morning to Sat morning
-    if 1 <= weekday <= 5: # Tue - Sat
-        if t <= dt_time(6, 0): return True
-        
-    return False
+    return nyse_calendar.is_open(now_kst())
+
+def needs_close_fetch(calendar: TradingCalendar, last: Optional[datetime], now: datetime) -> bool:
+    """
+    Off-hours fetch policy: keep fetching through CLOSE_GRACE after each close
+    (closing auction prints land a few minutes late), plus once more after
+    it if the last fetch fell inside it. Then quiet until the next session.
+    """
+    return last is None or last < calendar.previous_close(now) + CLOSE_GRACE
 
 def fetch_job(force: bool = False):
-    global latest_snapshot, latest_exchange_rate, latest_indices
+    global latest_exchange_rate, latest_indices
     global last_kr_fetch_time, last_us_fetch_time, last_indices_fetch_time
     
     now = now_kst()
+    prev_frame = price_store.current()
     print("-" * 60)
     print(f"[{now}] Starting fetch job cycle...")
     
@@ -85,17 +93,12 @@ def fetch_job(force: bool = False):
     us_stocks = {}
     
     # 1. KR Stocks Fetch Logic
-    should_fetch_kr = force or is_kr_market_open()
-    if not should_fetch_kr:
-        # Check if 1 hour has passed since last fetch
-        if last_kr_fetch_time is None or (now - last_kr_fetch_time) >= timedelta(hours=1):
-            should_fetch_kr = True
+    # Off-hours, fetching continues for a grace window after each close to
+    # pick up the closing prices; weekends and holidays fetch nothing.
+    should_fetch_kr = force or is_kr_market_open() or needs_close_fetch(krx_calendar, last_kr_fetch_time, now)
             
     if should_fetch_kr:
         print(f"[{now}] Fetching KR stocks (Market Open: {is_kr_market_open()})...")
-        # Fetch Top 100/100 (ETFs are already filtered out in fetcher side)
-        kr_stocks = fetch_top_stocks(limit=STOCK_LIMIT)
-        
         # --- Mandatory/Existing Symbol Coverage ---
         # Collect all symbols that MUST be updated
         mandatory_symbols = set(held_stocks_cache)
@@ -109,27 +112,29 @@ def fetch_job(force: bool = False):
                     mandatory_symbols.add(s)
         except Exception as e:
             print(f"Error fetching existing RTDB symbols: {e}")
+
+        # Whole market in one listing call (ETFs/ETNs only if mandatory)
+        kr_stocks = fetch_kr_listing(keep=mandatory_symbols)
             
-        # Identify missing symbols from the top fetch
-        missing_kr = mandatory_symbols - set(kr_stocks.keys())
+        # Only symbols the listing no longer carries (suspended, delisted, ...) need quotes
+        missing_kr = {s for s in mandatory_symbols if is_kr_symbol(s)} - set(kr_stocks.keys())
         if missing_kr:
-            print(f"[{now}] Fetching {len(missing_kr)} additional/existing KR stocks individually...")
-            for symbol in missing_kr:
-                st = fetch_single_stock(symbol)
-                if st:
-                    kr_stocks[symbol] = st
+            print(f"[{now}] Fetching {len(missing_kr)} unlisted held/existing KR stocks in batches...")
+            market_hints = {s: st.market for s, st in prev_frame.items() if s in missing_kr}
+            kr_stocks.update(fetch_realtime_quotes(missing_kr, market_hints))
         
+        fetch_tiers.observe(prev_frame, kr_stocks)
         last_kr_fetch_time = now
     else:
-        # Reuse existing KR stocks from latest_snapshot
-        kr_stocks = {s: st for s, st in latest_snapshot.items() if st.currency == 'KRW'}
+        # Reuse existing KR stocks from the previous frame
+        kr_stocks = {s: st for s, st in prev_frame.items() if st.currency == 'KRW'}
         # print(f"[{now}] Skipping KR fetch (off-hours). Reusing {len(kr_stocks)} stocks.")
 
     # 2. US Stocks Fetch Logic
-    should_fetch_us = force or is_us_market_open()
-    if not should_fetch_us:
-        if last_us_fetch_time is None or (now - last_us_fetch_time) >= timedelta(hours=1):
-            should_fetch_us = True
+    # Full sweep hourly in session (the tiered poller keeps them fresh in
+    # between), plus the grace window after each close; closed days are skipped.
+    should_fetch_us = force or needs_close_fetch(nyse_calendar, last_us_fetch_time, now) or (
+        is_us_market_open() and (now - last_us_fetch_time) >= timedelta(hours=1))
             
     if should_fetch_us:
         print(f"[{now}] Fetching US stocks (Market Open: {is_us_market_open()})...")
@@ -142,19 +147,19 @@ def fetch_job(force: bool = False):
         # Identify missing symbols from the popular fetch
         missing_us = held_us_symbols - set(us_stocks.keys())
         if missing_us:
-            print(f"[{now}] Fetching {len(missing_us)} additional held US stocks individually...")
-            for symbol in missing_us:
-                st = fetch_single_stock(symbol)
-                if st:
-                    us_stocks[symbol] = st
+            print(f"[{now}] Fetching {len(missing_us)} additional held US stocks in batches...")
+            us_stocks.update(fetch_realtime_quotes(missing_us))
         
         last_us_fetch_time = now
     else:
-        us_stocks = {s: st for s, st in latest_snapshot.items() if st.currency == 'USD'}
+        us_stocks = {s: st for s, st in prev_frame.items() if st.currency == 'USD'}
         # print(f"[{now}] Skipping US fetch (off-hours). Reusing {len(us_stocks)} stocks.")
 
-    # 3. Exchange Rate & Indices (Following KR fetch cycle or 1 hour)
-    should_fetch_indices = force or should_fetch_kr
+    # 3. Exchange Rate & Indices: every cycle while either market trades
+    # (the rate values every USD holding, the indices include US ones),
+    # otherwise hourly so FX and crypto indices keep moving over weekends.
+    should_fetch_indices = (force or should_fetch_kr or is_us_market_open() or last_indices_fetch_time is None
+                            or (now - last_indices_fetch_time) >= INDICES_REFRESH_INTERVAL)
     if should_fetch_indices:
         rate = fetch_exchange_rate()
         if rate:
@@ -168,10 +173,16 @@ def fetch_job(force: bool = False):
     # Merge
     all_stocks = {**kr_stocks, **us_stocks}
 
-    # Filter out stocks with price 0
-    latest_snapshot = {s: stock for s, stock in all_stocks.items() if stock.price > 0}
+    # Filter out stocks with price 0. Merged against the frame this cycle
+    # started from, so tier-poll patches applied meanwhile are not rolled back.
+    frame = price_store.merge({s: stock for s, stock in all_stocks.items() if stock.price > 0}, base=prev_frame)
     
-    print(f"[{now}] Total snapshot: {len(latest_snapshot)}. KR: {len(kr_stocks)}, US: {len(us_stocks)}. Rate: {latest_exchange_rate}")
+    print(f"[{now}] Total snapshot: {len(frame)} (v{frame.version}). KR: {len(kr_stocks)}, US: {len(us_stocks)}. Rate: {latest_exchange_rate}")
+
+    # Hand an immutable copy to the downstream stages (sync, order matching)
+    if pipeline is not None:
+        snapshot = make_snapshot(pipeline.next_version(), now, frame, latest_exchange_rate, latest_indices)
+        pipeline.publish(snapshot)
 
 import math
 import numpy as np
@@ -196,20 +207,30 @@ def sanitize_for_firebase(data):
         return val
     return data
 
-def sync_job(force: bool = False):
-    global last_written_snapshot
-    if not latest_snapshot:
+def sync_job(force: bool = False, snapshot: Optional[Snapshot] = None):
+    """
+    Diff the snapshot against what was last written and push changes to RTDB.
+    Without an explicit snapshot, syncs the store's current frame.
+
+    Tier patches (snapshot.full False) only push the changed stocks rows; the
+    full-node cleanup and system/ writes stay on the sync interval.
+    """
+    global last_written_frame, last_full_sync
+    stocks = snapshot.frame if snapshot is not None else price_store.current()
+    exchange_rate = snapshot.exchange_rate if snapshot is not None else latest_exchange_rate
+    indices = snapshot.indices if snapshot is not None else latest_indices
+    if not stocks:
         print(f"[{now_kst()}] No latest snapshot available yet. Skipping sync.")
         return
 
-    print(f"[{now_kst()}] Starting sync_job...")
-    changed: Dict[str, Stock] = {}
-    for symbol, stock in latest_snapshot.items():
-        prev = last_written_snapshot.get(symbol)
-        if prev is None or has_stock_changed(stock, prev):
-            changed[symbol] = stock
+    full = (snapshot is None or snapshot.full or last_full_sync is None
+            or time.monotonic() - last_full_sync >= SYNC_INTERVAL_MINUTES * 60)
+    print(f"[{now_kst()}] Starting sync_job{'' if full else ' (stocks only)'}...")
+    # Vectorized diff against the last written frame; only changed rows become Stock payloads
+    changed = {symbol: stocks[symbol] for symbol in stocks.changed_since(last_written_frame)}
+    patched: Dict[str, Stock] = {}
+    removed = []
 
-    ref = rtdb_admin.reference('stocks')
     updates = {}
     
     # Sync Stocks
@@ -222,24 +243,25 @@ def sync_job(force: bool = False):
         # Sanitize entire updates dict before sending to Firebase
         updates = sanitize_for_firebase(updates)
         
-        ref.update(updates)
+        # One multi-path update: the changed stocks/{symbol} rows plus their timestamp
+        paths = {f'stocks/{symbol}': row for symbol, row in updates.items()}
+        paths['system/stocksUpdatedAt'] = now_kst().isoformat()
+        rtdb_admin.reference().update(paths)
         print(f"[{now_kst()}] Updated {len(updates)} stocks in RTDB.")
-        # Update specific stocks timestamp
-        rtdb_admin.reference('system/stocksUpdatedAt').set(now_kst().isoformat())
     else:
         print(f"[{now_kst()}] No stock changes detected.")
 
+    if not full:
+        last_written_frame = stocks
+        return
+    last_full_sync = time.monotonic()
+
     # --- Zero-Price Cleanup Logic ---
     # 1. Fetch ALL stocks currently in RTDB to catch any old zero-price stocks
     existing_rtdb_stocks = rtdb_admin.reference('stocks').get() or {}
     
-    # 2. Identify stocks with 0 price (check both latest_snapshot and existing RTDB data)
-    zero_price_symbols = set()
-    
-    # Check latest snapshot
-    for s, stock in latest_snapshot.items():
-        if stock.price == 0:
-            zero_price_symbols.add(s)
+    # 2. Identify stocks with 0 price (check both the snapshot and existing RTDB data)
+    zero_price_symbols = set(stocks.symbols_at(np.flatnonzero(stocks.price == 0)))
             
     # Check existing RTDB data
     for s, data in existing_rtdb_stocks.items():
@@ -256,15 +278,7 @@ def sync_job(force: bool = False):
         # Fetch all held stocks to protect them
         held_stocks = set()
         try:
-            # Query all portfolios to find what stocks are owned
-            # Note: collection_group query might be slow if huge, but fine for now.
-            portfolios = firestore_db.collection_group("portfolio").stream()
-            for doc in portfolios:
-                # doc.id is usually the symbol in our design (users/{uid}/portfolio/{symbol})
-                data = doc.to_dict()
-                qty = data.get('quantity', 0)
-                if qty != 0:
-                    held_stocks.add(doc.id)
+            held_stocks = load_held_symbols()
         except Exception as e:
             print(f"Error fetching held stocks: {e}")
         
@@ -278,7 +292,7 @@ def sync_job(force: bool = False):
                 if new_stock and new_stock.price > 0:
                     print(f"     SUCCESS: Fetched valid price for {symbol}: {new_stock.price}")
                     # Update snapshot and RTDB immediately
-                    latest_snapshot[symbol] = new_stock
+                    patched[symbol] = new_stock
                     
                     # Fix: Handle datetime serialization
                     stock_dict = new_stock.to_dict()
@@ -288,8 +302,6 @@ def sync_job(force: bool = False):
                     stock_dict = sanitize_for_firebase(stock_dict)
                     
                     rtdb_admin.reference(f'stocks/{symbol}').set(stock_dict)
-                    # Also update last_written so next sync doesn't think it changed again immediately
-                    last_written_snapshot[symbol] = new_stock
                 else:
                     print(f"     FAILED: {symbol} still has 0 price after retry.")
             else:
@@ -298,8 +310,7 @@ def sync_job(force: bool = False):
                 try:
                     rtdb_admin.reference(f'stocks/{symbol}').delete()
                     # Remove from local snapshots so we don't sync it back or track it
-                    latest_snapshot.pop(symbol, None)
-                    last_written_snapshot.pop(symbol, None)
+                    removed.append(symbol)
                 except Exception as e:
                     print(f"     Error deleting {symbol}: {e}")
     # --------------------------------
@@ -307,20 +318,28 @@ def sync_job(force: bool = False):
     # Sync Exchange Rate
     # We update this every sync interval to ensure clients have fresh data
     # or we could check if it changed. Let's just update it.
-    rtdb_admin.reference('system/exchange_rate').set(latest_exchange_rate)
-    print(f"[{now_kst()}] Synced Exchange Rate: {latest_exchange_rate}")
+    rtdb_admin.reference('system/exchange_rate').set(exchange_rate)
+    print(f"[{now_kst()}] Synced Exchange Rate: {exchange_rate}")
 
     # Sync Indices
-    if latest_indices:
-        rtdb_admin.reference('system/indices').set(latest_indices)
+    if indices:
+        rtdb_admin.reference('system/indices').set(dict(indices))
         rtdb_admin.reference('system/indicesUpdatedAt').set(now_kst().isoformat())
         print(f"[{now_kst()}] Synced Market Indices.")
 
     # Global Last Updated At
     rtdb_admin.reference('system/updatedAt').set(now_kst().isoformat())
 
-    last_written_snapshot = {symbol: stock for symbol, stock in latest_snapshot.items()}
-    print(f"[{now_kst()}] Completed sync_job.")
+    # Remember what RTDB now holds (including retried/deleted symbols)
+    if patched or removed:
+        price_store.patch(patched, removed)
+        last_written_frame = stocks.with_changes(patched, removed)
+    else:
+        last_written_frame = stocks
+    if snapshot is not None:
+        print(f"[{now_kst()}] Completed sync_job (snapshot v{snapshot.version}, snapshot-to-RTDB {snapshot.age():.2f}s).")
+    else:
+        print(f"[{now_kst()}] Completed sync_job.")
 
 def diff_in_days(last_date_str: str) -> int:
     if not last_date_str:
@@ -341,6 +360,7 @@ def process_daily_interest_and_liquidation():
     docs = query.stream()
     
     today_str = datetime.now().strftime("%Y-%m-%d")
+    prices = price_store.current()
     
     count_interest = 0
     count_liquidated = 0
@@ -408,15 +428,13 @@ def process_daily_interest_and_liquidation():
                 if symbol not in portfolio_map:
                     continue
                     
-                stock_info = latest_snapshot.get(symbol)
+                stock_info = prices.get(symbol)
                 if not stock_info:
                     # Fallback if stock not in current snapshot (e.g. delisted or error)
                     # We can't sell if we don't know price. Skip.
                     continue
                     
-                current_price = stock_info.price
-                if stock_info.currency == "USD":
-                    current_price *= latest_exchange_rate
+                current_price = prices.krw_price(symbol, latest_exchange_rate)
 
                 owned_qty = portfolio_map[symbol].get("quantity", 0)
                 
@@ -450,15 +468,12 @@ def process_daily_interest_and_liquidation():
                     qty = item.get("quantity", 0)
                     if qty == 0: continue
                     
-                    stock_info = latest_snapshot.get(symbol)
+                    stock_info = prices.get(symbol)
                     if not stock_info: continue
                     
+                    current_price = prices.krw_price(symbol, latest_exchange_rate)
                     if qty > 0:
                         # Long position
-                        current_price = stock_info.price
-                        if stock_info.currency == "USD":
-                            current_price *= latest_exchange_rate
-                        
                         net_price = current_price * 0.999 # 0.1% fee
                         shares_needed = int(remaining_excess / net_price) + 1
                         shares_to_sell = min(shares_needed, qty)
@@ -474,10 +489,6 @@ def process_daily_interest_and_liquidation():
                         # Short position (qty < 0)
                         abs_qty = abs(qty)
                         avg_sell_price = item.get("averagePrice", 0)
-                        
-                        current_price = stock_info.price
-                        if stock_info.currency == "USD":
-                            current_price *= latest_exchange_rate
 
                         # Covering releases original sell price from usedCredit
                         # But it costs current_price * shares to cover
@@ -515,39 +526,21 @@ def process_missions_daily():
     except Exception as e:
         print(f"Error generating daily missions: {e}")
 
-def update_all_mission_progress():
-    """
-    Optimized: Only update missions for users who had a transaction since their last mission update.
-    Tracks activity via RTDB user_activities/{uid}.
-    """
-    # print(f"[{now_kst()}] Checking users for mission updates...")
-    try:
-        activities_ref = rtdb_admin.reference('user_activities')
-        activities = activities_ref.get()
-        
-        if not activities:
-            # print(f"[{now_kst()}] No active users found in RTDB activities.")
-            return
-
-        count = 0
-        for uid, activity in activities.items():
-            if not isinstance(activity, dict): continue
-            
-            last_tx = activity.get('lastTransactionAt')
-            last_update = activity.get('lastMissionUpdateAt')
-            
-            # If there's a transaction after the last update, or if never updated
-            if last_tx and (not last_update or last_tx > last_update):
-                mission_manager.update_mission_progress(uid)
-                activities_ref.child(uid).update({
-                    'lastMissionUpdateAt': datetime.utcnow().isoformat() + "Z"
-                })
-                count += 1
-        
-        if count > 0:
-            print(f"[{now_kst()}] Mission progress updated for {count} active users.")
-    except Exception as e:
-        print(f"Error updating mission progress: {e}")
+def handle_user_activity(uid: str, activity) -> bool:
+    """Update missions for one user if they traded since the last update."""
+    if not isinstance(activity, dict): return False
+    
+    last_tx = activity.get('lastTransactionAt')
+    last_update = activity.get('lastMissionUpdateAt')
+    
+    # If there's a transaction after the last update, or if never updated
+    if last_tx and (not last_update or last_tx > last_update):
+        mission_manager.update_mission_progress(uid)
+        rtdb_admin.reference('user_activities').child(uid).update({
+            'lastMissionUpdateAt': datetime.utcnow().isoformat() + "Z"
+        })
+        return True
+    return False
 
 def run_once_force():
     print("Force mode: fetching and syncing once.")
@@ -560,21 +553,27 @@ def run_daily_job_now():
     fetch_job()
     process_daily_interest_and_liquidation()
 
+def load_held_symbols() -> set:
+    """Symbols with at least one holder, from the holdings index (one doc read)."""
+    held = get_held_symbols()
+    if held is None:
+        # Index not built yet: build it once from the portfolios
+        held = {symbol for symbol, count in reconcile_holdings().items() if count > 0}
+    return held
+
+def reconcile_holdings_job():
+    try:
+        counts = reconcile_holdings()
+        print(f"[{now_kst()}] Holdings index reconciled. Held symbols: {len(counts)}")
+    except Exception as e:
+        print(f"Error reconciling holdings index: {e}")
+
 def refresh_held_stocks():
     global held_stocks_cache
     print(f"[{now_kst()}] Refreshing held stocks cache...")
     try:
-        # 1. Load from User Portfolios
-        # Optimization: verify if we can select only keys/ids. 
-        # collection_group query.
-        docs = firestore_db.collection_group("portfolio").stream()
-        new_cache = set()
-        for doc in docs:
-            # doc.id is the symbol in our data model: users/{uid}/portfolio/{symbol}
-            data = doc.to_dict()
-            qty = data.get('quantity', 0)
-            if qty != 0:
-                new_cache.add(doc.id)
+        # 1. Load from the holdings index (maintained by trade_executor)
+        new_cache = set(load_held_symbols())
         
         # 2. Load from Configuration File
         reserved_file = os.path.join(os.path.dirname(__file__), 'reserved_symbols.txt')
@@ -615,78 +614,110 @@ def refresh_held_stocks():
     except Exception as e:
         print(f"Error refreshing held stocks: {e}")
 
-def process_limit_orders():
+def process_limit_orders(snapshot: Optional[Snapshot] = None):
     """
-    Check Firestore for pending limit orders and execute them if conditions are met.
+    Execute pending limit orders whose target the latest prices cross.
+    Only orders popped from the in-memory order book are touched.
     """
-    if not latest_snapshot:
+    stocks = snapshot.frame if snapshot is not None else price_store.current()
+    exchange_rate = snapshot.exchange_rate if snapshot is not None else latest_exchange_rate
+    if not stocks:
+        return
+    if not order_book.wait_ready():
+        print(f"[{now_kst()}] Order book not loaded yet. Skipping limit order check.")
         return
 
-    print(f"[{now_kst()}] Checking pending limit orders...")
+    print(f"[{now_kst()}] Checking pending limit orders ({len(order_book)} open)...")
     try:
-        orders_ref = firestore_db.collection("active_orders")
-        pending_orders = orders_ref.where(filter=FieldFilter("status", "==", "PENDING")).stream()
-        
-        for order_doc in pending_orders:
-            order_data = order_doc.to_dict()
-            uid = order_data.get("uid")
-            symbol = order_data.get("symbol")
-            name = order_data.get("name", symbol)
-            target_price = order_data.get("targetPrice")
-            quantity = order_data.get("quantity")
-            order_type = order_data.get("type") # BUY or SELL
-            currency = order_data.get("currency", "KRW")
-            
-            stock_info = latest_snapshot.get(symbol)
+        for symbol in order_book.symbols():
+            stock_info = stocks.get(symbol)
             if not stock_info:
                 continue
-                
-            current_price = stock_info.price
-            
-            # Comparison logic: Ensure we compare in the same currency
-            # If the order is in KRW but the stock is USD, convert current_price for comparison
-            compare_price = current_price
-            if currency == "KRW" and stock_info.currency == "USD":
-                compare_price = current_price * latest_exchange_rate
-            
-            execute = False
-            if order_type == "BUY" and compare_price <= target_price:
-                execute = True
-            elif order_type == "SELL" and compare_price >= target_price:
-                execute = True
-                
-            if execute:
-                try:
-                    print(f"  -> Executing LIMIT {order_type} for user {uid}: {symbol} @ {current_price} {stock_info.currency} (Target: {target_price} {currency})")
-                    market = stock_info.market
-                    
-                    # Convert to KRW for the executor which expects base currency (KRW)
-                    # Note: buy_stock/sell_stock logic in trade_executor.py uses the passed price as the actual KRW cost basis.
-                    exec_price = current_price
-                    if stock_info.currency == "USD":
-                        exec_price = math.floor(current_price * latest_exchange_rate)
-                    
-                    if order_type == "BUY":
-                        buy_stock(uid, symbol, name, exec_price, quantity, order_type="LIMIT", market=market, original_price=current_price, original_currency=stock_info.currency)
-                    else:
-                        sell_stock(uid, symbol, name, exec_price, quantity, order_type="LIMIT", market=market, original_price=current_price, original_currency=stock_info.currency)
-                    
-                    orders_ref.document(order_doc.id).update({
-                        "status": "COMPLETED",
-                        "executedPrice": current_price,
-                        "executedAt": firestore.SERVER_TIMESTAMP
-                    })
-                except Exception as e:
-                    print(f"  -> ERROR executing limit order {order_doc.id}: {e}")
-                    orders_ref.document(order_doc.id).update({
-                        "status": "FAILED",
-                        "errorMessage": str(e)
-                    })
+            for order in order_book.take_crossing(symbol, stock_info.price, stock_info.currency, exchange_rate):
+                execute_limit_order(order, stock_info, exchange_rate)
     except Exception as e:
         print(f"Error in process_limit_orders: {e}")
 
+def execute_limit_order(order: LimitOrder, stock_info: Stock, exchange_rate: float):
+    orders_ref = firestore_db.collection("active_orders")
+    current_price = stock_info.price
+    try:
+        print(f"  -> Executing LIMIT {order.side} for user {order.uid}: {order.symbol} @ {current_price} {stock_info.currency} (Target: {order.target_price} {order.currency})")
+        market = stock_info.market
+        
+        # Convert to KRW for the executor which expects base currency (KRW)
+        # Note: buy_stock/sell_stock logic in trade_executor.py uses the passed price as the actual KRW cost basis.
+        exec_price = current_price
+        if stock_info.currency == "USD":
+            exec_price = math.floor(current_price * exchange_rate)
+        
+        if order.side == "BUY":
+            buy_stock(order.uid, order.symbol, order.name, exec_price, order.quantity, order_type="LIMIT", market=market, original_price=current_price, original_currency=stock_info.currency)
+        else:
+            sell_stock(order.uid, order.symbol, order.name, exec_price, order.quantity, order_type="LIMIT", market=market, original_price=current_price, original_currency=stock_info.currency)
+        
+        orders_ref.document(order.order_id).update({
+            "status": "COMPLETED",
+            "executedPrice": current_price,
+            "executedAt": firestore.SERVER_TIMESTAMP
+        })
+    except Exception as e:
+        print(f"  -> ERROR executing limit order {order.order_id}: {e}")
+        orders_ref.document(order.order_id).update({
+            "status": "FAILED",
+            "errorMessage": str(e)
+        })
+
+
+def recompute_fetch_tiers():
+    """Pin held and ordered symbols hot; US symbols get adaptive back-off."""
+    frame = price_store.current()
+    pinned = set(held_stocks_cache) | set(order_book.symbols())
+    background = {s for s, st in frame.items() if st.currency == 'USD'}
+    sizes = fetch_tiers.recompute(pinned, background)
+    print(f"[{now_kst()}] Fetch tiers: {sizes['hot']} hot, {sizes['idle']} idle.")
+
+def tier_fetch_job():
+    """Re-quote the symbols whose tier interval elapsed and publish the changes."""
+    kr_open, us_open = is_kr_market_open(), is_us_market_open()
+    if not (kr_open or us_open):
+        return
+    due = [s for s in fetch_tiers.due() if (kr_open if is_kr_symbol(s) else us_open)]
+    if not due:
+        return
+
+    prev = price_store.current()
+    hints = {s: prev[s].market for s in due if s in prev}
+    # Batch endpoint only: per-symbol suffix probing is left to the slow
+    # full sweeps, so a ticker that keeps failing costs nothing extra here.
+    quotes = {s: q for s, q in fetch_realtime_quotes(due, hints, single_fallback=False).items() if q.price > 0}
+    fetch_tiers.observe(prev, quotes)
+    changed = {s for s, q in quotes.items() if s not in prev or prev[s].price != q.price}
+    fetch_tiers.mark_fetched(due, changed)
+    if not changed:
+        return
+
+    frame = price_store.patch({s: quotes[s] for s in changed})
+    if pipeline is not None:
+        pipeline.publish(make_snapshot(pipeline.next_version(), now_kst(), frame, latest_exchange_rate, latest_indices, full=False))
+
+def report_pipeline_metrics():
+    """Log stage backpressure/latency metrics and mirror them to RTDB."""
+    if pipeline is None:
+        return
+    stats = pipeline.stats()
+    for name, st in stats['stages'].items():
+        print(f"[{now_kst()}] [pipeline:{name}] v{st['lastVersion']} processed={st['processed']} "
+              f"depth={st['queueDepth']} dropped={st['dropped']} skipped={st['skipped']} "
+              f"latency={st['lastLatencySec']}s (max {st['maxLatencySec']}s)")
+    try:
+        stats['updatedAt'] = now_kst().isoformat()
+        rtdb_admin.reference('system/pipeline').set(stats)
+    except Exception as e:
+        print(f"Error writing pipeline metrics: {e}")
 
 def start_scheduler():
+    global pipeline
     print("RTDB Scheduler started. Fetch every "
           f"{FETCH_INTERVAL_MINUTES} min, sync every {SYNC_INTERVAL_MINUTES} min (24/7).")
     print("Daily Interest/Liquidation job scheduled at 00:00 KST.")
@@ -696,253 +727,325 @@ def start_scheduler():
     fetch_job()
     sync_job()
 
-    schedule.every(FETCH_INTERVAL_MINUTES).minutes.do(fetch_job)
-    schedule.every(SYNC_INTERVAL_MINUTES).minutes.do(sync_job)
+    # Staged pipeline: the fetch stage publishes immutable snapshots, and the
+    # sync and order-matching stages each consume the newest one on their own
+    # worker so a slow Naver fetch never delays matching or request handling.
+    # Pending limit orders are mirrored in memory by a Firestore listener,
+    # so each matching pass only pops the orders whose target was crossed.
+    order_book.start()
+
+    pipeline = SnapshotPipeline()
+    pipeline.add_stage('sync', lambda snap: sync_job(snapshot=snap))
+    pipeline.add_stage('orders', lambda snap: process_limit_orders(snapshot=snap))
+    pipeline.start()
+    run_periodic('fetch', FETCH_INTERVAL_MINUTES * 60, fetch_job, initial_delay=FETCH_INTERVAL_MINUTES * 60)
+
+    # Tiered realtime polling on top of the full cycle
+    recompute_fetch_tiers()
+    run_periodic('tiers', TIER_TICK_SEC, tier_fetch_job)
+    schedule.every(1).minutes.do(recompute_fetch_tiers)
+
+    schedule.every(1).minutes.do(report_pipeline_metrics)
     
     # Schedule daily job at midnight KST
     schedule.every().day.at("00:00").do(process_daily_interest_and_liquidation)
     
     # Schedule held stocks refresh every 5 minutes
     schedule.every(5).minutes.do(refresh_held_stocks)
-    
-    schedule.every(1).minutes.do(process_limit_orders)
+
+    # Rebuild the holdings index from portfolios to catch drift
+    schedule.every(30).minutes.do(reconcile_holdings_job)
     
     # Schedule missions
     schedule.every().day.at("00:00").do(process_missions_daily)
 
-    # Schedule search requests processing every 5 seconds (not use schedule for high frequency)
-    # Actually we'll call it in the loop
-    
     # Schedule history job at 06:00 KST (after US market close)
     schedule.every().day.at("06:00").do(history_job)
 
     # Schedule ranking history every hour
     schedule.every().hour.at(":00").do(record_ranking_history)
 
+    # Drop finished RTDB request entries
+    schedule.every().hour.at(":30").do(compact_request_nodes)
+
+    # AI/Search/History requests and mission progress are event-driven:
+    # RTDB streams push child changes to handlers on worker pools.
+    dispatcher = RequestDispatcher()
+    dispatcher.route('ai_requests', handle_ai_request, workers=2)
+    dispatcher.route('search_requests', handle_search_request, workers=2)
+    dispatcher.route('history_requests', handle_history_request, workers=2)
+    dispatcher.route('user_activities', handle_user_activity, workers=2)
+    dispatcher.start()
+
+    # Re-open the streams periodically to recover from silently stale connections
+    schedule.every(4).hours.do(dispatcher.restart)
+    schedule.every(4).hours.do(order_book.restart)
+
     while True:
         schedule.run_pending()
-        
-        # Check AI requests, Search, and Mission progress more frequently
-        try:
-            process_ai_requests()
-            process_search_requests()
-            process_history_requests()
-            update_all_mission_progress()
-        except Exception as e:
-            print(f"Error in background processing: {e}")
-            
-        time.sleep(2)
+        time.sleep(1)
 
-import google.generativeai as genai
-
-# Configure Gemini API
+# LLM clients are only needed for AI analysis requests. Both SDKs are slow
+# to import, so they are created on the first request rather than at startup.
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
-genai.configure(api_key=GEMINI_API_KEY)
-
-# Configure Groq API
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = None
-if GROQ_API_KEY:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+_llm_clients = None
+_llm_lock = threading.Lock()
+
+def get_llm_clients():
+    """(Groq client, configured google.generativeai module); either may be None."""
+    global _llm_clients
+    with _llm_lock:
+        if _llm_clients is None:
+            groq_client = None
+            if GROQ_API_KEY:
+                from groq import Groq
+                groq_client = Groq(api_key=GROQ_API_KEY)
+            genai = None
+            if GEMINI_API_KEY:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+            else:
+                print("Warning: GEMINI_API_KEY environment variable is not set; no Gemini fallback.")
+            _llm_clients = (groq_client, genai)
+        return _llm_clients
 
-def process_ai_requests():
+def _parse_iso(value) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=MARKET_TZ)
+    return parsed
+
+def compact_request_nodes():
     """
-    Check RTDB for pending AI analysis requests and use Gemini API.
-    path: ai_requests/{uid}
+    Delete finished request entries past their retention so the request nodes
+    (and the listener's initial snapshot) stay small.
+    - search_requests: results live in search_results, the request is disposable.
+    - history_requests: the data lives in Supabase; the client re-requests if missing.
+    ai_requests is left alone: it holds one entry per user (the latest
+    request, overwritten by the next one) and the dashboard shows its result.
     """
-    ref = rtdb_admin.reference('ai_requests')
-    requests = ref.get()
-    
-    if not requests:
-        return
-
-    for uid, data in requests.items():
-        if isinstance(data, dict) and data.get('status') == 'pending':
-            # 0. Immediate Lock: Set status to processing to avoid double execution
+    rules = [
+        ('search_requests', ('completed', 'error'), SEARCH_REQUEST_RETENTION, ('completedAt', 'requestedAt')),
+        ('history_requests', ('completed', 'error'), HISTORY_REQUEST_RETENTION, ('updatedAt', 'requestedAt')),
+    ]
+    now = now_kst()
+    for node, statuses, retention, time_fields in rules:
+        ref = rtdb_admin.reference(node)
+        updates = {}
+        for status in statuses:
             try:
-                ref.child(uid).update({'status': 'processing'})
-            except Exception as lock_e:
-                print(f"Error locking request for {uid}: {lock_e}")
+                entries = ref.order_by_child('status').equal_to(status).get() or {}
+            except Exception as e:
+                print(f"Error querying {status} {node}: {e}")
                 continue
-            
-            print(f"[{now_kst()}] Processing AI request for user {uid}...")
-            
-            # Initialize response variables
-            result_text = "AI 분석 요청을 처리하는 중입니다."
-            used_model = "n/a"
-            last_error = None
-            portfolio_signature = None
-            
+            for key, data in entries.items():
+                if not isinstance(data, dict):
+                    continue
+                finished_at = next((t for t in (_parse_iso(data.get(f)) for f in time_fields) if t), None)
+                if finished_at is None or now - finished_at >= retention:
+                    updates[key] = None
+        if updates:
             try:
-                # 1. Fetch User Portfolio from Firestore
-                portfolio_ref = firestore_db.collection("users").document(uid).collection("portfolio")
-                portfolio_docs = list(portfolio_ref.stream()) # Listify to use multiple times if needed
+                ref.update(updates)
+                print(f"[{now_kst()}] Compacted {len(updates)} finished entries from {node}.")
+            except Exception as e:
+                print(f"Error compacting {node}: {e}")
+
+def handle_ai_request(uid: str, data):
+    """Process a single ai_requests/{uid} entry if it is pending."""
+    if not (isinstance(data, dict) and data.get('status') == 'pending'):
+        return
+    ref = rtdb_admin.reference('ai_requests')
+
+    # 0. Immediate Lock: Set status to processing to avoid double execution
+    try:
+        ref.child(uid).update({'status': 'processing'})
+    except Exception as lock_e:
+        print(f"Error locking request for {uid}: {lock_e}")
+        return
+    
+    print(f"[{now_kst()}] Processing AI request for user {uid}...")
+    
+    # Initialize response variables
+    result_text = "AI 분석 요청을 처리하는 중입니다."
+    used_model = "n/a"
+    last_error = None
+    portfolio_signature = None
+    
+    try:
+        # 1. Fetch User Portfolio from Firestore
+        portfolio_ref = firestore_db.collection("users").document(uid).collection("portfolio")
+        portfolio_docs = list(portfolio_ref.stream()) # Listify to use multiple times if needed
+        
+        prices = price_store.current()
+        portfolio_text = []
+        total_value = 0
+        total_principal = 0
+        total_profit = 0
+        
+        for doc in portfolio_docs:
+            item = doc.to_dict()
+            symbol = item.get('symbol')
+            quantity = item.get('quantity', 0)
+            avg_price = item.get('averagePrice') or 0 # Handle None case
+            
+            if quantity != 0:
+                stock_info = prices.get(symbol)
+                current_price = prices.krw_price(symbol, latest_exchange_rate) or 0
+                name = stock_info.name if stock_info else symbol
                 
-                portfolio_text = []
-                total_value = 0
-                total_principal = 0
-                total_profit = 0
+                # Use Absolute valuation for total value calculation but indicate short in text
+                value = quantity * current_price
+                total_value += value # Net asset value
                 
-                for doc in portfolio_docs:
-                    item = doc.to_dict()
-                    symbol = item.get('symbol')
-                    quantity = item.get('quantity', 0)
-                    avg_price = item.get('averagePrice') or 0 # Handle None case
-                    
-                    if quantity != 0:
-                        stock_info = latest_snapshot.get(symbol)
-                        current_price = stock_info.price if stock_info else 0
-                        name = stock_info.name if stock_info else symbol
-                        
-                        # Handle USD conversion
-                        if stock_info and stock_info.currency == 'USD':
-                            current_price *= latest_exchange_rate
-                        
-                        # Use Absolute valuation for total value calculation but indicate short in text
-                        value = quantity * current_price
-                        total_value += value # Net asset value
-                        
-                        pos_type = "매수" if quantity > 0 else "공매도"
-                        portfolio_text.append(f"- {name} ({symbol}): {quantity}주 ({pos_type}, 평가액: {value:,.0f} KRW)")
-                        
-                        # Performance calculations
-                        principal = abs(quantity) * avg_price
-                        total_principal += principal
-                        
-                        if quantity > 0:
-                            profit = (current_price - avg_price) * quantity
-                        else:
-                            profit = (avg_price - current_price) * abs(quantity)
-                        total_profit += profit
+                pos_type = "매수" if quantity > 0 else "공매도"
+                portfolio_text.append(f"- {name} ({symbol}): {quantity}주 ({pos_type}, 평가액: {value:,.0f} KRW)")
+                
+                # Performance calculations
+                principal = abs(quantity) * avg_price
+                total_principal += principal
+                
+                if quantity > 0:
+                    profit = (current_price - avg_price) * quantity
+                else:
+                    profit = (avg_price - current_price) * abs(quantity)
+                total_profit += profit
 
-                profit_ratio = (total_profit / total_principal * 100) if total_principal > 0 else 0
+        profit_ratio = (total_profit / total_principal * 100) if total_principal > 0 else 0
 
-                if not portfolio_text:
-                    result_text = "보유한 주식이 없습니다. 포트폴리오를 구성한 뒤 다시 요청해주세요."
-                else:
-                    # 2. Fetch Detailed User Info for Context
-                    user_info_text = ""
-                    try:
-                        user_doc = firestore_db.collection("users").document(uid).get()
-                        if user_doc.exists:
-                            user_data = user_doc.to_dict()
-                            balance = user_data.get('balance', 0)
-                            used_credit = user_data.get('usedCredit', 0)
-                            credit_limit = user_data.get('creditLimit', 0)
-                            
-                            leverage_ratio = (used_credit / credit_limit * 100) if credit_limit > 0 else 0
-                            
-                            user_info_text = (
-                                f"\n[사용자 자산 상태]\n"
-                                f"- 현재 현금 잔고: {balance:,.0f} KRW\n"
-                                f"- 사용 중인 신용/레버리지: {used_credit:,.0f} KRW (한도 대비 {leverage_ratio:.1f}% 사용)\n"
-                                f"- 전체 신용 한도: {credit_limit:,.0f} KRW"
-                            )
-                    except Exception as e:
-                        print(f"Error fetching user info for AI: {e}")
-
-                    # 3. Construct Refined Prompt
-                    prompt = (
-                        """
-                        너는 개인 투자자를 위한 AI 리서치 애널리스트다.
-                        단순 정보 요약이 아닌, 현재 포트폴리오의 성격과 전략적 의미를 해석하는 데 집중하라.
-                        증권사 리포트 톤으로 중립적으로 작성하되, 분석적 깊이를 유지하라.
-                        특정 투자 성향을 단정하지 말고, 가능한 전략 시나리오를 병렬적으로 제시하라.
-                        명령형 표현이나 직접적인 매수/매도 권유는 사용하지 않는다.
-
-                        아래 정보를 바탕으로 포트폴리오 분석 보고서를 작성하라.
-                        """ + 
-                        f"[포트폴리오 구성]\n"
-                        f"{chr(10).join(portfolio_text)}\n\n"
-                        f"[포트폴리오 성과]\n"
-                        f"- 총 투자원금: {total_principal:,.0f} KRW\n"
-                        f"- 총 평가손익: {total_profit:,.0f} KRW ({profit_ratio:+.2f}%)\n"
-                        f"- 주식 총 평가액(Net): {total_value:,.0f} KRW\n"
-                        f"{user_info_text}\n\n"
-                        +
-                        """
-                        [출력 형식 요구사항]
-                        - 전체 분량은 약 500~700자 이내
-                        - 아래 4개 섹션을 반드시 포함하라
-                        - 각 섹션마다 “해석 또는 판단” 문장을 최소 1개 이상 포함하라
-
-                        1. Executive Summary
-                           - 현재 포트폴리오의 성격(예: 테스트/대기/부분적 베팅)을 규정하고 요약
-
-                        2. Portfolio Structure & Performance
-                           - 자산 배분 구조와 성과를 해석 중심으로 서술
-                           - 단순 수치 나열 금지
-
-                        3. Risk, Exposure & Optionality
-                           - 현재 구조가 노출하고 있는 리스크
-                           - 동시에 확보하고 있는 선택지를 함께 서술
-
-                        4. Scenario-based View
-                           - 보수적 운용 시나리오
-                           - 공격적 운용 시나리오
-                           - 두 시나리오의 전제 조건을 함께 제시
-                        """
-                    )
+        if not portfolio_text:
+            result_text = "보유한 주식이 없습니다. 포트폴리오를 구성한 뒤 다시 요청해주세요."
+        else:
+            # 2. Fetch Detailed User Info for Context
+            user_info_text = ""
+            try:
+                user_doc = firestore_db.collection("users").document(uid).get()
+                if user_doc.exists:
+                    user_data = user_doc.to_dict()
+                    balance = user_data.get('balance', 0)
+                    used_credit = user_data.get('usedCredit', 0)
+                    credit_limit = user_data.get('creditLimit', 0)
                     
-                    # 4. Generate Content (Primary: Groq, Secondary: Gemini)
-                    used_model = "openai/gpt-oss-120b"
-                    #print(prompt) # Reduced noise
-
-                    if groq_client:
-                        try:
-                            completion = groq_client.chat.completions.create(
-                                model=used_model,
-                                messages=[                                    
-                                    {"role": "user", "content": prompt}
-                                ],
-                                max_tokens=8192,
-                                timeout=20.0, # 20 second timeout for Groq
-                            )
-                            result_text = completion.choices[0].message.content
-                        except Exception as ge:
-                            print(f"  -> Groq failed or quota exceeded: {ge}. Falling back to Gemini.")
-                            try:
-                                # Failover to Gemini
-                                used_model = "gemini-3-pro-preview"
-                                model = genai.GenerativeModel(used_model)
-                                response = model.generate_content(prompt, request_options={'timeout': 20}) # 20 second timeout
-                                result_text = response.text
-                            except Exception as gemini_e:
-                                print(f"  -> Gemini Analysis failed: {gemini_e}")
-                                result_text = "AI 분석 중 일시적인 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
-                                last_error = gemini_e
-                    print(f"  -> Analysis completed using {used_model}")
-
-                    # 5. Generate Portfolio Signature for Change Detection
-                    # Format: symbol:qty|symbol:qty (sorted)
-                    items_for_sig = []
-                    for doc in portfolio_docs:
-                        d = doc.to_dict()
-                        items_for_sig.append(f"{d.get('symbol')}:{d.get('quantity')}")
-                    items_for_sig.sort()
-                    portfolio_signature = "|".join(items_for_sig)
-            
+                    leverage_ratio = (used_credit / credit_limit * 100) if credit_limit > 0 else 0
+                    
+                    user_info_text = (
+                        f"\n[사용자 자산 상태]\n"
+                        f"- 현재 현금 잔고: {balance:,.0f} KRW\n"
+                        f"- 사용 중인 신용/레버리지: {used_credit:,.0f} KRW (한도 대비 {leverage_ratio:.1f}% 사용)\n"
+                        f"- 전체 신용 한도: {credit_limit:,.0f} KRW"
+                    )
             except Exception as e:
-                print(f"Error processing AI request for {uid}: {e}")
-                result_text = "AI 분석 데이터 처리 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
-                last_error = e
-                portfolio_signature = None
-
-            # 6. Update RTDB
-            update_payload = {
-                'status': 'completed',
-                'result': result_text,
-                'completedAt': now_kst().isoformat(),
-                'usedModel': used_model,
-                'lastError': last_error
-            }
-            if portfolio_signature:
-                update_payload['portfolioSignature'] = portfolio_signature
-                
-            ref.child(uid).update(update_payload)
-            print(f"[{now_kst()}] Completed AI request for user {uid}.")
+                print(f"Error fetching user info for AI: {e}")
+
+            # 3. Construct Refined Prompt
+            prompt = (
+                """
+                너는 개인 투자자를 위한 AI 리서치 애널리스트다.
+                단순 정보 요약이 아닌, 현재 포트폴리오의 성격과 전략적 의미를 해석하는 데 집중하라.
+                증권사 리포트 톤으로 중립적으로 작성하되, 분석적 깊이를 유지하라.
+                특정 투자 성향을 단정하지 말고, 가능한 전략 시나리오를 병렬적으로 제시하라.
+                명령형 표현이나 직접적인 매수/매도 권유는 사용하지 않는다.
+
+                아래 정보를 바탕으로 포트폴리오 분석 보고서를 작성하라.
+                """ + 
+                f"[포트폴리오 구성]\n"
+                f"{chr(10).join(portfolio_text)}\n\n"
+                f"[포트폴리오 성과]\n"
+                f"- 총 투자원금: {total_principal:,.0f} KRW\n"
+                f"- 총 평가손익: {total_profit:,.0f} KRW ({profit_ratio:+.2f}%)\n"
+                f"- 주식 총 평가액(Net): {total_value:,.0f} KRW\n"
+                f"{user_info_text}\n\n"
+                +
+                """
+                [출력 형식 요구사항]
+                - 전체 분량은 약 500~700자 이내
+                - 아래 4개 섹션을 반드시 포함하라
+                - 각 섹션마다 “해석 또는 판단” 문장을 최소 1개 이상 포함하라
+
+                1. Executive Summary
+                   - 현재 포트폴리오의 성격(예: 테스트/대기/부분적 베팅)을 규정하고 요약
+
+                2. Portfolio Structure & Performance
+                   - 자산 배분 구조와 성과를 해석 중심으로 서술
+                   - 단순 수치 나열 금지
+
+                3. Risk, Exposure & Optionality
+                   - 현재 구조가 노출하고 있는 리스크
+                   - 동시에 확보하고 있는 선택지를 함께 서술
+
+                4. Scenario-based View
+                   - 보수적 운용 시나리오
+                   - 공격적 운용 시나리오
+                   - 두 시나리오의 전제 조건을 함께 제시
+                """
+            )
+            
+            # 4. Generate Content (Primary: Groq, Secondary: Gemini)
+            used_model = "openai/gpt-oss-120b"
+            #print(prompt) # Reduced noise
+            groq_client, genai = get_llm_clients()
+
+            if groq_client:
+                try:
+                    completion = groq_client.chat.completions.create(
+                        model=used_model,
+                        messages=[                                    
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=8192,
+                        timeout=20.0, # 20 second timeout for Groq
+                    )
+                    result_text = completion.choices[0].message.content
+                except Exception as ge:
+                    print(f"  -> Groq failed or quota exceeded: {ge}. Falling back to Gemini.")
+                    try:
+                        # Failover to Gemini
+                        used_model = "gemini-3-pro-preview"
+                        if genai is None:
+                            raise RuntimeError("GEMINI_API_KEY environment variable is not set")
+                        model = genai.GenerativeModel(used_model)
+                        response = model.generate_content(prompt, request_options={'timeout': 20}) # 20 second timeout
+                        result_text = response.text
+                    except Exception as gemini_e:
+                        print(f"  -> Gemini Analysis failed: {gemini_e}")
+                        result_text = "AI 분석 중 일시적인 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
+                        last_error = gemini_e
+            print(f"  -> Analysis completed using {used_model}")
+
+            # 5. Generate Portfolio Signature for Change Detection
+            # Format: symbol:qty|symbol:qty (sorted)
+            items_for_sig = []
+            for doc in portfolio_docs:
+                d = doc.to_dict()
+                items_for_sig.append(f"{d.get('symbol')}:{d.get('quantity')}")
+            items_for_sig.sort()
+            portfolio_signature = "|".join(items_for_sig)
+    
+    except Exception as e:
+        print(f"Error processing AI request for {uid}: {e}")
+        result_text = "AI 분석 데이터 처리 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
+        last_error = e
+        portfolio_signature = None
+
+    # 6. Update RTDB
+    update_payload = {
+        'status': 'completed',
+        'result': result_text,
+        'completedAt': now_kst().isoformat(),
+        'usedModel': used_model,
+        'lastError': last_error
+    }
+    if portfolio_signature:
+        update_payload['portfolioSignature'] = portfolio_signature
+        
+    ref.child(uid).update(update_payload)
+    print(f"[{now_kst()}] Completed AI request for user {uid}.")
 
 def history_job(force: bool = False):
     """
@@ -953,27 +1056,25 @@ def history_job(force: bool = False):
     print(f"[{now_kst()}] Starting History Job...")
     
     # Ensure we have a list of stocks to process
-    global latest_snapshot
-    if not latest_snapshot:
+    if not price_store.current():
         print("Latest snapshot empty. Fetching current stocks first...")
         fetch_job()
         
-    stocks_to_process = list(latest_snapshot.keys())
+    stocks_to_process = list(price_store.current().symbols)
     print(f"Fetching history for {len(stocks_to_process)} stocks...")
     
-    success_count = 0
-    for i, symbol in enumerate(stocks_to_process):
-        # Rate limit friendly logging
-        if i % 10 == 0:
-            print(f"Processing {i}/{len(stocks_to_process)}...")
-            
-        if update_single_stock_history(symbol):
-            success_count += 1
-            
-        # Small sleep to be nice to yfinance/upstream
-        time.sleep(0.5)
-        
-    print(f"[{now_kst()}] History Job Completed. Updated {success_count}/{len(stocks_to_process)} stocks in Supabase.")
+    # Incremental: only fetch candles from the latest stored date onwards
+    latest_times = get_latest_history_times(stocks_to_process)
+    print(f"{len(latest_times)} stocks already have history; fetching deltas only for those.")
+
+    # Parallel fetch (bounded by the Naver client's per-host limits) feeding
+    # coalesced multi-symbol upserts, checkpointed per KST day.
+    result = run_history_pipeline(stocks_to_process,
+                                  lambda symbol: fetch_stock_history(symbol, since=latest_times.get(symbol)),
+                                  run_date=now_kst().strftime("%Y-%m-%d"))
+    success_count = result.resumed + result.written
+    print(f"[{now_kst()}] History Job Completed. Updated {success_count}/{result.total} stocks in Supabase "
+          f"({result.rows} rows in {result.upserts} upserts, {len(result.empty)} empty, {len(result.failed)} failed).")
 
 def update_single_stock_history(symbol: str) -> bool:
     success, _ = update_single_stock_history_v2(symbol)
@@ -992,27 +1093,16 @@ def update_single_stock_history_v2(symbol: str) -> (bool, str):
         return False, msg
 
     try:
-        history_data = fetch_stock_history(symbol)
+        since = get_latest_history_times([symbol]).get(symbol)
+        history_data = fetch_stock_history(symbol, since=since)
         if not history_data:
             msg = f"Naver returned no data for {symbol}."
             print(f"Error for {symbol}: {msg}")
             return False, msg
             
-        # Prepare rows for Supabase insertion
-        rows = []
-        for item in history_data:
-            rows.append({
-                "symbol": symbol,
-                "time": item["time"],
-                "open": item["open"],
-                "high": item["high"],
-                "low": item["low"],
-                "close": item["close"],
-                "volume": item.get("volume", 0)
-            })
-        
         # Upsert to prevent duplicate errors
-        supabase.table("stock_history").upsert(rows, on_conflict="symbol,time").execute()
+        rows = to_history_rows(symbol, history_data)
+        upsert_history_rows(rows)
         print(f"Successfully updated history for {symbol} ({len(rows)} rows).")
         return True, ""
     except Exception as e:
@@ -1020,70 +1110,59 @@ def update_single_stock_history_v2(symbol: str) -> (bool, str):
         print(msg)
         return False, msg
 
-def process_search_requests():
-    """
-    Check RTDB for pending search requests.
-    path: search_requests/{uid}
-    """
+def handle_search_request(uid: str, data):
+    """Process a single search_requests/{uid} entry if it is pending."""
+    if not (isinstance(data, dict) and data.get('status') == 'pending'):
+        return
     ref = rtdb_admin.reference('search_requests')
-    requests = ref.get()
+    query = data.get('query', '').strip()
+    print(f"[{now_kst()}] Processing Search request for user {uid}: query='{query}'")
     
-    if not requests:
-        return
-
-    for uid, data in requests.items():
-        if isinstance(data, dict) and data.get('status') == 'pending':
-            query = data.get('query', '').strip()
-            print(f"[{now_kst()}] Processing Search request for user {uid}: query='{query}'")
-            
-            try:
-                import requests as py_requests
-                results = []
-                if query:
-                    # Naver Unified Search API (Stock target)
-                    url = f"https://ac.stock.naver.com/ac?q={query}&target=stock"
-                    headers = {"User-Agent": "Mozilla/5.0"}
-                    
-                    resp = py_requests.get(url, headers=headers, timeout=5)
-                    if resp.status_code == 200:
-                        search_data = resp.json()
-                        items = search_data.get('items', [])
-                        
-                        # Naver returns a list of result objects
-                        for item in items:
-                            # Map Naver fields to our internal format
-                            # KR: typeCode (KOSPI/KOSDAQ), nationCode (KOR)
-                            # US: typeCode (NASDAQ/NYSE/AMEX), nationCode (USA)
-                            nation = item.get('nationCode', 'KOR')
-                            market_type = 'KR' if nation == 'KOR' else 'US'
-                            
-                            results.append({
-                                'symbol': item.get('code'),
-                                'name': item.get('name'),
-                                'market': item.get('typeCode'),
-                                'type': market_type
-                            })
-                    else:
-                        print(f"Warning: Naver search API returned HTTP {resp.status_code}")
-
-                # Update Results and Status
-                rtdb_admin.reference(f'search_results/{uid}').set({
-                    'results': results[:20], # UI limit
-                    'query': query,
-                    'updatedAt': now_kst().isoformat()
-                })
-                ref.child(uid).update({
-                    'status': 'completed',
-                    'completedAt': now_kst().isoformat()
-                })
-                print(f"[{now_kst()}] Completed Search request for user {uid}: found {len(results)} items.")
+    try:
+        results = []
+        if query:
+            # Naver Unified Search API (Stock target)
+            url = f"https://ac.stock.naver.com/ac?q={query}&target=stock"
+            resp = get_client().get(url, timeout=5)
+            if resp.status_code == 200:
+                search_data = resp.json()
+                items = search_data.get('items', [])
                 
-            except Exception as e:
-                print(f"Error processing Search request for {uid}: {e}")
-                ref.child(uid).update({
-                    'status': 'error',
-                    'error': str(e)
-                })
+                # Naver returns a list of result objects
+                for item in items:
+                    # Map Naver fields to our internal format
+                    # KR: typeCode (KOSPI/KOSDAQ), nationCode (KOR)
+                    # US: typeCode (NASDAQ/NYSE/AMEX), nationCode (USA)
+                    nation = item.get('nationCode', 'KOR')
+                    market_type = 'KR' if nation == 'KOR' else 'US'
+                    
+                    results.append({
+                        'symbol': item.get('code'),
+                        'name': item.get('name'),
+                        'market': item.get('typeCode'),
+                        'type': market_type
+                    })
+            else:
+                print(f"Warning: Naver search API returned HTTP {resp.status_code}")
+
+        # Update Results and Status
+        rtdb_admin.reference(f'search_results/{uid}').set({
+            'results': results[:20], # UI limit
+            'query': query,
+            'updatedAt': now_kst().isoformat()
+        })
+        ref.child(uid).update({
+            'status': 'completed',
+            'completedAt': now_kst().isoformat()
+        })
+        print(f"[{now_kst()}] Completed Search request for user {uid}: found {len(results)} items.")
+        
+    except Exception as e:
+        print(f"Error processing Search request for {uid}: {e}")
+        ref.child(uid).update({
+            'status': 'error',
+            'error': str(e)
+        })
 
 def record_ranking_history():
     """
@@ -1091,7 +1170,8 @@ def record_ranking_history():
     Run every hour.
     """
     print(f"[{now_kst()}] Recording ranking history...")
-    if not latest_snapshot:
+    prices = price_store.current()
+    if not prices:
         print("Latest snapshot empty. Skipping ranking history.")
         return
 
@@ -1100,15 +1180,16 @@ def record_ranking_history():
         users_ref = firestore_db.collection("users")
         users_docs = users_ref.stream()
         
-        user_data_map = {}
+        builder = PositionBookBuilder()
+        balances = []
+        used_credits = []
+        stored_values = []
         for doc in users_docs:
             data = doc.to_dict()
-            user_data_map[doc.id] = {
-                'balance': data.get('balance', 0),
-                'usedCredit': data.get('usedCredit', 0),
-                'portfolio_value': 0,
-                'short_initial_value': 0
-            }
+            builder.add_user(doc.id)
+            balances.append(data.get('balance', 0))
+            used_credits.append(data.get('usedCredit', 0))
+            stored_values.append(data.get('totalAssetValue'))
             
         # 2. Fetch all portfolios
         portfolios = firestore_db.collection_group("portfolio").stream()
@@ -1116,61 +1197,32 @@ def record_ranking_history():
             # UID is the grandparent of the portfolio item document
             # Path: users/{uid}/portfolio/{symbol}
             uid = doc.reference.parent.parent.id
-            if uid not in user_data_map:
+            if not builder.has_user(uid):
                 continue
             
             data = doc.to_dict()
-            symbol = doc.id
-            quantity = data.get('quantity', 0)
-            
-            if quantity != 0:
-                stock_info = latest_snapshot.get(symbol)
-                if stock_info:
-                    # Handle USD conversion
-                    current_price = stock_info.price
-                    if stock_info.currency == 'USD':
-                        current_price *= latest_exchange_rate
-                        
-                    user_data_map[uid]['portfolio_value'] += quantity * current_price
-                    
-                    if quantity < 0:
-                        # Use absolute value of quantity * averagePrice for short initial value (margin)
-                        # averagePrice is stored in KRW in this app
-                        avg_price = data.get('averagePrice', 0)
-                        user_data_map[uid]['short_initial_value'] += abs(quantity) * avg_price
+            # averagePrice is stored in KRW in this app
+            builder.add_position(uid, doc.id, data.get('quantity', 0), data.get('averagePrice', 0))
         
-        # 3. Calculate total assets (Equity) and prepare for ranking
-        ranking_list = []
-        batch = firestore_db.batch()
+        # 3. Calculate total assets (Equity) and ranks in one vectorized pass
+        # Equity = Cash + LongValue - CurrentShortValue - LongDebt
+        # Cash = balance + short_initial_value (since proceeds are held)
+        # LongDebt = usedCredit - short_initial_value
+        book = builder.build()
+        symbol_prices = prices.krw_prices_for(book.symbols, latest_exchange_rate)
+        result = compute_equity(book, book.position_prices(symbol_prices), balances, used_credits)
         
-        for uid, data in user_data_map.items():
-            # Corrected Equity Formula:
-            # Equity = Cash + LongValue - CurrentShortValue - LongDebt
-            # Cash = balance + short_initial_value (since proceeds are held)
-            # LongDebt = usedCredit - short_initial_value
-            # Equity = (balance + short_initial_value) + portfolio_value - (usedCredit - short_initial_value)
-            # where portfolio_value = LongValue - CurrentShortValue
-            equity = data['balance'] + data['portfolio_value'] - (data['usedCredit'] - data['short_initial_value']) + data['short_initial_value']
-            
-            # Update Firestore totalAssetValue for real-time consistency
+        # Update Firestore totalAssetValue for real-time consistency,
+        # skipping users whose stored value already matches
+        writer = BulkWriter(firestore_db)
+        for uid, equity, stored in zip(result.uids, result.equity.tolist(), stored_values):
             user_ref = firestore_db.collection("users").document(uid)
-            batch.update(user_ref, {"totalAssetValue": int(equity)})
-            
-            ranking_list.append({
-                'uid': uid,
-                'equity': equity
-            })
-            
-        # Execute Firestore batch update
-        try:
-            batch.commit()
-            print(f"[{now_kst()}] Updated totalAssetValue for {len(user_data_map)} users in Firestore.")
-        except Exception as e:
-            print(f"Error committing totalAssetValue batch: {e}")
+            writer.update(user_ref, {"totalAssetValue": int(equity)},
+                          current={"totalAssetValue": stored}, skip_unchanged=True)
+        write_result = writer.flush()
+        print(f"[{now_kst()}] Updated totalAssetValue in Firestore: {write_result.written} written, "
+              f"{write_result.skipped} unchanged, {write_result.failed} failed ({write_result.chunks} batches).")
             
-        # 4. Sort by equity descending
-        ranking_list.sort(key=lambda x: x['equity'], reverse=True)
-        
         # 1. Fetch user comments from RTDB
         user_comments = {}
         try:
@@ -1184,12 +1236,12 @@ def record_ranking_history():
         # 2. Assign ranks and prepare rows for Supabase
         rows = []
         recorded_at = now_kst().isoformat()
-        for i, item in enumerate(ranking_list):
-            uid = item['uid']
+        for row in result.order().tolist():
+            uid = result.uids[row]
             rows.append({
                 'uid': uid,
-                'total_assets': int(item['equity']),
-                'rank': i + 1,
+                'total_assets': int(result.equity[row]),
+                'rank': int(result.rank[row]),
                 'recorded_at': recorded_at,
                 'comment': user_comments.get(uid, "")
             })
@@ -1206,65 +1258,65 @@ def record_ranking_history():
     except Exception as e:
         print(f"Error in record_ranking_history: {e}")
 
-def process_history_requests():
-    """
-    Check RTDB for pending history fetch requests.
-    path: history_requests/{symbol}
-    """
-    ref = rtdb_admin.reference('history_requests')
-    requests = ref.get()
-    
-    if not requests:
+def handle_history_request(symbol: str, data):
+    """Process a single history_requests/{symbol} entry if it is pending."""
+    if data is None:
         return
-
-    for symbol, data in requests.items():
-        # data might be a boolean True or a dict with status
+    ref = rtdb_admin.reference('history_requests')
+    # data might be a boolean True or a dict with status
+    status = 'pending'
+    if isinstance(data, dict):
+        status = data.get('status', 'pending')
+    elif data == True:
         status = 'pending'
-        if isinstance(data, dict):
-            status = data.get('status', 'pending')
-        elif data == True:
-            status = 'pending'
-            
-        if status == 'pending':
-            print(f"[{now_kst()}] Processing History request for symbol: {symbol}")
-            try:
-                # Reuse the existing update_single_stock_history
-                success, error_msg = update_single_stock_history_v2(symbol)
-                if success:
-                    ref.child(symbol).set({
-                        'status': 'completed',
-                        'updatedAt': now_kst().isoformat()
-                    })
-                    print(f"[{now_kst()}] Completed History request for: {symbol}")
-                else:
-                    ref.child(symbol).update({
-                        'status': 'error',
-                        'error': error_msg or 'Fetch returned no data or failed'
-                    })
-                    print(f"[{now_kst()}] Failed History request for {symbol}: {error_msg}")
-            except Exception as e:
-                print(f"Error processing History request for {symbol}: {e}")
+        
+    if status == 'pending':
+        print(f"[{now_kst()}] Processing History request for symbol: {symbol}")
+        try:
+            # Reuse the existing update_single_stock_history
+            success, error_msg = update_single_stock_history_v2(symbol)
+            if success:
+                ref.child(symbol).set({
+                    'status': 'completed',
+                    'updatedAt': now_kst().isoformat()
+                })
+                print(f"[{now_kst()}] Completed History request for: {symbol}")
+            else:
                 ref.child(symbol).update({
                     'status': 'error',
-                    'error': str(e)
+                    'error': error_msg or 'Fetch returned no data or failed'
                 })
+                print(f"[{now_kst()}] Failed History request for {symbol}: {error_msg}")
+        except Exception as e:
+            print(f"Error processing History request for {symbol}: {e}")
+            ref.child(symbol).update({
+                'status': 'error',
+                'error': str(e)
+            })
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Stock updater scheduler for RTDB")
-    parser.add_argument("--force", action="store_true",
-                        help="Fetch and sync once immediately regardless of market hours, then exit.")
-    parser.add_argument("--daily-job", action="store_true",
-                        help="Run the daily interest/liquidation job immediately, then exit.")
-    parser.add_argument("--daily-chart", action="store_true",
-                        help="Run the history fetch job immediately, then exit.")
-    args = parser.parse_args()
-
-    if args.force:
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("run", help="Run the scheduler (default).")
+    commands.add_parser("fetch", help="Fetch and sync once regardless of market hours, then exit.")
+    commands.add_parser("daily-job", help="Run the daily interest/liquidation job, then exit.")
+    commands.add_parser("daily-chart", help="Run the history fetch job, then exit.")
+    # Flag spellings kept for existing cron entries and scripts
+    parser.add_argument("--force", dest="command", action="store_const", const="fetch", help=argparse.SUPPRESS)
+    parser.add_argument("--daily-job", dest="command", action="store_const", const="daily-job", help=argparse.SUPPRESS)
+    parser.add_argument("--daily-chart", dest="command", action="store_const", const="daily-chart", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Each command only touches the clients its jobs use: Firebase is set up
+    # on import, Supabase and the LLM SDKs on first use.
+    if args.command == "fetch":
         run_once_force()
-    elif args.daily_job:
+    elif args.command == "daily-job":
         run_daily_job_now()
-    elif args.daily_chart:
+    elif args.command == "daily-chart":
         history_job()
     else:
         start_scheduler()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+-- Run this in Supabase SQL Editor
+-- Latest stored candle date per symbol, used by the incremental daily history job.
+CREATE OR REPLACE FUNCTION stock_history_latest(symbols TEXT[])
+RETURNS TABLE (symbol TEXT, last_time TEXT)
+LANGUAGE sql STABLE AS $$
+    SELECT h.symbol, MAX(h.time)::TEXT
+    FROM stock_history h
+    WHERE h.symbol = ANY(symbols)
+    GROUP BY h.symbol;
+$$;
+
+-- Makes the grouped MAX(time) lookup an index scan
+CREATE INDEX IF NOT EXISTS idx_stock_history_symbol_time ON stock_history(symbol, time DESC);
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+# symbol -> Naver exchange suffix ('.O', '.N', '.A', '', '.K') that last resolved.
+CACHE_PATH = os.getenv(
+    'SUFFIX_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), 'us_suffix_cache.json')
+)
+
+
+class SuffixCache:
+    """
+    Persistent symbol -> resolved exchange suffix map for US tickers.
+    Lets the fetchers hit the right Naver reuters code on the first request
+    instead of probing every suffix each cycle.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self._data: Dict[str, str] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._data = {str(k): str(v) for k, v in data.items()}
+        except Exception as e:
+            print(f"Error loading suffix cache ({self.path}): {e}")
+
+    def get(self, symbol: str) -> Optional[str]:
+        with self._lock:
+            return self._data.get(symbol)
+
+    def ordered(self, symbol: str, suffixes: List[str]) -> List[str]:
+        """Return suffixes to probe, with the cached one (if any) first."""
+        cached = self.get(symbol)
+        if cached is None:
+            return list(suffixes)
+        return [cached] + [s for s in suffixes if s != cached]
+
+    def set(self, symbol: str, suffix: str):
+        with self._lock:
+            if self._data.get(symbol) != suffix:
+                self._data[symbol] = suffix
+                self._dirty = True
+
+    def invalidate(self, symbol: str):
+        with self._lock:
+            if self._data.pop(symbol, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """
+        Write to disk if anything changed (atomic replace). The lock is held
+        throughout and each save writes its own temp file, so concurrent
+        savers never interleave into one file.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(self.path) or '.',
+                                                 prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                                                 delete=False) as f:
+                    tmp_path = f.name
+                    json.dump(self._data, f, ensure_ascii=False, sort_keys=True)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except Exception as e:
+                print(f"Error saving suffix cache ({self.path}): {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+suffix_cache = SuffixCache()
+
+def get_suffix_cache() -> SuffixCache:
+    return suffix_cache
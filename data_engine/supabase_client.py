@@ -1,5 +1,5 @@
 import os
-from supabase import create_client, Client
+import threading
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
@@ -10,7 +10,15 @@ key: str = os.environ.get("SUPABASE_KEY")
 if not url or not key:
     print("Warning: SUPABASE_URL or SUPABASE_KEY not found in environment variables.")
 
-supabase: Client = create_client(url, key) if url and key else None
+# The supabase package is slow to import; only jobs that touch Supabase pay for it.
+supabase = None
+_lock = threading.Lock()
 
 def get_supabase():
+    global supabase
+    if supabase is None and url and key:
+        with _lock:
+            if supabase is None:
+                from supabase import create_client
+                supabase = create_client(url, key)
     return supabase
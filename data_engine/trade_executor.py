@@ -4,6 +4,7 @@ from zoneinfo import ZoneInfo
 from firebase_admin import firestore, db as rtdb_admin
 from google.cloud.firestore_v1.base_transaction import BaseTransaction
 from firestore_client import db
+from holdings_index import record_position_change
 
 def buy_stock(uid: str, symbol: str, name: str, price: float, quantity: int, order_type: str = "MARKET", market: str = None, original_price: float = None, original_currency: str = "KRW"):
     """
@@ -79,6 +80,7 @@ def buy_stock(uid: str, symbol: str, name: str, price: float, quantity: int, ord
         transaction.update(user_ref, update_data)
 
         # Update Portfolio
+        record_position_change(transaction, symbol, current_qty, new_qty)
         if new_qty == 0:
             transaction.delete(portfolio_ref)
         else:
@@ -225,6 +227,7 @@ def sell_stock(uid: str, symbol: str, name: str, price: float, quantity: int, or
 
         # Update Portfolio
         new_qty = current_qty - quantity
+        record_position_change(transaction, symbol, current_qty, new_qty)
         if new_qty == 0:
             transaction.delete(portfolio_ref)
         else: